@@ -0,0 +1,265 @@
+# simplesync - persistent cache for file checksums
+#
+# Copyright 2010 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import os.path
+import time
+
+from syncdebug import *
+from utilio import *
+
+# filename of the cache file within the root directory
+CACHE_FILENAME = ".simplesynccache"
+
+# the cache is written to this file that replaces the cache file
+CACHE_TEMP_FILENAME = ".tmp" + CACHE_FILENAME
+
+# default maximum count of cached checksums
+CACHE_MAX_ENTRIES = 500000
+
+# files modified less than this count of seconds before they are
+# hashed aren't cached. They might change again within the same tick
+# of the modification time without changing their key.
+CACHE_RACY_SECONDS = 1.0
+
+def get_mtime_ns(statresult):
+    """
+    returns the modification time of a stat result in nanoseconds
+    Parameters:
+    - statresult
+      result of os.stat()
+    Returns:
+    - modification time in nanoseconds
+    """
+    result = getattr(statresult, "st_mtime_ns", None)
+    if result == None:
+        result = int(statresult.st_mtime * 1000000000)
+    return result
+
+def get_cache_key(statresult):
+    """
+    creates the key that identifies an unchanged file
+    Parameters:
+    - statresult
+      result of os.stat() for the file
+    Returns:
+    - tuple of inode, size and modification time in nanoseconds
+    """
+    return (statresult.st_ino, statresult.st_size, get_mtime_ns(statresult))
+
+class ChecksumCache(object):
+    """
+    caches the checksums of the files below a root directory, so
+    that unchanged files are not hashed again
+    """
+
+    def __init__(self, root, maxentries=CACHE_MAX_ENTRIES):
+        """
+        creates an instance
+        Parameters:
+        - root
+          root directory to be synced
+        - maxentries
+          maximum count of cached checksums
+        """
+        self._root = root
+        self._maxentries = maxentries
+        self._dict = {}
+        self._tick = 0
+        self._seen = set()
+        self._scanned = set()
+        self._modified = False
+        self._hits = 0
+        self._misses = 0
+        self.load()
+
+    def get_hits(self):
+        """
+        Returns:
+        - count of checksums taken from the cache
+        """
+        return self._hits
+
+    def get_misses(self):
+        """
+        Returns:
+        - count of checksums that had to be computed
+        """
+        return self._misses
+
+    def lookup(self, filepath, statresult):
+        """
+        looks up the checksum of a file
+        Parameters:
+        - filepath
+          absolute path of the file
+        - statresult
+          result of os.stat() for the file
+        Returns:
+        - cached checksum or None if the file is unknown or changed
+        """
+        result = None
+        entry = self._dict.get(filepath)
+        if entry != None:
+            (key, checksum, tick) = entry
+            if key == get_cache_key(statresult):
+                self._tick = self._tick + 1
+                self._dict[filepath] = (key, checksum, self._tick)
+                self._seen.add(filepath)
+                result = checksum
+            else:
+                # the file was modified, so the entry is stale
+                del self._dict[filepath]
+                self._modified = True
+        if result != None:
+            self._hits = self._hits + 1
+        else:
+            self._misses = self._misses + 1
+        return result
+
+    def store(self, filepath, statresult, checksum):
+        """
+        stores the checksum of a file. Files that were modified just
+        before are not stored.
+        Parameters:
+        - filepath
+          absolute path of the file
+        - statresult
+          result of os.stat() for the file
+        - checksum
+          checksum to store
+        """
+        if checksum != None and not "\n" in filepath:
+            self._seen.add(filepath)
+            if statresult.st_mtime >= time.time() - CACHE_RACY_SECONDS:
+                debug("racy modification time: %s", filepath)
+                return
+            key = get_cache_key(statresult)
+            self._tick = self._tick + 1
+            self._dict[filepath] = (key, checksum, self._tick)
+            self._modified = True
+
+    def get_checksum(self, filepath, statresult, checksumfunction):
+        """
+        returns the checksum of a file and computes it only if it
+        is not cached
+        Parameters:
+        - filepath
+          absolute path of the file
+        - statresult
+          result of os.stat() for the file
+        - checksumfunction
+          function to compute the checksum of a file path
+        Returns:
+        - checksum of the file
+        """
+        result = self.lookup(filepath, statresult)
+        if result == None:
+            result = checksumfunction(filepath)
+            self.store(filepath, statresult, result)
+        return result
+
+    def remove(self, filepath):
+        """
+        removes the entry of a file
+        Parameters:
+        - filepath
+          absolute path of the file
+        """
+        if filepath in self._dict:
+            del self._dict[filepath]
+            self._modified = True
+
+    def mark_scanned(self, dirpath):
+        """
+        marks a directory whose files were all looked up. Entries of
+        files in the directory that weren't looked up since the cache
+        was loaded belong to removed files and are dropped on save.
+        Parameters:
+        - dirpath
+          absolute path of the scanned directory
+        """
+        self._scanned.add(os.path.normpath(dirpath))
+
+    def _prune(self):
+        """
+        drops the entries of removed files and the least recently used
+        entries if the cache exceeds its maximum size
+        """
+        if len(self._scanned) > 0:
+            for filepath in self._dict.keys():
+                if not filepath in self._seen and \
+                   os.path.normpath(os.path.dirname(filepath)) in self._scanned:
+                    del self._dict[filepath]
+                    self._modified = True
+        if len(self._dict) > self._maxentries:
+            entries = self._dict.items()
+            entries.sort(key=lambda item: item[1][2], reverse=True)
+            self._dict = dict(entries[:self._maxentries])
+            self._modified = True
+
+    def load(self):
+        """
+        loads the cache file
+        """
+        debug("entering ChecksumCache.load()")
+        self._dict = {}
+        f = open_file(self._root, CACHE_FILENAME, "r")
+        if f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 1 and fields[0].isdigit():
+                    # the first line contains the usage counter of the last save
+                    self._tick = int(fields[0])
+                elif len(fields) == 6:
+                    try:
+                        key = (int(fields[0]), int(fields[1]), int(fields[2]))
+                        tick = int(fields[3])
+                    except ValueError:
+                        continue
+                    self._dict[fields[5]] = (key, fields[4], tick)
+            f.close()
+        debug_value("entries", len(self._dict))
+        debug("exiting ChecksumCache.load()")
+
+    def save(self):
+        """
+        saves the cache file if it was modified
+        Returns:
+        - True:  cache was saved or unmodified
+        - False: cache could not be saved
+        """
+        debug("entering ChecksumCache.save()")
+        success = True
+        self._prune()
+        if self._modified:
+            # a new file replaces the cache, so a crash can't truncate it
+            f = open_file(self._root, CACHE_TEMP_FILENAME, "w")
+            if f:
+                f.write("%i\n" % self._tick)
+                for filepath, entry in self._dict.iteritems():
+                    ((inode, size, mtime), checksum, tick) = entry
+                    f.write("%i\t%i\t%i\t%i\t%s\t%s\n" % (inode, size, mtime,
+                            tick, checksum, filepath))
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+                os.rename(os.path.join(self._root, CACHE_TEMP_FILENAME),
+                          os.path.join(self._root, CACHE_FILENAME))
+                fsync_directory(self._root)
+                self._modified = False
+            else:
+                success = False
+        debug("exiting ChecksumCache.save()")
+        return success
@@ -13,18 +13,30 @@
 # GNU General Public License for more details.
 
 import hashlib
+import io
+import mmap
 import os
 import os.path
 import re
 import socket
 import stat
+import struct
 import sys
+import time
+import zlib
 
 from cStringIO import StringIO
+from threading import Lock
 
 from syncdebug import *
+from syncstats import *
 from utilio import *
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 GLOBAL_TAG = "fileproperty"
 NAME_TAG = "name"
 PATH_TAG = "path"
@@ -40,8 +52,80 @@ END_TAG = "</simplesyncmeta>"
 TYPE_FILE = "file"
 TYPE_DIRECTORY = "directory"
 
+# binary meta file format:
+#   header:  magic, version, record count, offset of the index
+#   records: length-prefixed records with length-prefixed fields
+#   index:   name -> record offset entries sorted by name. Properties
+#            with the same name are all stored as records, the index
+#            refers to the last of them.
+BINARY_MAGIC = "SSMB"
+BINARY_VERSION = 1
+BINARY_HEADER = "<4sBIQ"
+BINARY_RECORD_LENGTH = "<I"
+BINARY_FIELD_LENGTH = "<i"
+BINARY_INDEX_NAME_LENGTH = "<H"
+BINARY_INDEX_OFFSET = "<Q"
+
+# meta files of the legacy tag format start with this tag
+LEGACY_META_TAG = "<fileproperty>"
+
+# meta files are written to a temporary file with this prefix that
+# replaces the meta file. Server files start with ":::", so the
+# prefixed names can't collide with them.
+META_TEMP_PREFIX = ".tmp"
+
+# write-ahead journal of a meta file: the changes since the meta file
+# was saved. Format:
+#   header:  magic, version
+#   records: operation, CRC32 of the payload, length-prefixed payload
+# The payload of an update is a binary property record, the payload
+# of a removal is the name of the property.
+META_JOURNAL_PREFIX = ".journal"
+JOURNAL_MAGIC = "SSWL"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = "<4sB"
+JOURNAL_RECORD = "<cI"
+JOURNAL_UPDATE = "U"
+JOURNAL_REMOVE = "R"
+
+# algorithms to create checksums. MD5 checksums are stored without
+# a prefix to stay compatible to existing meta files. All other
+# checksums are stored as "<algorithm>:<hexdigest>".
+CHECKSUM_MD5 = "md5"
+CHECKSUM_SHA1 = "sha1"
+CHECKSUM_BLAKE2B = "blake2b"
+CHECKSUM_XXH64 = "xxh64"
+CHECKSUM_SEPARATOR = ":"
+CHECKSUM_BLOCKSIZE = 1024 * 1024
+
+checksum_algorithm = CHECKSUM_MD5
+checksum_blocksize = CHECKSUM_BLOCKSIZE
+
+# pattern to tokenize the nodes of a property string. Values never
+# contain "<" because they are escaped by escape_value().
+NODE_PATTERN = re.compile(r"<(\w+)>([^<]*)</\1>")
+
+# compiled formats of the binary meta file
+BINARY_RECORD_STRUCT = struct.Struct(BINARY_RECORD_LENGTH)
+BINARY_FIELD_STRUCT = struct.Struct(BINARY_FIELD_LENGTH)
+JOURNAL_HEADER_STRUCT = struct.Struct(JOURNAL_HEADER)
+JOURNAL_RECORD_STRUCT = struct.Struct(JOURNAL_RECORD)
+
+# name of the local host, determined once by get_local_hostname()
+local_hostname = None
+
 # utility functions
 
+def get_local_hostname():
+    """
+    Returns:
+    - name of the local host
+    """
+    global local_hostname
+    if local_hostname == None:
+        local_hostname = socket.gethostname()
+    return local_hostname
+
 def scan_tag(tag, tagstring):
     """
     extracts a substring that is enclosed by an tag from a string
@@ -84,15 +168,481 @@ def append_node(stringio, tagname, value):
         stringio.write("<")
         stringio.write(tagname)
         stringio.write(">")
-        stringio.write(value)
+        stringio.write(escape_value(value))
         stringio.write("</")
         stringio.write(tagname)
         stringio.write(">")
         result = stringio.getvalue()
 
+def escape_value(value):
+    """
+    escapes the characters of a value that would break the tags
+    Parameters:
+    - value
+      value to escape
+    Returns:
+    - escaped value
+    """
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    return value
+
+def unescape_value(value):
+    """
+    reverts escape_value()
+    Parameters:
+    - value
+      escaped value
+    Returns:
+    - original value
+    """
+    if "&" in value:
+        value = value.replace("&lt;", "<").replace("&gt;", ">")
+        value = value.replace("&amp;", "&")
+    return value
+
+def parse_property_string(propertystring):
+    """
+    extracts all nodes of a property string in a single scan
+    Parameters:
+    - propertystring
+      property string as created by FileProperty.get_property_string()
+    Returns:
+    - dictionary that maps the tag names to their unescaped values
+      or None if the string doesn't contain a property
+    """
+    starttag = "<" + GLOBAL_TAG + ">"
+    endtag = "</" + GLOBAL_TAG + ">"
+    start = propertystring.find(starttag)
+    if start == -1:
+        return None
+    end = propertystring.find(endtag, start)
+    if end == -1:
+        return None
+    result = {}
+    for (tag, value) in NODE_PATTERN.findall(propertystring, start + len(starttag), end):
+        result[tag] = unescape_value(value)
+    return result
+
+def pack_property(fileproperty):
+    """
+    packs a file property into a binary record
+    Parameters:
+    - fileproperty
+      file property to pack
+    Returns:
+    - binary record including its length prefix
+    """
+    stringio = StringIO()
+    for value in fileproperty.get_property_values():
+        if value == None:
+            stringio.write(struct.pack(BINARY_FIELD_LENGTH, -1))
+        else:
+            stringio.write(struct.pack(BINARY_FIELD_LENGTH, len(value)))
+            stringio.write(value)
+    record = stringio.getvalue()
+    return struct.pack(BINARY_RECORD_LENGTH, len(record)) + record
+
+def unpack_property(content, offset):
+    """
+    unpacks a binary record into a file property
+    Parameters:
+    - content
+      buffer containing the binary meta data
+    - offset
+      offset of the record's length prefix
+    Returns:
+    - tuple of the unpacked file property and the offset of the
+      next record
+    """
+    unpack_field = BINARY_FIELD_STRUCT.unpack_from
+    fieldsize = BINARY_FIELD_STRUCT.size
+    (length,) = BINARY_RECORD_STRUCT.unpack_from(content, offset)
+    pos = offset + BINARY_RECORD_STRUCT.size
+    end = pos + length
+    values = []
+    while pos < end:
+        (fieldlength,) = unpack_field(content, pos)
+        pos = pos + fieldsize
+        if fieldlength < 0:
+            values.append(None)
+        else:
+            values.append(content[pos:pos + fieldlength])
+            pos = pos + fieldlength
+    fileproperty = FileProperty()
+    fileproperty.set_property_values(values)
+    return (fileproperty, end)
+
+def is_binary_meta(content):
+    """
+    checks if meta data is stored in the binary format
+    Parameters:
+    - content
+      content of a meta file
+    Returns:
+    - True:  content is in the binary format
+    - False: content is in the legacy tag format
+    """
+    return content[:len(BINARY_MAGIC)] == BINARY_MAGIC
+
+def is_meta_file(filepath):
+    """
+    checks if a file is a meta file in one of the formats
+    Parameters:
+    - filepath
+      path of the file
+    Returns:
+    - True:  file is a meta file
+    - False: file has a different content
+    """
+    f = open(filepath, "rb")
+    try:
+        content = f.read(len(LEGACY_META_TAG))
+    finally:
+        f.close()
+    return is_binary_meta(content) or content == LEGACY_META_TAG
+
+def read_meta_index(content):
+    """
+    reads the index of binary meta data
+    Parameters:
+    - content
+      buffer containing the binary meta data
+    Returns:
+    - dictionary that maps names to record offsets
+    """
+    result = {}
+    (magic, version, count, indexoffset) = struct.unpack_from(BINARY_HEADER, content, 0)
+    if version != BINARY_VERSION:
+        debug_error("unsupported meta version: %i", version)
+        return result
+    namesize = struct.calcsize(BINARY_INDEX_NAME_LENGTH)
+    offsetsize = struct.calcsize(BINARY_INDEX_OFFSET)
+    pos = indexoffset
+    # the index ends with the content, count is the count of records
+    while pos < len(content):
+        (namelength,) = struct.unpack_from(BINARY_INDEX_NAME_LENGTH, content, pos)
+        pos = pos + namesize
+        name = content[pos:pos + namelength]
+        pos = pos + namelength
+        (offset,) = struct.unpack_from(BINARY_INDEX_OFFSET, content, pos)
+        pos = pos + offsetsize
+        result[name] = offset
+    return result
+
+def parse_binary_meta(content):
+    """
+    parses meta data in the binary format
+    Parameters:
+    - content
+      buffer containing the binary meta data
+    Returns:
+    - list of file properties
+    """
+    propertylist = []
+    (magic, version, count, indexoffset) = struct.unpack_from(BINARY_HEADER, content, 0)
+    if version != BINARY_VERSION:
+        debug_error("unsupported meta version: %i", version)
+        return propertylist
+    pos = struct.calcsize(BINARY_HEADER)
+    for i in range(count):
+        (fileproperty, pos) = unpack_property(content, pos)
+        propertylist.append(fileproperty)
+    return propertylist
+
+def parse_legacy_meta(content):
+    """
+    parses meta data in the legacy tag format
+    Parameters:
+    - content
+      content of the meta file
+    Returns:
+    - list of file properties
+    """
+    propertylist = []
+    pos = 0
+    while pos < len(content):
+        start = content.find("<fileproperty>", pos)
+        end = content.find("</fileproperty>", start)
+        if start != -1 and end != -1:
+            end = end + len("</fileproperty>")
+            substr = content[start:end]
+            fileproperty = FileProperty()
+            fileproperty.set_property_string(substr)
+            propertylist.append(fileproperty)
+            pos = end
+        else:
+            pos = len(content) + 1
+    return propertylist
+
+def debug_property(fileproperty):
+    """
+    debugs the values of a file property at detail level
+    Parameters:
+    - fileproperty
+      file property to debug
+    """
+    debug_value("fileproperty.name", fileproperty.get_name(), DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.path", fileproperty.get_path(), DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.hostname", fileproperty.get_hostname(),
+                DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.timestamp", fileproperty.get_timestamp(),
+                DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.checksum", fileproperty.get_checksum(),
+                DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.state", fileproperty.get_state(), DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.type", fileproperty.get_type(), DEBUG_LEVEL_DETAIL)
+    debug_value("fileproperty.encrypted", fileproperty.get_encrypted(),
+                DEBUG_LEVEL_DETAIL)
+    debug_detail("--")
+
+def get_journal_filename(filename):
+    """
+    Parameters:
+    - filename
+      name of a meta file
+    Returns:
+    - name of the journal of the meta file
+    """
+    return META_JOURNAL_PREFIX + filename
+
+def has_journal(directory, filename):
+    """
+    Parameters:
+    - directory
+      directory of the meta file
+    - filename
+      name of the meta file
+    Returns:
+    - True:  changes were journaled since the meta file was saved
+    - False: meta file is complete
+    """
+    return os.path.exists(os.path.join(directory, get_journal_filename(filename)))
+
+def read_journal(directory, filename):
+    """
+    reads the records of the journal of a meta file. A record that was
+    only partly written by an interrupted sync ends the journal.
+    Parameters:
+    - directory
+      directory of the meta file
+    - filename
+      name of the meta file
+    Returns:
+    - list of tuples of operation and file property or name
+    """
+    result = []
+    f = open_file(directory, get_journal_filename(filename), "rb")
+    if f == None:
+        return result
+    try:
+        content = f.read()
+    finally:
+        f.close()
+    if len(content) < JOURNAL_HEADER_STRUCT.size:
+        return result
+    (magic, version) = JOURNAL_HEADER_STRUCT.unpack_from(content, 0)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        debug_error("invalid meta journal: %s", filename)
+        return result
+    pos = JOURNAL_HEADER_STRUCT.size
+    headersize = JOURNAL_RECORD_STRUCT.size + BINARY_RECORD_STRUCT.size
+    while pos + headersize <= len(content):
+        (operation, crc) = JOURNAL_RECORD_STRUCT.unpack_from(content, pos)
+        payloadpos = pos + JOURNAL_RECORD_STRUCT.size
+        (length,) = BINARY_RECORD_STRUCT.unpack_from(content, payloadpos)
+        end = payloadpos + BINARY_RECORD_STRUCT.size + length
+        if end > len(content):
+            break
+        payload = content[payloadpos:end]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            break
+        if operation == JOURNAL_UPDATE:
+            (fileproperty, nextpos) = unpack_property(payload, 0)
+            result.append((operation, fileproperty))
+        elif operation == JOURNAL_REMOVE:
+            result.append((operation, payload[BINARY_RECORD_STRUCT.size:]))
+        else:
+            break
+        pos = end
+    debug_value("journal records", len(result))
+    return result
+
+def replay_journal(directory, filename, propertylist):
+    """
+    applies the journal of a meta file to its properties. The records
+    are applied in order like the changes were applied to the list in
+    memory: an update replaces the last property with the same name or
+    is appended, a removal removes it. Other properties, including
+    properties with the same name or without a name, are kept.
+    Parameters:
+    - directory
+      directory of the meta file
+    - filename
+      name of the meta file
+    - propertylist
+      list of the properties of the meta file
+    Returns:
+    - list of the properties including the journaled changes
+    """
+    records = read_journal(directory, filename)
+    if len(records) == 0:
+        return propertylist
+    result = list(propertylist)
+    positions = {}
+    for index in range(len(result)):
+        positions[result[index].get_name()] = index
+    for (operation, value) in records:
+        if operation == JOURNAL_UPDATE:
+            name = value.get_name()
+            if name in positions:
+                result[positions[name]] = value
+            else:
+                positions[name] = len(result)
+                result.append(value)
+        elif value in positions:
+            result[positions.pop(value)] = None
+    return [ fileproperty for fileproperty in result if fileproperty != None ]
+
+class MetaJournal(object):
+    """
+    write-ahead journal of a meta file. Changes are appended and synced
+    to disk as the actions complete, so an interrupted sync doesn't
+    lose them. Saving the meta file by compact() empties the journal.
+    """
+
+    def __init__(self, directory, filename):
+        """
+        creates an instance
+        Parameters:
+        - directory
+          directory of the meta file
+        - filename
+          name of the meta file
+        """
+        self._directory = directory
+        self._filename = filename
+        self._fd = None
+        self._lock = Lock()
+
+    def get_path(self):
+        """
+        Returns:
+        - path of the journal file
+        """
+        return os.path.join(self._directory, get_journal_filename(self._filename))
+
+    def _write(self, operation, payload):
+        """
+        appends a record
+        Parameters:
+        - operation
+          JOURNAL_UPDATE or JOURNAL_REMOVE
+        - payload
+          length-prefixed payload of the record
+        """
+        record = (JOURNAL_RECORD_STRUCT.pack(operation,
+                                             zlib.crc32(payload) & 0xffffffff) +
+                  payload)
+        self._lock.acquire()
+        try:
+            try:
+                if self._fd == None:
+                    path = self.get_path()
+                    self._fd = open(path, "ab")
+                    if self._fd.tell() == 0:
+                        self._fd.write(JOURNAL_HEADER_STRUCT.pack(JOURNAL_MAGIC,
+                                                                  JOURNAL_VERSION))
+                        self._fd.flush()
+                        os.fsync(self._fd.fileno())
+                        # the new journal must survive a crash, too
+                        fsync_directory(self._directory)
+                self._fd.write(record)
+                self._fd.flush()
+                os.fsync(self._fd.fileno())
+            except (IOError, OSError), e:
+                debug_error("unable to write journal %s: %s", self.get_path(), e)
+        finally:
+            self._lock.release()
+
+    def append(self, fileproperty):
+        """
+        journals a new or changed property
+        Parameters:
+        - fileproperty
+          changed file property
+        """
+        self._write(JOURNAL_UPDATE, pack_property(fileproperty))
+
+    def remove(self, name):
+        """
+        journals a removed property
+        Parameters:
+        - name
+          name of the removed property
+        """
+        self._write(JOURNAL_REMOVE, BINARY_RECORD_STRUCT.pack(len(name)) + name)
+
+    def close(self):
+        """
+        syncs and closes the journal file
+        """
+        self._lock.acquire()
+        try:
+            self._close()
+        finally:
+            self._lock.release()
+
+    def _close(self):
+        """
+        syncs and closes the journal file. The lock must be held.
+        """
+        if self._fd != None:
+            try:
+                self._fd.flush()
+                os.fsync(self._fd.fileno())
+            except (IOError, OSError), e:
+                debug_error("unable to sync journal %s: %s", self.get_path(), e)
+            self._fd.close()
+            self._fd = None
+
+    def compact(self, propertylist):
+        """
+        saves the meta file and removes the journal
+        Parameters:
+        - propertylist
+          list of all properties
+        Returns:
+        - True:  meta file was saved
+        - False: meta file could not be saved, the journal is kept
+        """
+        self._lock.acquire()
+        try:
+            self._close()
+            if propertylist:
+                success = save_property_file(self._directory, self._filename,
+                                             propertylist)
+            else:
+                # save_property_file() keeps the meta file of empty lists
+                success = True
+            if success:
+                try:
+                    os.remove(self.get_path())
+                except OSError:
+                    pass
+        finally:
+            self._lock.release()
+        return success
+
 def load_property_file(directory, filename):
     """
-    loads a list of properties from a file
+    loads a list of properties from a file. Both the binary and
+    the legacy tag format are supported. Changes in the journal of
+    the file are applied.
     Parameters:
     - directory
       directory in which the file to load is located
@@ -106,42 +656,30 @@ def load_property_file(directory, filename):
     debug_value("filename", filename)
     propertylist = []
     content = None
-    f = open_file(directory, filename, "r")
+    f = open_file(directory, filename, "rb")
     if f:
-        stringio = StringIO()
-        for line in f.readlines():
-            stringio.write(line)
+        content = f.read()
         f.close()
-        content = stringio.getvalue()
     if content:
-        pos = 0
-        while pos < len(content):
-            start = content.find("<fileproperty>", pos)
-            end = content.find("</fileproperty>", start)
-            if start != -1 and end != -1:
-                end = end + len("</fileproperty>")
-                substr = content[start:end]
-                fileproperty = FileProperty()
-                fileproperty.set_property_string(substr)
-                name = fileproperty.get_name()
-                debug_value("fileproperty.name", fileproperty.get_name())
-                debug_value("fileproperty.path", fileproperty.get_path())
-                debug_value("fileproperty.hostname", fileproperty.get_hostname())
-                debug_value("fileproperty.timestamp", fileproperty.get_timestamp())
-                debug_value("fileproperty.checksum", fileproperty.get_checksum())
-                debug_value("fileproperty.state", fileproperty.get_state())
-                debug_value("fileproperty.type", fileproperty.get_type())
-                debug("--")
-                propertylist.append(fileproperty)
-                pos = end
-            else:
-                pos = len(content) + 1
-        debug("exiting load_property_file()")
+        if is_binary_meta(content):
+            debug("binary format")
+            propertylist = parse_binary_meta(content)
+        else:
+            debug("legacy format")
+            propertylist = parse_legacy_meta(content)
+    propertylist = replay_journal(directory, filename, propertylist)
+    if is_debug_enabled(DEBUG_LEVEL_DETAIL):
+        for fileproperty in propertylist:
+            debug_property(fileproperty)
+    debug("exiting load_property_file()")
     return propertylist
 
 def save_property_file(directory, filename, propertylist):
     """
-    saves a list of properties to a file
+    saves a list of properties to a file in the binary format.
+    Meta files in the legacy tag format are migrated by this. The
+    properties are written to a temporary file that replaces the file,
+    so an interrupted save keeps the previous file.
     Parameters:
     - directory
       directory in which the file should be saved
@@ -158,49 +696,223 @@ def save_property_file(directory, filename, propertylist):
     debug_value("filename", filename)
     success = False
     if propertylist:
-        f = open_file(directory, filename, "w")
+        tempname = META_TEMP_PREFIX + filename
+        f = open_file(directory, tempname, "wb")
         if f:
-            f.write(START_TAG)
+            offsets = {}
+            pos = struct.calcsize(BINARY_HEADER)
+            records = StringIO()
+            detailflag = is_debug_enabled(DEBUG_LEVEL_DETAIL)
             for p in propertylist:
-                debug_value("fileproperty.name", p.get_name())
-                debug_value("fileproperty.path", p.get_path())
-                debug_value("fileproperty.hostname", p.get_hostname())
-                debug_value("fileproperty.timestamp", p.get_timestamp())
-                debug_value("fileproperty.checksum", p.get_checksum())
-                debug_value("fileproperty.state", p.get_state())
-                debug_value("fileproperty.type", p.get_type())
-                debug_value("fileproperty.encrypted", p.get_encrypted())
-                debug("--")
-                f.write(p.get_property_string())
-            f.write(END_TAG)
+                if detailflag:
+                    debug_property(p)
+                record = pack_property(p)
+                offsets[p.get_name() or ""] = pos
+                records.write(record)
+                pos = pos + len(record)
+            index = StringIO()
+            names = offsets.keys()
+            names.sort()
+            for name in names:
+                index.write(struct.pack(BINARY_INDEX_NAME_LENGTH, len(name)))
+                index.write(name)
+                index.write(struct.pack(BINARY_INDEX_OFFSET, offsets[name]))
+            # the index has one entry per name, but every record is kept
+            f.write(struct.pack(BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION,
+                                len(propertylist), pos))
+            f.write(records.getvalue())
+            f.write(index.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
             f.close()
+            temppath = os.path.join(directory, tempname)
             flag = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
-            os.chmod(filename, flag)
+            os.chmod(temppath, flag)
+            os.rename(temppath, os.path.join(directory, filename))
+            fsync_directory(directory)
             success = True
         else:
             success = False
-    return success
     debug("exiting save_property_file()")
+    return success
+
+def get_checksum_algorithms():
+    """
+    Returns:
+    - list of the checksum algorithms available on this machine
+    """
+    result = [ CHECKSUM_MD5, CHECKSUM_SHA1 ]
+    if hasattr(hashlib, "blake2b"):
+        result.append(CHECKSUM_BLAKE2B)
+    if xxhash != None:
+        result.append(CHECKSUM_XXH64)
+    return result
+
+def set_checksum_algorithm(algorithm):
+    """
+    sets the algorithm to create new checksums
+    Parameters:
+    - algorithm
+      name of the algorithm
+    Returns:
+    - True:  algorithm was set
+    - False: algorithm is not available
+    """
+    global checksum_algorithm
+    result = False
+    if algorithm in get_checksum_algorithms():
+        checksum_algorithm = algorithm
+        result = True
+    return result
+
+def set_checksum_blocksize(blocksize):
+    """
+    sets the size of the blocks to read for creating checksums
+    Parameters:
+    - blocksize
+      block size in bytes
+    """
+    global checksum_blocksize
+    checksum_blocksize = max(4096, int(blocksize))
+
+def get_checksum_algorithm(checksum):
+    """
+    determines the algorithm that created a checksum
+    Parameters:
+    - checksum
+      checksum as stored in the checksum tag
+    Returns:
+    - name of the algorithm or None for no checksum
+    """
+    result = None
+    if checksum:
+        pos = checksum.find(CHECKSUM_SEPARATOR)
+        if pos == -1:
+            result = CHECKSUM_MD5
+        else:
+            result = checksum[:pos]
+    return result
 
-def create_checksum(filename):
+def create_hasher(algorithm):
     """
-    creates a checksum for a file
+    creates a hash object
+    Parameters:
+    - algorithm
+      name of the algorithm
+    Returns:
+    - hash object with update() and hexdigest()
+    """
+    if algorithm == CHECKSUM_XXH64:
+        return xxhash.xxh64()
+    if algorithm == CHECKSUM_BLAKE2B:
+        return hashlib.blake2b()
+    return hashlib.new(algorithm)
+
+def create_checksum(filename, algorithm = None, blocksize = None):
+    """
+    creates a checksum for a file. The file is read in blocks into a
+    reusable buffer, so the memory usage doesn't depend on the file size.
     Parameters:
     - filename
       name of the file to create a checksum for
+    - algorithm
+      optional algorithm to use instead of the configured one
+    - blocksize
+      optional block size to use instead of the configured one
     Return:
     - checksum for the given file
     """
-    m = hashlib.md5()
+    if algorithm == None:
+        algorithm = checksum_algorithm
+    if blocksize == None:
+        blocksize = checksum_blocksize
+    m = create_hasher(algorithm)
     try:
-        fd = open(filename, "rb")
-    except IOError:
+        fd = io.open(filename, "rb", buffering=0)
+    except (IOError, OSError):
         return None
-    content = fd.readlines()
-    fd.close()
-    for line in content:
-        m.update(line)
-    return m.hexdigest()
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    try:
+        while True:
+            count = fd.readinto(buf)
+            if not count:
+                break
+            m.update(view[:count])
+    finally:
+        fd.close()
+    result = m.hexdigest()
+    if algorithm != CHECKSUM_MD5:
+        result = algorithm + CHECKSUM_SEPARATOR + result
+    return result
+
+class PropertyFileIndex(object):
+    """
+    provides access to single properties of a binary meta file
+    via its index without parsing the whole file
+    """
+
+    def __init__(self, directory, filename):
+        """
+        creates an instance
+        Parameters:
+        - directory
+          directory in which the meta file is located
+        - filename
+          name of the meta file
+        """
+        self._file = open_file(directory, filename, "rb")
+        self._content = None
+        self._index = {}
+        self._properties = None
+        if self._file:
+            size = os.fstat(self._file.fileno()).st_size
+            if size > 0:
+                self._content = mmap.mmap(self._file.fileno(), size,
+                                          access=mmap.ACCESS_READ)
+            if self._content != None and is_binary_meta(self._content):
+                self._index = read_meta_index(self._content)
+            elif self._content != None:
+                # legacy files have no index, so they are parsed once
+                self._properties = {}
+                for p in parse_legacy_meta(self._content[:]):
+                    self._properties[p.get_name()] = p
+
+    def get_names(self):
+        """
+        Returns:
+        - list of the names of all properties
+        """
+        if self._properties != None:
+            return self._properties.keys()
+        return self._index.keys()
+
+    def get_property(self, name):
+        """
+        reads a single property by its name
+        Parameters:
+        - name
+          name of the property
+        Returns:
+        - file property or None
+        """
+        result = None
+        if self._properties != None:
+            result = self._properties.get(name)
+        elif name in self._index:
+            (result, pos) = unpack_property(self._content, self._index[name])
+        return result
+
+    def close(self):
+        """
+        closes the meta file
+        """
+        if self._content != None:
+            self._content.close()
+            self._content = None
+        if self._file:
+            self._file.close()
+            self._file = None
 
 # classes
 
@@ -215,7 +927,7 @@ class FileProperty(object):
         """
         self._name = None
         self._path = None
-        self._hostname = socket.gethostname()
+        self._hostname = get_local_hostname()
         self._timestamp = None
         self._state = None
         self._checksum = None
@@ -247,7 +959,7 @@ class FileProperty(object):
         return self._encrypted
 
     def is_host_property(self):
-        return self._hostname == socket.gethostname()
+        return self._hostname == get_local_hostname()
 
     def is_directory(self):
         result = False
@@ -267,7 +979,8 @@ class FileProperty(object):
         append_node(stringio, NAME_TAG, self._name)
         append_node(stringio, PATH_TAG, self._path)
         append_node(stringio, HOSTNAME_TAG, self._hostname)
-        append_node(stringio, TIMESTAMP_TAG, str(self._timestamp))
+        if self._timestamp != None:
+            append_node(stringio, TIMESTAMP_TAG, repr(self._timestamp))
         append_node(stringio, STATE_TAG, self._state)
         append_node(stringio, CHECKSUM_TAG, self._checksum)
         append_node(stringio, TYPE_TAG, self._type)
@@ -277,6 +990,43 @@ class FileProperty(object):
         stringio.write(">")
         return stringio.getvalue()
 
+    def get_property_values(self):
+        """
+        Returns:
+        - list of the property values as strings in the order
+          they are stored in binary meta files
+        """
+        timestamp = None
+        if self._timestamp != None:
+            timestamp = repr(self._timestamp)
+        return [ self._name, self._path, self._hostname, timestamp,
+                 self._state, self._checksum, self._type,
+                 str(self._encrypted) ]
+
+    def set_property_values(self, values):
+        """
+        sets the file properties by a list of values as returned
+        by get_property_values()
+        Parameters:
+        - values
+          list of property values
+        """
+        (name, path, hostname, timestamp, state, checksum, typevalue,
+         encrypted) = values
+        self._name = name
+        self._path = path
+        self._hostname = hostname
+        self._timestamp = None
+        if timestamp:
+            try:
+                self._timestamp = float(timestamp)
+            except ValueError:
+                self._timestamp = None
+        self._state = state
+        self._checksum = checksum
+        self._type = typevalue or TYPE_FILE
+        self._encrypted = encrypted == "True"
+
     def set_values(self, otherproperty):
         """
         copies the values from an other property object
@@ -298,16 +1048,16 @@ class FileProperty(object):
         - propertystring
           property string to set
         """
-        globalvalue = scan_tag(GLOBAL_TAG, propertystring)
-        if globalvalue:
-            namevalue = scan_tag(NAME_TAG, propertystring)
-            pathvalue = scan_tag(PATH_TAG, propertystring)
-            hostnamevalue = scan_tag(HOSTNAME_TAG, propertystring)
-            timestampvalue = scan_tag(TIMESTAMP_TAG, propertystring)
-            statevalue = scan_tag(STATE_TAG, propertystring)
-            checksumvalue = scan_tag(CHECKSUM_TAG, propertystring)
-            typevalue = scan_tag(TYPE_TAG, propertystring)
-            encryptedvalue = scan_tag(ENCRYPTED_TAG, propertystring)
+        values = parse_property_string(propertystring)
+        if values:
+            namevalue = values.get(NAME_TAG)
+            pathvalue = values.get(PATH_TAG)
+            hostnamevalue = values.get(HOSTNAME_TAG)
+            timestampvalue = values.get(TIMESTAMP_TAG)
+            statevalue = values.get(STATE_TAG)
+            checksumvalue = values.get(CHECKSUM_TAG)
+            typevalue = values.get(TYPE_TAG)
+            encryptedvalue = values.get(ENCRYPTED_TAG)
             if namevalue:
                 self._name = namevalue
             else:
@@ -354,7 +1104,7 @@ class FileProperty(object):
     def set_encrypted(self, flag):
         self._encrypted = flag
 
-    def scan(self, filepath, rootpath = None):
+    def scan(self, filepath, rootpath = None, checksumcache = None):
         """
         scans the properties of a local file
         Parameters:
@@ -363,6 +1113,9 @@ class FileProperty(object):
         - root_path
           absolute path of the directory that
           is syncronized
+        - checksumcache
+          optional ChecksumCache to look up checksums of
+          unchanged files
         Returns:
         - True
           scanning was successful
@@ -372,25 +1125,73 @@ class FileProperty(object):
         debug("entering FileProperty.scan()")
         debug_value("filepath", filepath)
         result = False
-        if os.path.exists(filepath):
+        abspath = os.path.abspath(filepath)
+        try:
+            statresult = os.stat(abspath)
+        except OSError:
+            statresult = None
+        if statresult != None:
             debug("file exists")
-            abspath = os.path.abspath(filepath)
-            if rootpath != None and os.path.exists(rootpath):
-                prefix = os.path.abspath(rootpath)
-                if abspath.startswith(prefix):
-                    index = len(prefix)
-                    self._path = abspath[index:]
-            else:
-                self._path = abspath
-            (tmp, filename) = os.path.split(abspath)
-            self._name = filename
-            self._timestamp = os.path.getmtime(abspath)
-            if os.path.isdir(filepath):
-                self._type = TYPE_DIRECTORY
-                debug("is directory")
-            if os.path.isfile(filepath):
-                self._type = TYPE_FILE
-                self._checksum = create_checksum(abspath)
-                debug("is file")
+            if rootpath != None and not os.path.exists(rootpath):
+                rootpath = None
+            if rootpath != None:
+                rootpath = os.path.abspath(rootpath)
+            result = self.scan_stat(abspath, statresult, rootpath, checksumcache)
         debug("exiting FileProperty.scan()")
         return result
+
+    def scan_stat(self, abspath, statresult, rootpath = None, checksumcache = None,
+                  stats = None):
+        """
+        sets the properties of a local file by an existing stat result,
+        so no further system calls are needed except for the checksum
+        Parameters:
+        - abspath
+          absolute path of the file or directory
+        - statresult
+          result of os.stat() for the file or directory
+        - rootpath
+          absolute path of the directory that is syncronized
+        - checksumcache
+          optional ChecksumCache to look up checksums of
+          unchanged files
+        - stats
+          optional SyncStats to count the hashed files
+        Returns:
+        - True
+          scanning was successful
+        - False
+          scanning failed
+        """
+        result = False
+        if rootpath != None:
+            if abspath.startswith(rootpath):
+                index = len(rootpath)
+                self._path = abspath[index:]
+        else:
+            self._path = abspath
+        (tmp, filename) = os.path.split(abspath)
+        self._name = filename
+        self._timestamp = statresult.st_mtime
+        if stat.S_ISDIR(statresult.st_mode):
+            self._type = TYPE_DIRECTORY
+            debug("is directory")
+            result = True
+        if stat.S_ISREG(statresult.st_mode):
+            self._type = TYPE_FILE
+            checksum = None
+            if checksumcache != None:
+                checksum = checksumcache.lookup(abspath, statresult)
+            if get_checksum_algorithm(checksum) != checksum_algorithm:
+                start = time.time()
+                checksum = create_checksum(abspath)
+                if stats != None:
+                    stats.add_time(STATS_HASH, time.time() - start)
+                    stats.add_count(STATS_FILES_HASHED)
+                    stats.add_count(STATS_BYTES_HASHED, statresult.st_size)
+                if checksumcache != None:
+                    checksumcache.store(abspath, statresult, checksum)
+            self._checksum = checksum
+            debug("is file")
+            result = True
+        return result
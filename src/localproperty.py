@@ -13,12 +13,20 @@
 # GNU General Public License for more details.
 
 import re
-import glob
 import os
 import os.path
 import shutil
+import time
+
+from threading import Lock
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = getattr(os, "scandir", None)
 
 from cStringIO import StringIO
+from checksumcache import *
 from fileproperty import *
 from utilio import *
 from syncdebug import *
@@ -33,12 +41,61 @@ STATE_EXISTING = "existing"
 STATE_UPDATED = "updated"
 STATE_DELETED = "deleted"
 
+# Constants for the handling of hidden files
+HIDDEN_SKIP = "skip"
+HIDDEN_INCLUDE = "include"
+
+# files that are never syncronized
+IGNORED_FILENAMES = [ META_FILENAME, CACHE_FILENAME, CACHE_TEMP_FILENAME,
+                      META_TEMP_PREFIX + META_FILENAME,
+                      get_journal_filename(META_FILENAME) ]
+
+def scan_directory(dirpath, hiddenpolicy = HIDDEN_SKIP):
+    """
+    scans the entries of a directory with a single stat per entry.
+    Symbolic links are followed.
+    Parameters:
+    - dirpath
+      full path of the directory to scan
+    - hiddenpolicy
+      HIDDEN_SKIP to skip entries starting with a dot or
+      HIDDEN_INCLUDE to include them
+    Returns:
+    - list of tuples of absolute path and stat result
+    """
+    result = []
+    dirpath = os.path.abspath(dirpath)
+    if scandir != None:
+        entries = []
+        for entry in scandir(dirpath):
+            entries.append((entry.name, entry))
+    else:
+        entries = []
+        for name in os.listdir(dirpath):
+            entries.append((name, None))
+    for (name, entry) in entries:
+        if name in IGNORED_FILENAMES:
+            continue
+        if hiddenpolicy == HIDDEN_SKIP and name.startswith("."):
+            continue
+        path = os.path.join(dirpath, name)
+        try:
+            if entry != None:
+                statresult = entry.stat()
+            else:
+                statresult = os.stat(path)
+        except OSError:
+            # broken links or entries deleted while scanning
+            continue
+        result.append((path, statresult))
+    return result
+
 class LocalProperty(object):
     """
     represents the properties of a local file
     """
 
-    def __init__(self, filepath, rootpath, meta = None):
+    def __init__(self, filepath, rootpath, meta = None, checksumcache = None):
         """
         creates an instance
         Parameters:
@@ -46,12 +103,14 @@ class LocalProperty(object):
         - rootpath
         - meta
           meta properties of a the file
+        - checksumcache
+          optional ChecksumCache to use for scanning the file
         """
         self._state = STATE_UNKNOWN
         self._meta = None
         if filepath != None:
             self._current = FileProperty()
-            self._current.scan(filepath, rootpath)
+            self._current.scan(filepath, rootpath, checksumcache)
         else:
             self._current = None
         self.update_state()
@@ -145,9 +204,9 @@ class LocalProperty(object):
         updates the state of the local file
         """
         debug("entering LocalProperty.update_state()")
-        debug_value("name", self.get_name())
-        debug_value("current exist", self._current != None)
-        debug_value("meta exist", self._meta != None)
+        debug("name = %s", self.get_name())
+        debug("current exist = %s", self._current != None)
+        debug("meta exist = %s", self._meta != None)
         if self._meta == None and self._current != None:
             self._state = STATE_NEW
         if self._meta != None and self._current == None:
@@ -155,15 +214,15 @@ class LocalProperty(object):
         if self._meta != None and self._current != None:
             meta_timestamp = self._meta.get_timestamp()
             current_timestamp = self._current.get_timestamp()
-            debug_value("meta timestamp", meta_timestamp)
-            debug_value("current timestamp", current_timestamp)
+            debug("meta timestamp = %s", meta_timestamp)
+            debug("current timestamp = %s", current_timestamp)
             if current_timestamp - meta_timestamp < 0.1:
                 self._state = STATE_EXISTING
             else:
                 self._state = STATE_UPDATED
         if self._current:
             self._current.set_state(self._state)
-        debug_value("state", self._state)
+        debug("state = %s", self._state)
         debug("exiting LocalProperty.update_state()")
 
 class SyncLocal(object):
@@ -171,17 +230,25 @@ class SyncLocal(object):
     access local files for syncronization
     """
 
-    def __init__(self, root):
+    def __init__(self, root, hiddenpolicy = HIDDEN_SKIP):
         """
         creates an instance
         Parameters:
         - root
           root directory to be synced
+        - hiddenpolicy
+          HIDDEN_SKIP or HIDDEN_INCLUDE to determine if hidden
+          files are syncronized
         """
         self._root = root
+        self._hiddenpolicy = hiddenpolicy
         self._directory = None
         self._list = []
         self._dict = {}
+        self._checksumcache = None
+        self._stats = None
+        self._journal = None
+        self._lock = Lock()
 
     def get_root(self):
         """
@@ -190,6 +257,88 @@ class SyncLocal(object):
         """
         return self._root
 
+    def get_directory(self):
+        """
+        Returns:
+        - directory that was read or None
+        """
+        return self._directory
+
+    def set_directory(self, dirpath):
+        """
+        sets the directory the meta data is saved to. This is needed
+        for directories that are created while syncronizing.
+        Parameters:
+        - dirpath
+          full path of the directory
+        """
+        self._directory = dirpath
+
+    def get_hidden_policy(self):
+        """
+        Returns:
+        - policy for hidden files
+        """
+        return self._hiddenpolicy
+
+    def set_hidden_policy(self, hiddenpolicy):
+        """
+        sets the policy for hidden files
+        Parameters:
+        - hiddenpolicy
+          HIDDEN_SKIP or HIDDEN_INCLUDE
+        """
+        self._hiddenpolicy = hiddenpolicy
+
+    def get_stats(self):
+        """
+        Returns:
+        - SyncStats that counts the scanned files or None
+        """
+        return self._stats
+
+    def set_stats(self, stats):
+        """
+        sets the SyncStats to count the scanned files
+        Parameters:
+        - stats
+          SyncStats instance or None
+        """
+        self._stats = stats
+
+    def get_checksum_cache(self):
+        """
+        Returns:
+        - ChecksumCache of the root directory
+        """
+        if self._checksumcache == None and self._root:
+            self._checksumcache = ChecksumCache(self._root)
+        return self._checksumcache
+
+    def set_checksum_cache(self, checksumcache):
+        """
+        sets the ChecksumCache to use. Several SyncLocal instances of the
+        same root can share a cache.
+        Parameters:
+        - checksumcache
+          ChecksumCache to use
+        """
+        self._checksumcache = checksumcache
+
+    def get_journal(self):
+        """
+        Returns:
+        - MetaJournal of the directory or None if no directory was read
+        """
+        if not self._directory:
+            return None
+        if self._journal == None or self._journal.get_path() != \
+           os.path.join(self._directory, get_journal_filename(META_FILENAME)):
+            if self._journal != None:
+                self._journal.close()
+            self._journal = MetaJournal(self._directory, META_FILENAME)
+        return self._journal
+
     def append_property(self, fileproperty):
         """
         appends a file property to the list
@@ -208,14 +357,21 @@ class SyncLocal(object):
           fileproperty to update
         """
         name = fileproperty.get_name()
-        if name in self._dict.keys():
-            entry = self._dict[name]
-            entry.set_current(fileproperty)
-        else:
-            newproperty = LocalProperty(None, None)
-            newproperty.set_current(fileproperty)
-            self._list.append(newproperty)
-            self._dict[name] = newproperty
+        self._lock.acquire()
+        try:
+            if name in self._dict:
+                entry = self._dict[name]
+                entry.set_current(fileproperty)
+            else:
+                newproperty = LocalProperty(None, None)
+                newproperty.set_current(fileproperty)
+                self._list.append(newproperty)
+                self._dict[name] = newproperty
+            journal = self.get_journal()
+        finally:
+            self._lock.release()
+        if journal != None:
+            journal.append(fileproperty)
 
     def get_properties(self):
         """
@@ -234,7 +390,7 @@ class SyncLocal(object):
         - file property or None
         """
         result = None
-        if name in self._dict.keys():
+        if name in self._dict:
             result = self._dict[name]
         return result
 
@@ -248,7 +404,7 @@ class SyncLocal(object):
         if not fileproperty:
             return
         name = fileproperty.get_name()
-        if name in self._dict.keys():
+        if name in self._dict:
             root = self._root
             deldirectory = fileproperty.get_path()
             delpath = root + deldirectory
@@ -266,6 +422,53 @@ class SyncLocal(object):
         if success:
             self.update_property(fileproperty)
 
+    def move(self, fileproperty, newproperty, sourcelocal = None):
+        """
+        renames a local file
+        Parameters:
+        - fileproperty
+          property of the file with the old name
+        - newproperty
+          server property of the new name
+        - sourcelocal
+          optional SyncLocal with the meta data of the old name
+        Returns:
+        - True:  file was renamed
+        - False: file could not be renamed
+        """
+        if sourcelocal == None:
+            sourcelocal = self
+        srcpath = self._root + fileproperty.get_path()
+        destpath = self._root + newproperty.get_path()
+        if os.path.exists(destpath):
+            return False
+        try:
+            os.rename(srcpath, destpath)
+        except OSError:
+            return False
+        sourcelocal.remove_property(fileproperty.get_name())
+        self.update_property(newproperty)
+        return True
+
+    def remove_property(self, name):
+        """
+        removes a file property, so it isn't saved in the meta data
+        Parameters:
+        - name
+          name of the property
+        """
+        journal = None
+        self._lock.acquire()
+        try:
+            if name in self._dict:
+                self._list.remove(self._dict[name])
+                del self._dict[name]
+                journal = self.get_journal()
+        finally:
+            self._lock.release()
+        if journal != None:
+            journal.remove(name)
+
     def read_directory(self, dirpath):
         """
         reads a given directory
@@ -274,18 +477,30 @@ class SyncLocal(object):
           full path of the directory to read
         """
         debug("entering SyncLocal.read_directory()")
-        debug_value("dirpath", dirpath)
+        debug("dirpath = %s", dirpath)
         self._list = []
         self._dict = {}
         if check_directory(dirpath):
             self._directory = dirpath
-            for infile in glob.glob(os.path.join(dirpath, "*")):
-                debug_value("infile", infile)
-                localproperty = LocalProperty(infile, self._root)
-                debug_value("path", localproperty.get_current().get_path())
-                debug_value("timestamp", localproperty.get_current().get_timestamp())
-                debug_value("checksum", localproperty.get_current().get_checksum())
+            rootpath = None
+            if self._root:
+                rootpath = os.path.abspath(self._root)
+            checksumcache = self.get_checksum_cache()
+            for (infile, statresult) in scan_directory(dirpath, self._hiddenpolicy):
+                debug("infile = %s", infile)
+                current = FileProperty()
+                current.scan_stat(infile, statresult, rootpath, checksumcache,
+                                  self._stats)
+                if self._stats != None:
+                    self._stats.add_count(STATS_FILES_SCANNED)
+                localproperty = LocalProperty(None, None)
+                localproperty.set_current(current)
+                debug("path = %s", localproperty.get_current().get_path())
+                debug("timestamp = %s", localproperty.get_current().get_timestamp())
+                debug("checksum = %s", localproperty.get_current().get_checksum())
                 self.append_property(localproperty)
+            if checksumcache != None:
+                checksumcache.mark_scanned(dirpath)
             self.load_meta()
             for p in self._list:
                 p.update_state()
@@ -303,11 +518,11 @@ class SyncLocal(object):
             propertylist = load_property_file(self._directory, META_FILENAME)
             for fileproperty in propertylist:
                 name = fileproperty.get_name()
-                debug_value("name", name)
-                debug_value("path", fileproperty.get_path())
-                debug_value("timestamp", fileproperty.get_timestamp())
-                debug_value("checksum", fileproperty.get_checksum())
-                if name in self._dict.keys():
+                debug("name = %s", name)
+                debug("path = %s", fileproperty.get_path())
+                debug("timestamp = %s", fileproperty.get_timestamp())
+                debug("checksum = %s", fileproperty.get_checksum())
+                if name in self._dict:
                     debug("existing property")
                     self._dict[name].set_meta(fileproperty)
                 else:
@@ -323,10 +538,15 @@ class SyncLocal(object):
     def save_meta(self):
         success = False
         if self._directory:
+            start = time.time()
             propertylist = []
             for p in self._list:
                 if p.get_current():
                     propertylist.append(p.get_current())
-            save_property_file(self._directory, META_FILENAME, propertylist)
+            self.get_journal().compact(propertylist)
+            if self._checksumcache:
+                self._checksumcache.save()
+            if self._stats != None:
+                self._stats.add_time(STATS_META_SAVE, time.time() - start)
             success = True
         return success
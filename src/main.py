@@ -40,9 +40,14 @@ __status__ = "Development"
 PARAMETER_CONFIG = "-c"
 PARAMETER_DIRECTORY = "-d"
 PARAMETER_RECURSIVE = "-r"
+PARAMETER_STATS = "--stats"
+PARAMETER_STATS_JSON = "--stats-json"
 
 # constants for config keys
 CONFIG_KEY_ENCRYPTION = "encryption"
+CONFIG_KEY_CHECKSUM = "checksum"
+CONFIG_KEY_CHECKSUM_BLOCKSIZE = "checksum-blocksize"
+CONFIG_KEY_HIDDEN = "hidden-files"
 
 class OutputBase(object):
     """
@@ -187,7 +192,93 @@ def get_action_string(index, total, action):
     stringio.write(" ...")
     return stringio.getvalue()
 
-def syncronize(directory, output, recursive = False):
+def setup_encryption(processor, config):
+    """
+    sets the encryption of a processor according to the configuration
+    Parameters:
+    - processor
+      SyncProcessor or TreeSyncProcessor to set the encryption for
+    - config
+      configuration to use
+    """
+    encryptionflag = config.get_value(CONFIG_KEY_ENCRYPTION)
+    if encryptionflag:
+        if encryptionflag.lower().strip() == "true":
+            synccrypt = SyncCrypt(False)
+            synccrypt.enter_password(True)
+            processor.set_encryption(synccrypt)
+
+def setup_checksum(config, output):
+    """
+    sets the checksum options according to the configuration
+    Parameters:
+    - config
+      configuration to use
+    - output
+      output instance to use
+    """
+    algorithm = config.get_value(CONFIG_KEY_CHECKSUM)
+    if algorithm:
+        if not set_checksum_algorithm(algorithm.lower().strip()):
+            output.output("Checksum algorithm not available: " + algorithm)
+    blocksize = config.get_value(CONFIG_KEY_CHECKSUM_BLOCKSIZE)
+    if blocksize:
+        set_checksum_blocksize(blocksize)
+
+def get_hidden_policy(config):
+    """
+    Parameters:
+    - config
+      configuration to use
+    Returns:
+    - policy for hidden files
+    """
+    result = HIDDEN_SKIP
+    hiddenflag = config.get_value(CONFIG_KEY_HIDDEN)
+    if hiddenflag:
+        if hiddenflag.lower().strip() == HIDDEN_INCLUDE:
+            result = HIDDEN_INCLUDE
+    return result
+
+def get_concurrency(config):
+    """
+    Parameters:
+    - config
+      configuration to use
+    Returns:
+    - count of actions to process in parallel
+    """
+    result = DEFAULT_CONCURRENCY
+    value = config.get_value(CONFIG_KEY_CONCURRENCY)
+    if value:
+        try:
+            result = max(1, int(value))
+        except ValueError:
+            result = DEFAULT_CONCURRENCY
+    return result
+
+def output_stats(stats, output):
+    """
+    outputs the statistics of a sync as requested by the command line.
+    --stats prints them, --stats-json FILE saves them as JSON.
+    Parameters:
+    - stats
+      SyncStats of the sync
+    - output
+      output instance to use
+    """
+    if PARAMETER_STATS in sys.argv:
+        stringio = StringIO()
+        stats.write_text(stringio)
+        for line in stringio.getvalue().splitlines():
+            output.output(line)
+    filepath = get_parameter(PARAMETER_STATS_JSON)
+    if filepath:
+        stats.save_json(filepath)
+    elif filepath != None:
+        output.output("No file for the statistics specified.")
+
+def syncronize(directory, output, recursive = False, config = None):
     """
     synchronizes a directory
     Parameters:
@@ -197,25 +288,29 @@ def syncronize(directory, output, recursive = False):
       output instance to use
     - recursive
       syncronize subdirectories recursively
+    - config
+      configuration to use. If omitted the configuration is
+      determined by the command line.
     """
-    config = get_config()
+    if config == None:
+        config = get_config()
+    setup_checksum(config, output)
+    if recursive:
+        syncronize_tree(directory, output, config)
+        return
     root = os.path.expanduser("~")
-    local = SyncLocal(root)
+    local = SyncLocal(root, get_hidden_policy(config))
     server = SyncServer(config, local, directory)
     processor = SyncProcessor(local, directory, server)
-    encryptionflag = config.get_value(CONFIG_KEY_ENCRYPTION)
-    if encryptionflag:
-        if encryptionflag.lower().strip() == "true":
-            synccrypt = SyncCrypt(False)
-            synccrypt.enter_password(True)
-            processor.set_encryption(synccrypt)
+    processor.set_concurrency(get_concurrency(config))
+    setup_encryption(processor, config)
     output.output("Connecting server ...")
     processor.startup()
     output.output("Syncronizing %s ..." % directory)
     total = processor.get_action_count()
     if processor.needs_encryption():
         synccrypt = SyncCrypt(False)
-        synccrypt.enter_password(false)
+        synccrypt.enter_password(False)
         processor.set_encryption(synccrypt)
     while processor.has_open_actions():
         index = processor.get_action_index()
@@ -226,11 +321,59 @@ def syncronize(directory, output, recursive = False):
             for error in server.get_errors():
                 output.output("ERROR: " + error)
                 server.clear_errors()
-    if recursive:
-        for subdir in get_subdirectories(directory):
-            syncronize(subdir, output, True)
+    # errors of parallel actions are logged when they finish
+    processor.wait_actions()
+    for error in server.get_errors():
+        output.output("ERROR: " + error)
+    server.clear_errors()
+    output.output("Disconnecting ...")
+    processor.shutdown()
+    output_stats(processor.get_stats(), output)
+    output.output("Done.")
+
+def syncronize_tree(directory, output, config):
+    """
+    synchronizes a directory and all subdirectories in one session
+    Parameters:
+    - directory
+      directory to synchronize
+    - output
+      output instance to use
+    - config
+      configuration to use
+    """
+    root = os.path.expanduser("~")
+    processor = TreeSyncProcessor(config, root, directory,
+                                  get_hidden_policy(config))
+    processor.set_concurrency(get_concurrency(config))
+    setup_encryption(processor, config)
+    output.output("Connecting server ...")
+    processor.startup()
+    total = processor.get_action_count()
+    if processor.needs_encryption():
+        synccrypt = SyncCrypt(False)
+        synccrypt.enter_password(False)
+        processor.set_encryption(synccrypt)
+    currentdir = None
+    while processor.has_open_actions():
+        if processor.get_action_directory() != currentdir:
+            currentdir = processor.get_action_directory()
+            output.output("Syncronizing %s ..." % currentdir)
+        index = processor.get_action_index()
+        action = processor.get_action_title()
+        output.output(get_action_string(index, total, action))
+        processor.process_next_action()
+        for error in processor.get_errors():
+            output.output("ERROR: " + error)
+        processor.clear_errors()
+    # errors of parallel actions are logged when they finish
+    processor.wait_actions()
+    for error in processor.get_errors():
+        output.output("ERROR: " + error)
+    processor.clear_errors()
     output.output("Disconnecting ...")
     processor.shutdown()
+    output_stats(processor.get_stats(), output)
     output.output("Done.")
 
 def main():
@@ -242,7 +385,7 @@ def main():
     config = get_config()
     directory = get_directory()
     recursive = get_parameter(PARAMETER_RECURSIVE) != None
-    syncronize(directory, output, recursive)
+    syncronize(directory, output, recursive, config)
 
 if __name__ == "__main__":
     main()
@@ -47,6 +47,7 @@ class ProgressDialog(object):
         self._directories_current = 0
         self._files_count = 0
         self._files_current = 0
+        self._stats = None
         self._stop_flag = False
         self._Thread = SyncThread(self)
 
@@ -144,6 +145,29 @@ class ProgressDialog(object):
         fraction = float(self._directories_current) / float(self._directories_count)
         progressbar.set_fraction(fraction)
 
+    def set_stats(self, stats):
+        """
+        sets the statistics of the running sync to display its
+        throughput
+        Parameters:
+        - stats
+          SyncStats of the sync or None
+        """
+        self._stats = stats
+        self.update_stats()
+
+    def update_stats(self):
+        """
+        displays the throughput of the running sync
+        """
+        progressbar = self._widget_tree.get_widget("progressbar_file")
+        if self._stats == None:
+            progressbar.set_text("")
+        else:
+            progressbar.set_text("%s, %s/s" %
+                                 (format_bytes(self._stats.get_bytes()),
+                                  format_bytes(self._stats.get_throughput())))
+
     def set_file(self, filename):
         """
         sets the file
@@ -239,15 +263,20 @@ class SyncThread(Thread):
         local = SyncLocal(root)
         server = SyncServer(config, local, directory)
         processor = SyncProcessor(local, directory, server)
+        concurrency = config.get_value(CONFIG_KEY_CONCURRENCY)
+        if concurrency and concurrency.isdigit():
+            processor.set_concurrency(int(concurrency))
         if dlg.get_crypt():
             processor.set_encryption(dlg.get_crypt(), True)
         processor.startup()
         dlg.set_files_count(processor.get_action_count())
+        dlg.set_stats(processor.get_stats())
         while processor.has_open_actions():
             action = processor.get_action_title()
             dlg.set_file(action)
             dlg.add_detail_line(action)
             processor.process_next_action()
+            dlg.update_stats()
             if server.has_errors():
                 for error in server.get_errors():
                     detail_line = " ERROR: %s" % error
@@ -0,0 +1,656 @@
+#!/usr/bin/env python
+
+# simplesync - benchmarks
+#
+# Copyright 2010 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import hashlib
+import json
+import os
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from checksumcache import *
+from syncconfig import *
+from syncprocessor import *
+
+# action counts used by the planner benchmark
+PLANNER_COUNTS = [ 1000, 10000, 100000 ]
+
+# record count used by the meta parser benchmark
+PARSER_COUNT = 100000
+
+# shapes of the synthetic trees of the sync benchmark. Each directory
+# has "directories" subdirectories down to "depth" levels and contains
+# "files" files of "size" bytes. The scale factor changes the count of
+# files or, for huge files, their size.
+TREE_PROFILES = {
+    "small-files": { "depth": 0, "directories": 0, "files": 2000, "size": 1024 },
+    "huge-files": { "depth": 0, "directories": 0, "files": 3,
+                    "size": 32 * 1024 * 1024, "scalesize": True },
+    "deep": { "depth": 12, "directories": 1, "files": 20, "size": 4096 },
+    "wide": { "depth": 1, "directories": 400, "files": 5, "size": 4096 },
+}
+
+TREE_PROFILE_NAMES = [ "small-files", "huge-files", "deep", "wide" ]
+
+# scenarios of the sync benchmark in the order they are run
+SCENARIO_FIRST_SYNC = "first-sync"
+SCENARIO_NOOP = "noop-resync"
+SCENARIO_CHANGED = "changed-1pct"
+SCENARIO_RENAMED = "renamed-1pct"
+
+SYNC_SCENARIOS = [ SCENARIO_FIRST_SYNC, SCENARIO_NOOP, SCENARIO_CHANGED,
+                   SCENARIO_RENAMED ]
+
+# size of the blocks the synthetic file content is built of
+CONTENT_BLOCKSIZE = 1024 * 1024
+
+# seed of the synthetic content, so runs are reproducible
+BENCHMARK_SEED = 2011
+
+# relative slowdown against a baseline that is reported as regression
+REGRESSION_TOLERANCE = 0.25
+
+# slowdowns below this count of seconds are treated as noise
+REGRESSION_MIN_SECONDS = 0.05
+
+def create_file_property(index):
+    """
+    creates a file property for a synthetic file
+    Parameters:
+    - index
+      index of the synthetic file
+    Returns:
+    - created FileProperty
+    """
+    fileproperty = FileProperty()
+    fileproperty.set_property_values(["file-%i.txt" % index,
+        "/bench/file-%i.txt" % index, "localhost", "1300000000.0",
+        STATE_EXISTING, "%032x" % index, TYPE_FILE, "False"])
+    return fileproperty
+
+def create_upload_action(index):
+    """
+    creates an upload action for a synthetic file
+    Parameters:
+    - index
+      index of the synthetic file
+    Returns:
+    - created ActionEntry
+    """
+    fileproperty = create_file_property(index)
+    fileproperty.set_state(STATE_NEW)
+    return ActionEntry(fileproperty, None, ACTION_UPLOAD)
+
+def benchmark_planner(count):
+    """
+    measures the time to append actions to a SyncProcessor. Every
+    action is appended twice, so the duplicate detection is measured
+    as well.
+    Parameters:
+    - count
+      count of actions
+    Returns:
+    - seconds needed to append all actions
+    """
+    actions = []
+    for index in range(count):
+        actions.append(create_upload_action(index))
+    processor = SyncProcessor(SyncLocal(None), None, None)
+    start = time.time()
+    for action in actions:
+        processor.append_action(action)
+    for action in actions:
+        processor.append_action(action)
+    duration = time.time() - start
+    processor.wait_actions()
+    return duration
+
+def benchmark_planning(count):
+    """
+    measures the planning of a directory whose files are unchanged:
+    scanning the files, loading the meta data, merging the local and
+    the server properties and creating the actions
+    Parameters:
+    - count
+      count of files in the directory
+    Returns:
+    - tuple of the seconds needed to plan the sync and the timings of
+      the phases
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        root = os.path.join(directory, "client")
+        tree = os.path.join(root, "bench")
+        server = os.path.join(directory, "server")
+        os.makedirs(tree)
+        os.mkdir(server)
+        for index in range(count):
+            open(os.path.join(tree, "file-%i.txt" % index), "w").close()
+        synclocal = SyncLocal(root)
+        synclocal.read_directory(tree)
+        propertylist = []
+        for localproperty in synclocal.get_properties():
+            propertylist.append(localproperty.get_current())
+        save_property_file(tree, META_FILENAME, propertylist)
+        save_property_file(server, create_hash("/bench"), propertylist)
+        config = SyncConfig("benchmark")
+        config.set_value(CONFIG_KEY_TYPE, CONFIG_VALUE_FILE)
+        config.set_value(CONFIG_KEY_SERVER_DIRECTORY, server)
+        synclocal = SyncLocal(root)
+        processor = SyncProcessor(synclocal, tree,
+                                  SyncServer(config, synclocal, tree))
+        start = time.time()
+        processor.startup()
+        duration = time.time() - start
+        processor.wait_actions()
+        return (duration, processor.get_timings())
+    finally:
+        shutil.rmtree(directory)
+
+def run_planner_benchmark(output = sys.stdout):
+    """
+    runs the planner benchmark for several action counts
+    Parameters:
+    - output
+      file to write the results to
+    """
+    output.write("planner: append_action\n")
+    for count in PLANNER_COUNTS:
+        duration = benchmark_planner(count)
+        output.write("  %8i actions: %8.3f s  %8.2f us/action\n" %
+                     (count, duration, duration * 1000000.0 / (2 * count)))
+    output.write("planner: read_directory and merge\n")
+    for count in PLANNER_COUNTS:
+        (duration, timings) = benchmark_planning(count)
+        output.write("  %8i files: %8.3f s  %8.2f us/file  scan %.3f s"
+                     "  merge %.3f s\n" %
+                     (count, duration, duration * 1000000.0 / count,
+                      timings.get(TIMING_SCAN, 0.0),
+                      timings.get(TIMING_MERGE, 0.0)))
+
+def parse_with_scan_tag(propertystring):
+    """
+    parses a property string with a regular expression per tag like
+    former versions of FileProperty.set_property_string() did
+    Parameters:
+    - propertystring
+      property string to parse
+    Returns:
+    - parsed FileProperty
+    """
+    fileproperty = FileProperty()
+    if scan_tag(GLOBAL_TAG, propertystring):
+        values = []
+        for tag in [ NAME_TAG, PATH_TAG, HOSTNAME_TAG, TIMESTAMP_TAG,
+                     STATE_TAG, CHECKSUM_TAG, TYPE_TAG, ENCRYPTED_TAG ]:
+            values.append(scan_tag(tag, propertystring))
+        fileproperty.set_property_values(values)
+    return fileproperty
+
+def benchmark_meta_parser(count):
+    """
+    measures parsing a meta file in the legacy tag format with the
+    regular expressions of scan_tag() and with the single-pass parser
+    and loading the same properties from the binary format
+    Parameters:
+    - count
+      count of records
+    Returns:
+    - tuple of seconds for scan_tag(), the single-pass parser and the
+      binary format
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        propertylist = []
+        for index in range(count):
+            propertylist.append(create_file_property(index))
+        f = open(os.path.join(directory, "legacy"), "w")
+        f.write(START_TAG)
+        for fileproperty in propertylist:
+            f.write(fileproperty.get_property_string())
+        f.write(END_TAG)
+        f.close()
+        save_property_file(directory, "binary", propertylist)
+        f = open(os.path.join(directory, "legacy"))
+        content = f.read()
+        f.close()
+        start = time.time()
+        pos = content.find("<fileproperty>")
+        while pos != -1:
+            end = content.find("</fileproperty>", pos) + len("</fileproperty>")
+            parse_with_scan_tag(content[pos:end])
+            pos = content.find("<fileproperty>", end)
+        regexduration = time.time() - start
+        start = time.time()
+        load_property_file(directory, "legacy")
+        parserduration = time.time() - start
+        start = time.time()
+        load_property_file(directory, "binary")
+        binaryduration = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+    return (regexduration, parserduration, binaryduration)
+
+def run_meta_parser_benchmark(output = sys.stdout):
+    """
+    runs the meta parser benchmark
+    Parameters:
+    - output
+      file to write the results to
+    """
+    output.write("meta parser: %i records\n" % PARSER_COUNT)
+    (regexduration, parserduration, binaryduration) = benchmark_meta_parser(PARSER_COUNT)
+    output.write("  scan_tag:            %8.3f s\n" % regexduration)
+    output.write("  single-pass parser:  %8.3f s\n" % parserduration)
+    output.write("  binary format:       %8.3f s\n" % binaryduration)
+
+def create_content(seed, size):
+    """
+    creates reproducible pseudo random content
+    Parameters:
+    - seed
+      seed of the content
+    - size
+      size of the content
+    Returns:
+    - string with the content
+    """
+    blocks = []
+    for index in range((size + 15) // 16):
+        blocks.append(hashlib.md5("%s-%i" % (seed, index)).digest())
+    return "".join(blocks)[:size]
+
+def write_synthetic_file(filepath, index, size, block):
+    """
+    writes a synthetic file. Every file and every block of a file
+    differs, so neither deltas nor the content store can skip data.
+    Parameters:
+    - filepath
+      path of the file
+    - index
+      index of the file
+    - size
+      size of the file
+    - block
+      content to build the file of
+    """
+    f = open(filepath, "wb")
+    try:
+        written = 0
+        chunk = 0
+        while written < size:
+            prefix = "%i:%i\n" % (index, chunk)
+            data = prefix + block[len(prefix):]
+            data = data[:size - written]
+            f.write(data)
+            written = written + len(data)
+            chunk = chunk + 1
+    finally:
+        f.close()
+
+def generate_tree(directory, profile, scale = 1.0, seed = BENCHMARK_SEED):
+    """
+    generates a synthetic directory tree
+    Parameters:
+    - directory
+      directory to create the tree in
+    - profile
+      name of the shape of the tree, see TREE_PROFILES
+    - scale
+      factor for the count of files and the size of huge files
+    - seed
+      seed of the content
+    Returns:
+    - sorted list of the paths of the created files. Their modification
+      time lies before the racy window of the checksum cache, so a
+      resync finds their checksums in the cache like it would for
+      files that weren't just written.
+    """
+    shape = TREE_PROFILES[profile]
+    files = shape["files"]
+    size = shape["size"]
+    if shape.get("scalesize"):
+        size = max(1, int(size * scale))
+    else:
+        files = max(1, int(files * scale))
+    block = create_content(seed, min(size, CONTENT_BLOCKSIZE))
+    result = []
+    pending = [ (directory, 0) ]
+    index = 0
+    while len(pending) > 0:
+        (current, level) = pending.pop(0)
+        if not os.path.isdir(current):
+            os.makedirs(current)
+        for count in range(files):
+            filepath = os.path.join(current, "file-%06i.dat" % index)
+            write_synthetic_file(filepath, index, size, block)
+            result.append(filepath)
+            index = index + 1
+        if level < shape["depth"]:
+            for count in range(shape["directories"]):
+                pending.append((os.path.join(current, "dir-%04i" % count),
+                                level + 1))
+    timestamp = time.time() - 10 * CACHE_RACY_SECONDS
+    for filepath in result:
+        os.utime(filepath, (timestamp, timestamp))
+    result.sort()
+    return result
+
+def get_sample(filelist, percent = 1.0):
+    """
+    selects a reproducible sample of files
+    Parameters:
+    - filelist
+      sorted list of files
+    - percent
+      share of the files to select
+    Returns:
+    - list of selected files, at least one
+    """
+    count = max(1, int(len(filelist) * percent / 100.0))
+    step = max(1, len(filelist) // count)
+    return filelist[::step][:count]
+
+def change_files(filelist):
+    """
+    changes the first bytes of files and moves their modification time
+    forward, so the next sync uploads them
+    Parameters:
+    - filelist
+      files to change
+    """
+    for filepath in filelist:
+        f = open(filepath, "r+b")
+        f.write("changed")
+        f.close()
+        timestamp = os.path.getmtime(filepath) + 2
+        os.utime(filepath, (timestamp, timestamp))
+
+def rename_files(filelist):
+    """
+    renames files within their directories
+    Parameters:
+    - filelist
+      files to rename
+    Returns:
+    - list of the new paths
+    """
+    result = []
+    for filepath in filelist:
+        newpath = filepath + ".renamed"
+        os.rename(filepath, newpath)
+        result.append(newpath)
+    return result
+
+def read_proc_io():
+    """
+    Returns:
+    - dictionary with the I/O counters of this process from
+      /proc/self/io or an empty dictionary if they are not available
+    """
+    result = {}
+    try:
+        f = open("/proc/self/io")
+    except IOError:
+        return result
+    try:
+        for line in f:
+            (key, value) = line.split(":", 1)
+            result[key.strip()] = int(value)
+    finally:
+        f.close()
+    return result
+
+class Measurement(object):
+    """
+    measures wall time, CPU time, read and write calls and bytes read
+    and written by this process. The read and write calls are the
+    syscr and syscw counters of /proc/self/io and don't include other
+    syscalls like stat. All values include all threads.
+    """
+
+    def __init__(self):
+        """
+        creates an instance and starts measuring
+        """
+        self._io = read_proc_io()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._start = time.time()
+        self._result = None
+
+    def stop(self):
+        """
+        stops measuring
+        Returns:
+        - dictionary with the measured values
+        """
+        wall = time.time() - self._start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = read_proc_io()
+        def delta(key):
+            if key in io and key in self._io:
+                return io[key] - self._io[key]
+            return None
+        rwcalls = None
+        if delta("syscr") != None:
+            rwcalls = delta("syscr") + delta("syscw")
+        self._result = {
+            "wall": wall,
+            "cpu": (usage.ru_utime - self._usage.ru_utime +
+                    usage.ru_stime - self._usage.ru_stime),
+            "rwcalls": rwcalls,
+            "bytes_read": delta("rchar"),
+            "bytes_written": delta("wchar"),
+            # high-water mark of the whole process in KB
+            "peak_rss": usage.ru_maxrss }
+        return self._result
+
+def run_sync(config, root, directory):
+    """
+    synchronizes a directory tree with the file server of a
+    configuration
+    Parameters:
+    - config
+      configuration entry to use
+    - root
+      root directory of the local files
+    - directory
+      directory to synchronize
+    Returns:
+    - TreeSyncProcessor that did the sync
+    """
+    processor = TreeSyncProcessor(config, root, directory)
+    processor.startup()
+    while processor.has_open_actions():
+        processor.process_next_action()
+    processor.shutdown()
+    return processor
+
+def benchmark_sync(profile, scale = 1.0):
+    """
+    runs the sync scenarios on a synthetic tree and a local file server
+    Parameters:
+    - profile
+      name of the shape of the tree, see TREE_PROFILES
+    - scale
+      factor for the size of the tree
+    Returns:
+    - list of dictionaries with the results of each scenario
+    """
+    result = []
+    directory = tempfile.mkdtemp()
+    try:
+        root = os.path.join(directory, "client")
+        tree = os.path.join(root, "tree")
+        server = os.path.join(directory, "server")
+        os.mkdir(server)
+        config = SyncConfig("benchmark")
+        config.set_value(CONFIG_KEY_TYPE, CONFIG_VALUE_FILE)
+        config.set_value(CONFIG_KEY_SERVER_DIRECTORY, server)
+        filelist = generate_tree(tree, profile, scale)
+        for scenario in SYNC_SCENARIOS:
+            if scenario == SCENARIO_CHANGED:
+                change_files(get_sample(filelist))
+            if scenario == SCENARIO_RENAMED:
+                sample = get_sample(filelist)
+                rename_files(sample)
+            measurement = Measurement()
+            processor = run_sync(config, root, tree)
+            values = measurement.stop()
+            stats = processor.get_stats()
+            values["profile"] = profile
+            values["scenario"] = scenario
+            values["files"] = len(filelist)
+            values["actions"] = processor.get_action_count()
+            values["errors"] = len(processor.get_errors())
+            for phase in [ STATS_SCAN, STATS_HASH, STATS_META_LOAD,
+                           STATS_META_SAVE, STATS_PLAN ]:
+                values[phase] = stats.get_time(phase)
+            values["upload"] = stats.get_action_seconds("upload")
+            result.append(values)
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+def format_value(value, pattern):
+    """
+    formats a measured value that might not be available
+    Parameters:
+    - value
+      measured value or None
+    - pattern
+      format pattern
+    Returns:
+    - formatted value or "n/a"
+    """
+    if value == None:
+        return "n/a"
+    return pattern % value
+
+def run_sync_benchmark(profiles = TREE_PROFILE_NAMES, scale = 1.0,
+                       output = sys.stdout):
+    """
+    runs the sync benchmark for several tree profiles
+    Parameters:
+    - profiles
+      names of the tree profiles
+    - scale
+      factor for the size of the trees
+    - output
+      file to write the results to
+    Returns:
+    - list of dictionaries with the results
+    """
+    results = []
+    output.write("sync: scale %.2f\n" % scale)
+    output.write("  %-12s %-13s %6s %8s %8s %9s %10s %10s %8s %8s %8s %8s\n" %
+                 ("profile", "scenario", "files", "actions", "wall s",
+                  "r/w calls", "read MB", "written MB", "rss MB", "scan s",
+                  "meta s", "upload s"))
+    for profile in profiles:
+        for values in benchmark_sync(profile, scale):
+            results.append(values)
+            megabyte = 1024.0 * 1024.0
+            output.write("  %-12s %-13s %6i %8i %8.3f %9s %10s %10s %8.1f %8.3f %8.3f %8.3f\n" %
+                (profile, values["scenario"], values["files"],
+                 values["actions"], values["wall"],
+                 format_value(values["rwcalls"], "%i"),
+                 format_value(values["bytes_read"] and
+                              values["bytes_read"] / megabyte, "%.1f"),
+                 format_value(values["bytes_written"] and
+                              values["bytes_written"] / megabyte, "%.1f"),
+                 values["peak_rss"] / 1024.0, values[STATS_SCAN],
+                 values[STATS_META_LOAD], values["upload"]))
+    return results
+
+def compare_results(results, baseline, tolerance = REGRESSION_TOLERANCE):
+    """
+    compares the results of the sync benchmark with a baseline
+    Parameters:
+    - results
+      list of dictionaries with the results
+    - baseline
+      list of dictionaries with the results of an earlier run
+    - tolerance
+      relative slowdown that is accepted
+    Returns:
+    - list of messages about the regressions
+    """
+    reference = {}
+    for values in baseline:
+        reference[(values["profile"], values["scenario"])] = values
+    messages = []
+    for values in results:
+        old = reference.get((values["profile"], values["scenario"]))
+        if old == None:
+            continue
+        for key in [ "wall", STATS_SCAN, STATS_META_LOAD, "upload" ]:
+            limit = old[key] * (1.0 + tolerance)
+            if values[key] > limit and values[key] - old[key] > REGRESSION_MIN_SECONDS:
+                messages.append("%s/%s: %s %.3f s, baseline %.3f s" %
+                                (values["profile"], values["scenario"], key,
+                                 values[key], old[key]))
+    return messages
+
+def get_option(name, default = None):
+    """
+    returns the value that follows an option on the command line
+    Parameters:
+    - name
+      name of the option
+    - default
+      value if the option is missing
+    Returns:
+    - value of the option
+    """
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+if __name__ == "__main__":
+    # usage: syncbenchmark.py [planner] [parser] [sync] [--profile NAME]
+    #        [--scale FACTOR] [--json FILE] [--baseline FILE]
+    benchmarks = [ arg for arg in sys.argv[1:] if arg in [ "planner", "parser", "sync" ] ]
+    if len(benchmarks) == 0:
+        benchmarks = [ "planner", "parser", "sync" ]
+    if "planner" in benchmarks:
+        run_planner_benchmark()
+    if "parser" in benchmarks:
+        run_meta_parser_benchmark()
+    if "sync" in benchmarks:
+        profiles = TREE_PROFILE_NAMES
+        if get_option("--profile"):
+            profiles = get_option("--profile").split(",")
+        scale = float(get_option("--scale", "1.0"))
+        results = run_sync_benchmark(profiles, scale)
+        if get_option("--json"):
+            f = open(get_option("--json"), "w")
+            json.dump(results, f, indent = 2, sort_keys = True)
+            f.close()
+        if get_option("--baseline"):
+            f = open(get_option("--baseline"))
+            baseline = json.load(f)
+            f.close()
+            messages = compare_results(results, baseline)
+            for message in messages:
+                print "REGRESSION " + message
+            if len(messages) > 0:
+                sys.exit(1)
@@ -0,0 +1,302 @@
+# simplesync - fast file copies
+#
+# Copyright 2011 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+
+from threading import Lock
+
+from syncdebug import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# names of the copy backends
+COPY_REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+COPY_SENDFILE = "sendfile"
+COPY_BUFFER = "buffer"
+
+# name used for files whose content was already stored
+COPY_DEDUP = "dedup"
+
+COPY_BACKENDS = [ COPY_REFLINK, COPY_FILE_RANGE, COPY_SENDFILE, COPY_BUFFER,
+                  COPY_DEDUP ]
+
+# ioctl request to clone a file on btrfs, XFS and similar filesystems
+FICLONE = 0x40049409
+
+# size of the chunks for the kernel copies and the buffer
+COPY_CHUNKSIZE = 8 * 1024 * 1024
+
+# functions of the C library for the kernel copies. The os module of
+# Python 2 provides neither copy_file_range nor sendfile.
+# copy_file_range(fd_in, *off_in, fd_out, *off_out, len, flags)
+# sendfile(out_fd, in_fd, *offset, count)
+KERNEL_FUNCTIONS = { COPY_FILE_RANGE: ([ "copy_file_range" ],
+                                       [ ctypes.c_int,
+                                         ctypes.POINTER(ctypes.c_int64),
+                                         ctypes.c_int,
+                                         ctypes.POINTER(ctypes.c_int64),
+                                         ctypes.c_size_t, ctypes.c_uint ]),
+                     COPY_SENDFILE: ([ "sendfile64", "sendfile" ],
+                                     [ ctypes.c_int, ctypes.c_int,
+                                       ctypes.POINTER(ctypes.c_int64),
+                                       ctypes.c_size_t ]) }
+
+# errors that mean a backend isn't supported for a pair of files
+UNSUPPORTED_ERRORS = [ errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                       errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                       getattr(errno, "ENOTSUP", errno.EOPNOTSUPP) ]
+
+def copy_reflink(srcfile, destfile, size):
+    """
+    clones a file by a copy-on-write reflink
+    Parameters:
+    - srcfile
+      open source file
+    - destfile
+      open destination file
+    - size
+      size of the source file
+    Returns:
+    - True:  file was cloned
+    - False: reflinks are not supported
+    """
+    if fcntl == None:
+        return False
+    try:
+        fcntl.ioctl(destfile.fileno(), FICLONE, srcfile.fileno())
+    except (IOError, OSError), e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+    return True
+
+def load_kernel_functions():
+    """
+    loads the functions of the C library for the kernel copies
+    Returns:
+    - dictionary of the backend and its function. Backends that the C
+      library doesn't provide are missing.
+    """
+    result = {}
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError, e:
+        debug_error("C library not available: %s", e)
+        return result
+    for (backend, (names, argtypes)) in KERNEL_FUNCTIONS.items():
+        for name in names:
+            function = getattr(libc, name, None)
+            if function != None:
+                function.argtypes = argtypes
+                function.restype = ctypes.c_ssize_t
+                result[backend] = function
+                break
+    return result
+
+kernel_functions = load_kernel_functions()
+
+def copy_kernel(backend, srcfile, destfile, size):
+    """
+    copies a file within the kernel
+    Parameters:
+    - backend
+      COPY_FILE_RANGE or COPY_SENDFILE
+    - srcfile
+      open source file
+    - destfile
+      open destination file
+    - size
+      size of the source file
+    Returns:
+    - True:  file was copied
+    - False: the backend is not supported for these files
+    """
+    function = kernel_functions.get(backend)
+    if function == None:
+        return False
+    infd = srcfile.fileno()
+    outfd = destfile.fileno()
+    offset = 0
+    while offset < size:
+        count = min(COPY_CHUNKSIZE, size - offset)
+        inoffset = ctypes.c_int64(offset)
+        if backend == COPY_SENDFILE:
+            # sendfile writes at the position of outfd, which it advances
+            sent = function(outfd, infd, ctypes.byref(inoffset), count)
+        else:
+            outoffset = ctypes.c_int64(offset)
+            sent = function(infd, ctypes.byref(inoffset), outfd,
+                            ctypes.byref(outoffset), count, 0)
+        if sent < 0:
+            code = ctypes.get_errno()
+            if offset == 0 and code in UNSUPPORTED_ERRORS:
+                return False
+            raise OSError(code, os.strerror(code))
+        if sent == 0:
+            if offset == 0:
+                # some filesystems report success without copying
+                return False
+            break
+        offset = offset + sent
+    return True
+
+def copy_buffer(srcfile, destfile, size):
+    """
+    copies a file through a large reusable buffer
+    Parameters:
+    - srcfile
+      open source file
+    - destfile
+      open destination file
+    - size
+      size of the source file
+    Returns:
+    - True
+    """
+    buf = bytearray(COPY_CHUNKSIZE)
+    view = memoryview(buf)
+    while True:
+        count = srcfile.readinto(buf)
+        if not count:
+            break
+        destfile.write(view[:count])
+    return True
+
+def copy_file(srcpath, destpath):
+    """
+    copies a file. The backends are tried in the order reflink,
+    copy_file_range, sendfile and buffered copy.
+    Parameters:
+    - srcpath
+      path of the source file
+    - destpath
+      path of the destination file
+    Returns:
+    - name of the backend that copied the file
+    """
+    result = None
+    srcfile = open(srcpath, "rb", 0)
+    try:
+        destfile = open(destpath, "wb", 0)
+        try:
+            size = os.fstat(srcfile.fileno()).st_size
+            if size > 0 and copy_reflink(srcfile, destfile, size):
+                result = COPY_REFLINK
+            elif size > 0 and copy_kernel(COPY_FILE_RANGE, srcfile, destfile, size):
+                result = COPY_FILE_RANGE
+            elif size > 0 and copy_kernel(COPY_SENDFILE, srcfile, destfile, size):
+                result = COPY_SENDFILE
+            else:
+                srcfile.seek(0)
+                destfile.seek(0)
+                destfile.truncate(0)
+                copy_buffer(srcfile, destfile, size)
+                result = COPY_BUFFER
+        finally:
+            destfile.close()
+    finally:
+        srcfile.close()
+    debug("copy backend = %s", result)
+    return result
+
+class CopyStats(object):
+    """
+    counts the files and bytes copied by each backend
+    """
+
+    def __init__(self):
+        """
+        creates an instance
+        """
+        self._lock = Lock()
+        self._files = {}
+        self._bytes = {}
+        self._filebackends = {}
+        self._last = None
+
+    def add(self, backend, size, filepath = None):
+        """
+        counts a copied file
+        Parameters:
+        - backend
+          name of the backend
+        - size
+          size of the file
+        - filepath
+          optional path of the copied file
+        """
+        self._lock.acquire()
+        try:
+            self._files[backend] = self._files.get(backend, 0) + 1
+            self._bytes[backend] = self._bytes.get(backend, 0) + size
+            if filepath != None:
+                self._filebackends[filepath] = backend
+            self._last = backend
+        finally:
+            self._lock.release()
+
+    def get_file_backend(self, filepath):
+        """
+        Parameters:
+        - filepath
+          path of a copied file
+        Returns:
+        - backend that copied the file or None
+        """
+        return self._filebackends.get(filepath)
+
+    def get_files(self, backend):
+        """
+        Parameters:
+        - backend
+          name of a backend
+        Returns:
+        - count of files copied by the backend
+        """
+        return self._files.get(backend, 0)
+
+    def get_bytes(self, backend):
+        """
+        Parameters:
+        - backend
+          name of a backend
+        Returns:
+        - count of bytes copied by the backend
+        """
+        return self._bytes.get(backend, 0)
+
+    def get_last_backend(self):
+        """
+        Returns:
+        - backend that copied the last file
+        """
+        return self._last
+
+    def get_backends(self):
+        """
+        Returns:
+        - list of the backends that copied files
+        """
+        result = []
+        for backend in COPY_BACKENDS:
+            if backend in self._files:
+                result.append(backend)
+        return result
@@ -17,15 +17,74 @@
 # GNU General Public License for more details.
 
 import getpass
-import random
+import hashlib
+import hmac
+import multiprocessing
 import struct
+import os
 import os.path
 
+from threading import Lock
+
 from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from syncdebug import *
 
 # Constants for copy modes
 ENCRYPTION_EXTENSION = ".encrypt"
 
+# extension of temporary files during decryption
+DECRYPTION_EXTENSION = ".decrypt"
+
+# Container format for encrypted files. The file is split into chunks
+# that are encrypted and authenticated independently, so they can be
+# processed in parallel. Files without the header use the former
+# format <Q size><IV><AES-CBC>. The header is
+# <magic><version><key origin><chunk size><file size>.
+CONTAINER_MAGIC = "SSEC"
+CONTAINER_HEADER = struct.Struct("<4sBBIQ")
+CONTAINER_CHUNKSIZE = 1024 * 1024
+
+# versions of the container format. Chunks are stored as
+# <nonce><cipher text><tag>:
+# - CONTAINER_VERSION_HMAC: AES-CTR with HMAC-SHA256
+# - CONTAINER_VERSION_GCM:  AES-GCM. Empty files have one empty chunk,
+#                           so the header of every file is authenticated.
+CONTAINER_VERSION_HMAC = 2
+CONTAINER_VERSION_GCM = 3
+
+# sizes of the nonce and the tag of the chunks for each version
+CHUNK_LAYOUTS = { CONTAINER_VERSION_HMAC: (8, 32),
+                  CONTAINER_VERSION_GCM: (12, 16) }
+CHUNK_INDEX = struct.Struct("<Q")
+
+# AES-GCM is only provided by PyCryptodome
+if hasattr(AES, "MODE_GCM"):
+    CONTAINER_VERSION = CONTAINER_VERSION_GCM
+else:
+    CONTAINER_VERSION = CONTAINER_VERSION_HMAC
+
+# origins of the key a container was encrypted with:
+# - KEY_ORIGIN_PASSWORD: the normalized password of former versions,
+#                        used while the server has no salt
+# - KEY_ORIGIN_KDF:      the key derived from the password and the salt
+KEY_ORIGIN_PASSWORD = 0
+KEY_ORIGIN_KDF = 1
+
+# minimum count of chunks to use a process pool
+PARALLEL_MIN_CHUNKS = 4
+
+# parameters of the key derivation. The salt is created once per server.
+KDF_NAME = "pbkdf2-sha256"
+KDF_ITERATIONS = 200000
+KDF_SALT_SIZE = 16
+KDF_KEY_SIZE = 32
+
+# format versions returned by get_format_version()
+FORMAT_LEGACY = 1
+FORMAT_CONTAINER = CONTAINER_VERSION
+
 # helper functions for encryption and decryption
 
 def normalize_key(key):
@@ -70,28 +129,131 @@ def split_line(line, length):
         result.append(line[pos:])
     return result
 
-def encrypt_file(srcfilename, destfilename, key, chunksize=64*1024):
-    """ 
-    encrypts a file using AES with a given key
+class KeyCache(object):
+    """
+    caches derived keys, so the key derivation runs once per password
+    and salt and not for every file
+    """
+
+    def __init__(self):
+        """
+        creates an instance
+        """
+        self._lock = Lock()
+        self._keys = {}
+
+    def get_cache_key(self, password, salt, iterations):
+        """
+        Parameters:
+        - password
+          password of the user
+        - salt
+          salt of the server
+        - iterations
+          count of iterations of the key derivation
+        Returns:
+        - key of the cache entry. The password itself isn't stored.
+        """
+        digest = hmac.new(salt, password, hashlib.sha256).digest()
+        return (digest, salt, iterations)
+
+    def get_key(self, password, salt, iterations):
+        """
+        returns a derived key and derives it only if it isn't cached
+        Parameters:
+        - password
+          password of the user
+        - salt
+          salt of the server
+        - iterations
+          count of iterations of the key derivation
+        Returns:
+        - derived key
+        """
+        cachekey = self.get_cache_key(password, salt, iterations)
+        self._lock.acquire()
+        try:
+            key = self._keys.get(cachekey)
+            if key == None:
+                debug("derive key")
+                key = hashlib.pbkdf2_hmac("sha256", password, salt,
+                                          iterations, KDF_KEY_SIZE)
+                self._keys[cachekey] = key
+            return key
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        removes all keys
+        """
+        self._lock.acquire()
+        try:
+            self._keys = {}
+        finally:
+            self._lock.release()
+
+# keys derived in this process
+key_cache = KeyCache()
+
+def create_salt():
+    """
+    Returns:
+    - new random salt for the key derivation
+    """
+    return os.urandom(KDF_SALT_SIZE)
+
+def format_salt(salt, iterations=KDF_ITERATIONS):
+    """
+    creates the content of a salt file
     Parameters:
-    - srcfilename
-      name of the file to encrypt
-    - destfilename
-      name of the destination file
+    - salt
+      salt of the key derivation
+    - iterations
+      count of iterations of the key derivation
+    Returns:
+    - line with the name of the key derivation, the iterations and
+      the salt
+    """
+    return "%s %i %s\n" % (KDF_NAME, iterations, salt.encode("hex"))
+
+def parse_salt(content):
+    """
+    parses the content of a salt file
+    Parameters:
+    - content
+      content of a salt file
+    Returns:
+    - tuple of salt and iterations or None if the content is invalid
+    """
+    fields = content.split()
+    if len(fields) != 3 or fields[0] != KDF_NAME or not fields[1].isdigit():
+        return None
+    try:
+        salt = fields[2].decode("hex")
+    except TypeError:
+        return None
+    return (salt, int(fields[1]))
+
+def encrypt_stream(srcfile, destfile, filesize, key, chunksize=64*1024):
+    """
+    encrypts the content of an open file using AES with a given key and
+    writes it to another open file
+    Parameters:
+    - srcfile
+      open file to read the plain text from
+    - destfile
+      open file to write the cipher text to
+    - filesize
+      size of the plain text
     - key
       encryption key. The encryption key must be 16, 24 or 32
       bytes long.
     - chunksize
       size of the chunks to read and encrypt the file
     """
-    rlist = []
-    for i in range(16):
-        rlist.append(chr(random.randint(0, 255)))
-    iv = "".join(rlist)
+    iv = os.urandom(16)
     encryptor = AES.new(key, AES.MODE_CBC, iv)
-    filesize = os.path.getsize(srcfilename)
-    srcfile = open(srcfilename, "rb")
-    destfile = open(destfilename, "wb")
     destfile.write(struct.pack('<Q', filesize))
     destfile.write(iv)
     while True:
@@ -101,36 +263,469 @@ def encrypt_file(srcfilename, destfilename, key, chunksize=64*1024):
         elif len(chunk) % 16 != 0:
             chunk += ' ' * (16 - len(chunk) % 16)
         destfile.write(encryptor.encrypt(chunk))
-    srcfile.close()
-    destfile.close()
 
-def decrypt_file(srcfilename, destfilename, key, chunksize=64*1024):
+# size of the header <Q size><IV> of the former format
+LEGACY_HEADER_SIZE = struct.calcsize('<Q') + 16
+
+def is_legacy_size(origsize, ciphertextsize):
     """
-    decrypt a file using AES with a given key
+    checks if the original size in the header of the former format
+    matches the size of the cipher text
     Parameters:
-    - srcfilename
-      name of the file to decrypt
-    - destfilename
-      name of the destination file
+    - origsize
+      original size stored in the header
+    - ciphertextsize
+      size of the cipher text after the header
+    Returns:
+    - True:  sizes match
+    - False: file is damaged or uses another format
+    """
+    return ciphertextsize % 16 == 0 and \
+           origsize <= ciphertextsize < origsize + 16
+
+def decrypt_stream(srcfile, destfile, key, chunksize=64*1024):
+    """
+    decrypts the content of an open file using AES with a given key
+    and writes it to another open file
+    Parameters:
+    - srcfile
+      open file to read the cipher text from
+    - destfile
+      open file to write the plain text to. The file is truncated
+      to the original size.
     - key
       encryption key. The encryption key must be 16, 24 or 32
       bytes long.
     - chunksize
-      size of the chunks to read and encrypt the file
+      size of the chunks to read and decrypt the file
+    Raises:
+    - ValueError if the original size doesn't match the cipher text
     """
-    srcfile = open(srcfilename, "rb")
-    origsize = struct.unpack('<Q', srcfile.read(struct.calcsize('Q')))[0]
-    iv = srcfile.read(16)
+    header = srcfile.read(LEGACY_HEADER_SIZE)
+    if len(header) < LEGACY_HEADER_SIZE:
+        raise ValueError("encrypted file is truncated")
+    origsize = struct.unpack('<Q', header[:8])[0]
+    iv = header[8:]
+    ciphertextsize = os.fstat(srcfile.fileno()).st_size - LEGACY_HEADER_SIZE
+    if not is_legacy_size(origsize, ciphertextsize):
+        raise ValueError("encrypted file is damaged")
     decryptor = AES.new(key, AES.MODE_CBC, iv)
-    destfile = open(destfilename, "wb")
     while True:
         chunk = srcfile.read(chunksize)
         if len(chunk) == 0:
             break
         destfile.write(decryptor.decrypt(chunk))
     destfile.truncate(origsize)
-    srcfile.close()
-    destfile.close()
+
+def create_mac_key(key):
+    """
+    derives the key for the chunk MACs from the encryption key
+    Parameters:
+    - key
+      encryption key
+    Returns:
+    - key for HMAC-SHA256
+    """
+    return hmac.new(key, "simplesync chunk mac", hashlib.sha256).digest()
+
+def get_chunk_count(filesize, chunksize, version=CONTAINER_VERSION):
+    """
+    Parameters:
+    - filesize
+      size of the plain text
+    - chunksize
+      size of the plain text chunks
+    - version
+      version of the container format
+    Returns:
+    - count of chunks in a container
+    """
+    result = (filesize + chunksize - 1) // chunksize
+    if version == CONTAINER_VERSION_GCM:
+        result = max(result, 1)
+    return result
+
+def get_chunk_offset(index, chunksize, version=CONTAINER_VERSION):
+    """
+    Parameters:
+    - index
+      index of a chunk
+    - chunksize
+      size of the plain text chunks
+    - version
+      version of the container format
+    Returns:
+    - offset of the chunk in a container file
+    """
+    (noncesize, tagsize) = CHUNK_LAYOUTS[version]
+    return CONTAINER_HEADER.size + index * (noncesize + chunksize + tagsize)
+
+def get_container_size(filesize, chunksize, version=CONTAINER_VERSION):
+    """
+    Parameters:
+    - filesize
+      size of the plain text
+    - chunksize
+      size of the plain text chunks
+    - version
+      version of the container format
+    Returns:
+    - size of the container file
+    """
+    (noncesize, tagsize) = CHUNK_LAYOUTS[version]
+    count = get_chunk_count(filesize, chunksize, version)
+    return CONTAINER_HEADER.size + filesize + count * (noncesize + tagsize)
+
+def read_container_header(filename):
+    """
+    reads the header of a container file
+    Parameters:
+    - filename
+      name of an encrypted file
+    Returns:
+    - tuple of header, version, chunksize, filesize and key origin or
+      None if the file uses the former format
+    Raises:
+    - ValueError if the file starts with the magic but its header or
+      size is damaged
+    """
+    f = open(filename, "rb")
+    try:
+        header = f.read(CONTAINER_HEADER.size)
+        containersize = os.fstat(f.fileno()).st_size
+    finally:
+        f.close()
+    if len(header) < CONTAINER_HEADER.size:
+        return None
+    (magic, version, keyorigin, chunksize, filesize) = \
+        CONTAINER_HEADER.unpack(header)
+    if magic != CONTAINER_MAGIC:
+        return None
+    if not version in CHUNK_LAYOUTS or chunksize == 0 or \
+       not keyorigin in [ KEY_ORIGIN_PASSWORD, KEY_ORIGIN_KDF ] or \
+       containersize != get_container_size(filesize, chunksize, version):
+        origsize = struct.unpack('<Q', header[:8])[0]
+        if is_legacy_size(origsize, containersize - LEGACY_HEADER_SIZE):
+            # a file of the former format that happens to start with the magic
+            return None
+        raise ValueError("damaged container: " + filename)
+    if version == CONTAINER_VERSION_GCM and not hasattr(AES, "MODE_GCM"):
+        raise ValueError("AES-GCM is not supported to decrypt " + filename)
+    return (header, version, chunksize, filesize, keyorigin)
+
+def get_format_version(filename):
+    """
+    Parameters:
+    - filename
+      name of an encrypted file
+    Returns:
+    - version of the container format or FORMAT_LEGACY
+    """
+    container = read_container_header(filename)
+    if container:
+        return container[1]
+    return FORMAT_LEGACY
+
+def get_key_origin(filename):
+    """
+    Parameters:
+    - filename
+      name of an encrypted file
+    Returns:
+    - origin of the key the file was encrypted with. Files of the
+      former format always use KEY_ORIGIN_PASSWORD.
+    """
+    container = read_container_header(filename)
+    if container:
+        return container[4]
+    return KEY_ORIGIN_PASSWORD
+
+def create_chunk_mac(mackey, header, index, nonce, ciphertext):
+    """
+    creates the MAC of a chunk. The MAC covers the container header and
+    the chunk index, so chunks can't be reordered or moved to other files
+    of a different size.
+    Parameters:
+    - mackey
+      key for HMAC-SHA256
+    - header
+      packed container header
+    - index
+      index of the chunk
+    - nonce
+      nonce of the chunk
+    - ciphertext
+      encrypted chunk
+    Returns:
+    - MAC of the chunk
+    """
+    mac = hmac.new(mackey, header, hashlib.sha256)
+    mac.update(CHUNK_INDEX.pack(index))
+    mac.update(nonce)
+    mac.update(ciphertext)
+    return mac.digest()
+
+def create_chunk_cipher(key, nonce):
+    """
+    Parameters:
+    - key
+      encryption key
+    - nonce
+      nonce of a chunk
+    Returns:
+    - AES-CTR cipher for the chunk
+    """
+    counter = Counter.new(64, prefix=nonce, initial_value=0)
+    return AES.new(key, AES.MODE_CTR, counter=counter)
+
+def encrypt_chunk(key, mackey, header, version, index, plaintext):
+    """
+    encrypts and authenticates a chunk
+    Parameters:
+    - key
+      encryption key
+    - mackey
+      key for the MACs of CONTAINER_VERSION_HMAC
+    - header
+      packed container header
+    - version
+      version of the container format
+    - index
+      index of the chunk
+    - plaintext
+      content of the chunk
+    Returns:
+    - tuple of nonce, cipher text and tag
+    """
+    nonce = os.urandom(CHUNK_LAYOUTS[version][0])
+    if version == CONTAINER_VERSION_GCM:
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header + CHUNK_INDEX.pack(index))
+        (ciphertext, tag) = cipher.encrypt_and_digest(plaintext)
+    else:
+        ciphertext = create_chunk_cipher(key, nonce).encrypt(plaintext)
+        tag = create_chunk_mac(mackey, header, index, nonce, ciphertext)
+    return (nonce, ciphertext, tag)
+
+def decrypt_chunk(key, mackey, header, version, index, nonce, ciphertext, tag):
+    """
+    verifies and decrypts a chunk
+    Parameters:
+    - key
+      encryption key
+    - mackey
+      key for the MACs of CONTAINER_VERSION_HMAC
+    - header
+      packed container header
+    - version
+      version of the container format
+    - index
+      index of the chunk
+    - nonce
+      nonce of the chunk
+    - ciphertext
+      encrypted chunk
+    - tag
+      authentication tag of the chunk
+    Returns:
+    - content of the chunk
+    Raises:
+    - ValueError if the chunk was modified or the key is wrong
+    """
+    if version == CONTAINER_VERSION_GCM:
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header + CHUNK_INDEX.pack(index))
+        try:
+            return cipher.decrypt_and_verify(ciphertext, tag)
+        except ValueError:
+            raise ValueError("chunk %i is corrupt" % index)
+    expected = create_chunk_mac(mackey, header, index, nonce, ciphertext)
+    if not hmac.compare_digest(tag, expected):
+        raise ValueError("chunk %i is corrupt" % index)
+    return create_chunk_cipher(key, nonce).decrypt(ciphertext)
+
+def crypt_chunks(task):
+    """
+    encrypts or decrypts a range of chunks. Every call opens its own
+    files and writes to fixed offsets, so ranges can be processed by
+    several processes in parallel. Every chunk is verified before it
+    is written.
+    Parameters:
+    - task
+      tuple of encryptflag, source filename, destination filename, key,
+      container header and list of chunk indices
+    """
+    (encryptflag, srcfilename, destfilename, key, header, indices) = task
+    (magic, version, keyorigin, chunksize, filesize) = \
+        CONTAINER_HEADER.unpack(header)
+    (noncesize, tagsize) = CHUNK_LAYOUTS[version]
+    mackey = create_mac_key(key)
+    srcfile = open(srcfilename, "rb")
+    try:
+        destfile = open(destfilename, "r+b")
+        try:
+            for index in indices:
+                plainoffset = index * chunksize
+                length = min(chunksize, filesize - plainoffset)
+                chunkoffset = get_chunk_offset(index, chunksize, version)
+                if encryptflag:
+                    srcfile.seek(plainoffset)
+                    plaintext = srcfile.read(length)
+                    (nonce, ciphertext, tag) = encrypt_chunk(key, mackey,
+                        header, version, index, plaintext)
+                    destfile.seek(chunkoffset)
+                    destfile.write(nonce)
+                    destfile.write(ciphertext)
+                    destfile.write(tag)
+                else:
+                    srcfile.seek(chunkoffset)
+                    nonce = srcfile.read(noncesize)
+                    ciphertext = srcfile.read(length)
+                    tag = srcfile.read(tagsize)
+                    try:
+                        plaintext = decrypt_chunk(key, mackey, header, version,
+                            index, nonce, ciphertext, tag)
+                    except ValueError, e:
+                        raise ValueError("%s of %s" % (str(e), srcfilename))
+                    destfile.seek(plainoffset)
+                    destfile.write(plaintext)
+        finally:
+            destfile.close()
+    finally:
+        srcfile.close()
+
+def run_chunk_tasks(encryptflag, srcfilename, destfilename, key, header,
+                    indices, processes, pool=None):
+    """
+    processes chunks either in this process or in a process pool
+    Parameters:
+    - encryptflag
+      True to encrypt and False to decrypt
+    - srcfilename
+      name of the file to read
+    - destfilename
+      name of the file to write
+    - key
+      encryption key
+    - header
+      packed container header
+    - indices
+      list of the chunk indices to process
+    - processes
+      count of processes. None or 1 processes the chunks in this
+      process.
+    - pool
+      process pool with the given count of processes that is kept
+      over several files or None to create a pool for this call
+    """
+    if processes == None or processes <= 1 or \
+            len(indices) < PARALLEL_MIN_CHUNKS:
+        crypt_chunks((encryptflag, srcfilename, destfilename, key, header,
+                      indices))
+        return
+    processes = min(processes, len(indices))
+    tasks = []
+    for i in range(processes):
+        tasks.append((encryptflag, srcfilename, destfilename, key, header,
+                      indices[i::processes]))
+    if pool != None:
+        pool.map(crypt_chunks, tasks)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(crypt_chunks, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def encrypt_file(srcfilename, destfilename, key,
+                 chunksize=CONTAINER_CHUNKSIZE, processes=None, pool=None,
+                 keyorigin=KEY_ORIGIN_PASSWORD):
+    """ 
+    encrypts a file using AES with a given key. The file is written in
+    the container format with independently encrypted chunks.
+    Parameters:
+    - srcfilename
+      name of the file to encrypt
+    - destfilename
+      name of the destination file
+    - key
+      encryption key. The encryption key must be 16, 24 or 32
+      bytes long.
+    - chunksize
+      size of the chunks to encrypt
+    - processes
+      count of processes or None to process the file in this process
+    - pool
+      process pool with the given count of processes or None
+    - keyorigin
+      origin of the key that is stored in the header, see KEY_ORIGIN_KDF
+    """
+    filesize = os.path.getsize(srcfilename)
+    header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION,
+                                   keyorigin, chunksize, filesize)
+    destfile = open(destfilename, "wb")
+    try:
+        destfile.write(header)
+        destfile.truncate(get_container_size(filesize, chunksize))
+    finally:
+        destfile.close()
+    indices = range(get_chunk_count(filesize, chunksize))
+    run_chunk_tasks(True, srcfilename, destfilename, key, header, indices,
+                    processes, pool)
+
+def decrypt_file(srcfilename, destfilename, key, chunksize=64*1024,
+                 processes=None, pool=None):
+    """
+    decrypt a file using AES with a given key. Both the container
+    format and the former CBC format are supported. The file is
+    decrypted into a temporary file that replaces the destination file
+    only if all chunks were verified.
+    Parameters:
+    - srcfilename
+      name of the file to decrypt
+    - destfilename
+      name of the destination file
+    - key
+      encryption key. The encryption key must be 16, 24 or 32
+      bytes long.
+    - chunksize
+      size of the chunks to read files of the former format
+    - processes
+      count of processes or None to process the file in this process
+    - pool
+      process pool with the given count of processes or None
+    Raises:
+    - ValueError if the file was modified or the key is wrong. The
+      destination file is unchanged in this case.
+    """
+    temppath = destfilename + DECRYPTION_EXTENSION
+    try:
+        container = read_container_header(srcfilename)
+        if container:
+            (header, version, containerchunksize, filesize) = container[:4]
+            destfile = open(temppath, "wb")
+            try:
+                destfile.truncate(filesize)
+            finally:
+                destfile.close()
+            indices = range(get_chunk_count(filesize, containerchunksize,
+                                            version))
+            run_chunk_tasks(False, srcfilename, temppath, key, header,
+                            indices, processes, pool)
+        else:
+            srcfile = open(srcfilename, "rb")
+            destfile = open(temppath, "wb")
+            try:
+                decrypt_stream(srcfile, destfile, key, chunksize)
+            finally:
+                srcfile.close()
+                destfile.close()
+        os.rename(temppath, destfilename)
+    except:
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        raise
 
 class SyncCrypt(object):
     """
@@ -145,7 +740,65 @@ class SyncCrypt(object):
           determines if a GUI is used for user input
         """
         self._guiflag = guiflag
-        self._key = None
+        self._password = None
+        self._salt = None
+        self._iterations = KDF_ITERATIONS
+        self._processes = None
+        self._pool = None
+
+    def set_processes(self, processes):
+        """
+        sets the count of processes to encrypt and decrypt large files
+        Parameters:
+        - processes
+          count of processes or None to use all processors
+        """
+        self._processes = processes
+
+    def start_pool(self):
+        """
+        creates the process pool that encrypts and decrypts the chunks
+        of all files of a sync session. The pool has to be created
+        before any other threads are started. Without a pool the chunks
+        are processed in the calling thread.
+        """
+        if self._pool != None:
+            return
+        processes = self.get_processes()
+        if processes > 1:
+            debug_value("crypt processes", processes)
+            self._pool = multiprocessing.Pool(processes)
+
+    def stop_pool(self):
+        """
+        terminates the process pool of the sync session
+        """
+        if self._pool == None:
+            return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def get_processes(self):
+        """
+        returns the count of processes of the pool
+        Returns:
+        - count of processes
+        """
+        if self._processes == None:
+            return multiprocessing.cpu_count()
+        return self._processes
+
+    def get_pool_arguments(self):
+        """
+        returns the keyword arguments to process chunks in the pool of
+        the sync session
+        Returns:
+        - dictionary with the count of processes and the pool
+        """
+        if self._pool == None:
+            return {}
+        return {"processes": self.get_processes(), "pool": self._pool}
 
     def get_decrypted_filename(self, filename):
         """
@@ -167,7 +820,71 @@ class SyncCrypt(object):
         - key
           password to set
         """
-        self._key = normalize_key(key)
+        self._password = key
+
+    def has_password(self):
+        """
+        Returns:
+        - True:  password was set or entered
+        - False: password is unknown
+        """
+        return self._password != None
+
+    def set_salt(self, salt, iterations=KDF_ITERATIONS):
+        """
+        sets the salt of the server to derive the key from
+        Parameters:
+        - salt
+          salt of the key derivation or None to use the keys of former
+          versions
+        - iterations
+          count of iterations of the key derivation
+        """
+        self._salt = salt
+        self._iterations = iterations
+
+    def get_key(self):
+        """
+        Returns:
+        - key derived from the password and the salt. Without a salt
+          the normalized password is used like former versions did.
+        """
+        if self._salt == None:
+            return self.get_legacy_key()
+        return key_cache.get_key(self._password, self._salt, self._iterations)
+
+    def get_legacy_key(self):
+        """
+        Returns:
+        - key of files that were encrypted by former versions
+        """
+        return normalize_key(self._password)
+
+    def get_key_origin(self):
+        """
+        Returns:
+        - origin of the key that get_key() returns
+        """
+        if self._salt == None:
+            return KEY_ORIGIN_PASSWORD
+        return KEY_ORIGIN_KDF
+
+    def get_origin_key(self, keyorigin):
+        """
+        returns the key of a given origin
+        Parameters:
+        - keyorigin
+          origin of the key, see KEY_ORIGIN_KDF
+        Returns:
+        - key to decrypt files of the origin
+        Raises:
+        - ValueError if the key is derived but the salt is unknown
+        """
+        if keyorigin == KEY_ORIGIN_PASSWORD:
+            return self.get_legacy_key()
+        if self._salt == None:
+            raise ValueError("the salt of the server is unknown")
+        return key_cache.get_key(self._password, self._salt, self._iterations)
 
     def enter_password(self, repeat=False):
         """
@@ -176,7 +893,7 @@ class SyncCrypt(object):
         - repeat
           prompts to repeat the password
         """
-        if guiflag:
+        if self._guiflag:
             # TODO: implement GUI
             pass
         else:
@@ -185,12 +902,12 @@ class SyncCrypt(object):
                     key1 = getpass.getpass("Enter password: ")
                     key2 = getpass.getpass("Repeat password: ")
                     if key1 == key2:
-                        self._key = key1
+                        self.set_password(key1)
                         break
                     else:
                         print "Entered password don't match."
             else:
-                self._key = getpass.getpass("Enter password: ")
+                self.set_password(getpass.getpass("Enter password: "))
 
     def encrypt_file(self, filename):
         """
@@ -203,11 +920,43 @@ class SyncCrypt(object):
         - name of the encrypted file
         """
         destfilename = filename + ENCRYPTION_EXTENSION
-        if not self._key:
+        if not self.has_password():
             self.enter_password(True)
-        encrypt_file(filename, destfilename, self._key)
+        encrypt_file(filename, destfilename, self.get_key(),
+                     keyorigin=self.get_key_origin(),
+                     **self.get_pool_arguments())
         return destfilename
 
+    def encrypt_to(self, srcfilename, destfilename):
+        """
+        encrypts a file directly into a destination file without
+        writing a temporary file
+        Parameters:
+        - srcfilename
+          name of the file to encrypt
+        - destfilename
+          name of the encrypted file to write
+        """
+        if not self.has_password():
+            self.enter_password(True)
+        encrypt_file(srcfilename, destfilename, self.get_key(),
+                     keyorigin=self.get_key_origin(),
+                     **self.get_pool_arguments())
+
+    def decrypt_to(self, srcfilename, destfilename):
+        """
+        decrypts a file directly into a destination file without
+        writing a temporary file
+        Parameters:
+        - srcfilename
+          name of the encrypted file
+        - destfilename
+          name of the decrypted file to write
+        """
+        if not self.has_password():
+            self.enter_password()
+        self.decrypt_with_key(srcfilename, destfilename)
+
     def decrypt_file(self, filename):
         """
         decrypts a file
@@ -221,8 +970,24 @@ class SyncCrypt(object):
         flen = len(filename)
         elen = len(ENCRYPTION_EXTENSION)
         destfilename = self.get_decrypted_filename(filename)
-        if not self._key:
+        if not self.has_password():
             self.enter_password()
-        decrypt_file(filename, destfilename, self._key)
+        self.decrypt_with_key(filename, destfilename)
         return destfilename
 
+    def decrypt_with_key(self, srcfilename, destfilename):
+        """
+        decrypts a file with the key whose origin is stored in the
+        container header. Files of the former format are decrypted with
+        the key of former versions.
+        Parameters:
+        - srcfilename
+          name of the encrypted file
+        - destfilename
+          name of the decrypted file to write
+        Raises:
+        - ValueError if the file was modified or the key is wrong
+        """
+        key = self.get_origin_key(get_key_origin(srcfilename))
+        decrypt_file(srcfilename, destfilename, key,
+                     **self.get_pool_arguments())
@@ -14,12 +14,26 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
-import gtk
+import errno
+import json
+import os
+import os.path
 import socket
 import sys
 import time
 
-from threading import Thread
+from threading import Condition, Thread
+
+try:
+    import gtk
+except ImportError:
+    gtk = None
+
+from main import get_concurrency, get_hidden_policy, setup_checksum
+from main import OutputBase, CONFIG_KEY_ENCRYPTION, PARAMETER_CONFIG
+from syncconfig import *
+from syncjournal import *
+from syncprocessor import *
 
 # state of the server
 STATE_NOT_STARTED = 0
@@ -27,25 +41,295 @@ STATE_RUNNING = 1
 STATE_STOPPING = 2
 STATE_PAUSING = 3
 
+STATE_NAMES = { STATE_NOT_STARTED: "not started", STATE_RUNNING: "running",
+                STATE_STOPPING: "stopping", STATE_PAUSING: "pausing" }
+
 # commands
 COMMAND_START = "start"
 COMMAND_STOP = "stop"
 COMMAND_PAUSE = "pause"
 COMMAND_CONTINUE = "continue"
+COMMAND_RESUME = "resume"
+COMMAND_SYNC_NOW = "sync-now"
+COMMAND_STATUS = "status"
+
+COMMAND_LIST = [ COMMAND_START, COMMAND_STOP, COMMAND_PAUSE, COMMAND_CONTINUE,
+                 COMMAND_RESUME, COMMAND_SYNC_NOW, COMMAND_STATUS ]
+
+# path of the Unix domain socket to control the daemon
+CONTROL_SOCKET_PATH = "~/.simplesyncd.sock"
+
+# results of control requests
+RESULT_OK = "ok"
+RESULT_ERROR = "error"
+
+# maximum size of a control request
+CONTROL_REQUEST_SIZE = 4096
+
+# seconds a control connection may take
+CONTROL_TIMEOUT = 5.0
+
+# seconds between two full syncs that catch changes the journal missed
+FULL_SYNC_INTERVAL = 3600
+
+# configuration key of the seconds between two full syncs. The interval
+# of a single directory is set by the key "interval:<directory>".
+CONFIG_KEY_INTERVAL = "interval"
+
+# configuration key of the count of directories synchronized at once
+CONFIG_KEY_DAEMON_CONCURRENCY = "daemon-concurrency"
+
+# seconds to wait after the first failed sync of a directory. The delay
+# doubles with every further failure.
+BACKOFF_DELAY = 30
+
+# maximum seconds to wait after failed syncs
+BACKOFF_MAX_DELAY = 3600
+
+def get_interval(config, directory):
+    """
+    returns the seconds between two full syncs of a directory
+    Parameters:
+    - config
+      configuration entry to use
+    - directory
+      directory to synchronize
+    Returns:
+    - interval in seconds
+    """
+    for key in [ CONFIG_KEY_INTERVAL + ":" + directory, CONFIG_KEY_INTERVAL ]:
+        value = config.get_value(key)
+        if value:
+            try:
+                return max(1, int(value))
+            except ValueError:
+                debug_error("invalid value of " + key + ": " + value)
+    return FULL_SYNC_INTERVAL
+
+def get_daemon_concurrency(config):
+    """
+    returns the count of directories that are synchronized at once
+    Parameters:
+    - config
+      configuration entry to use
+    Returns:
+    - count of directories
+    """
+    value = config.get_value(CONFIG_KEY_DAEMON_CONCURRENCY)
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            debug_error("invalid value of " + CONFIG_KEY_DAEMON_CONCURRENCY +
+                        ": " + value)
+    return 1
+
+class DirectorySchedule(object):
+    """
+    schedule of a directory that is synchronized by the daemon. A
+    directory is synchronized completely at the start and after its
+    interval and only its changed subdirectories otherwise. After
+    failed syncs the directory waits with an exponential backoff.
+    """
+
+    def __init__(self, directory, interval = FULL_SYNC_INTERVAL):
+        """
+        creates an instance
+        Parameters:
+        - directory
+          directory to synchronize
+        - interval
+          seconds between two full syncs
+        """
+        self._directory = directory
+        self._interval = interval
+        self._fullsync = True
+        self._dirty = {}
+        self._next_full_sync = 0
+        self._not_before = 0
+        self._failures = 0
+        self._last_sync = None
+        self._last_error = None
+
+    def get_directory(self):
+        return self._directory
+
+    def get_interval(self):
+        return self._interval
+
+    def get_failures(self):
+        return self._failures
+
+    def get_not_before(self):
+        return self._not_before
+
+    def get_last_sync(self):
+        return self._last_sync
+
+    def get_last_error(self):
+        return self._last_error
+
+    def contains(self, directory):
+        """
+        Parameters:
+        - directory
+          path of a directory
+        Returns:
+        - True:  directory is the scheduled directory or below it
+        - False: directory is outside of the scheduled directory
+        """
+        return (directory == self._directory or
+                directory.startswith(self._directory + os.sep))
+
+    def add_dirty_directories(self, dirtydirectories):
+        """
+        records the changed directories that are below the scheduled
+        directory
+        Parameters:
+        - dirtydirectories
+          list of changed directories
+        """
+        for directory in dirtydirectories:
+            if self.contains(directory):
+                self._dirty[directory] = True
+
+    def mark_full_sync(self):
+        """
+        requests a full sync, e.g. after changes were lost
+        """
+        self._fullsync = True
+
+    def request_sync(self):
+        """
+        requests a full sync as soon as possible, even if the directory
+        waits after errors
+        """
+        self._fullsync = True
+        self._not_before = 0
+
+    def is_due(self, now):
+        """
+        Parameters:
+        - now
+          current time
+        Returns:
+        - True:  directory has to be synchronized
+        - False: directory didn't change or waits after errors
+        """
+        if now < self._not_before:
+            return False
+        return (self._fullsync or now >= self._next_full_sync or
+                len(self._dirty) > 0)
 
-COMMAND_LIST = [ COMMAND_START, COMMAND_STOP, COMMAND_PAUSE, COMMAND_CONTINUE ]
+    def get_delay(self, now):
+        """
+        Parameters:
+        - now
+          current time
+        Returns:
+        - seconds until the directory is due without further changes
+        """
+        if self._fullsync or len(self._dirty) > 0:
+            due = self._not_before
+        else:
+            due = max(self._not_before, self._next_full_sync)
+        return max(0, due - now)
+
+    def take_work(self, now):
+        """
+        returns the work of the next sync and clears it
+        Parameters:
+        - now
+          current time
+        Returns:
+        - sorted list of changed directories or None for a full sync
+        """
+        if self._fullsync or now >= self._next_full_sync:
+            result = None
+            self._fullsync = False
+            self._next_full_sync = now + self._interval
+        else:
+            result = self._dirty.keys()
+            result.sort()
+        self._dirty = {}
+        return result
+
+    def succeeded(self, now):
+        """
+        records a successful sync
+        Parameters:
+        - now
+          current time
+        """
+        self._failures = 0
+        self._not_before = 0
+        self._last_sync = now
+
+    def failed(self, now, work, error = None):
+        """
+        records a failed sync. The work is kept for the next try.
+        Parameters:
+        - now
+          current time
+        - work
+          list of changed directories or None for a full sync
+        - error
+          message of the last error
+        """
+        self._failures = self._failures + 1
+        self._last_error = error
+        delay = min(BACKOFF_MAX_DELAY,
+                    BACKOFF_DELAY * 2 ** min(self._failures - 1, 16))
+        self._not_before = now + delay
+        if work == None:
+            self._fullsync = True
+        else:
+            self.add_dirty_directories(work)
+        debug_value("retry sync of " + self._directory + " in seconds", delay)
+
+    def get_status(self, now):
+        """
+        Parameters:
+        - now
+          current time
+        Returns:
+        - dictionary with the state of the schedule
+        """
+        return { "directory": self._directory,
+                 "interval": self._interval,
+                 "failures": self._failures,
+                 "last_sync": self._last_sync,
+                 "last_error": self._last_error,
+                 "pending": len(self._dirty),
+                 "due_in": self.get_delay(now) }
 
 class DaemonSyncThread(object):
     """
     thread to syncronize the files
     """
 
-    def __init__(self):
+    def __init__(self, config = None, directories = None, root = None):
         """
         creates an instance
+        Parameters:
+        - config
+          configuration entry to use
+        - directories
+          list of directories to synchronize
+        - root
+          root directory of the synchronized files
         """
         self._state = STATE_NOT_STARTED
         self._sleep_interval = 10
+        self._config = config
+        self._directories = directories or []
+        self._root = root or os.path.expanduser("~")
+        self._journal = None
+        self._schedules = []
+        self._running = {}
+        self._processors = {}
+        self._lock = Condition()
+        self._concurrency = 1
 
     def is_running(self):
         """
@@ -55,6 +339,14 @@ class DaemonSyncThread(object):
         """
         return self._state != STATE_STOPPING
 
+    def is_pausing(self):
+        """
+        Returns:
+        - True:  no syncs are started
+        - False: syncs are started
+        """
+        return self._state == STATE_PAUSING
+
     def stop(self):
         """
         signals the thread to stop
@@ -63,141 +355,658 @@ class DaemonSyncThread(object):
 
     def start_pausing(self):
         """
-        signals the thread to pause
+        signals the thread to pause. Running syncs are finished, but
+        no new syncs are started. Changes are still recorded.
         """
-        self._state = STATE_PAUSING
+        if self._state != STATE_STOPPING:
+            self._state = STATE_PAUSING
 
     def stop_pausing(self):
         """
         signals the thread to stop pausing
         """
-        self._state = STATE_RUNNING
+        if self._state != STATE_STOPPING:
+            self._state = STATE_RUNNING
+
+    def get_journal(self):
+        """
+        Returns:
+        - ChangeJournal with the changed directories
+        """
+        return self._journal
+
+    def get_schedules(self):
+        """
+        Returns:
+        - list of the DirectorySchedule of the directories
+        """
+        return self._schedules
+
+    def get_schedule(self, directory):
+        """
+        Parameters:
+        - directory
+          synchronized directory
+        Returns:
+        - DirectorySchedule of the directory or None
+        """
+        directory = os.path.normpath(directory)
+        for schedule in self._schedules:
+            if schedule.get_directory() == directory:
+                return schedule
+        return None
+
+    def init_journal(self):
+        """
+        creates the journal and watches the directories to synchronize
+        """
+        hiddenpolicy = get_hidden_policy(self._config)
+        self._journal = ChangeJournal(hiddenpolicy)
+        for directory in self._directories:
+            self._journal.add_directory(directory)
+        if self._config.get_value(CONFIG_KEY_TYPE) == CONFIG_VALUE_FILE:
+            serverdirectory = self._config.get_value(CONFIG_KEY_SERVER_DIRECTORY)
+            if serverdirectory and os.path.isdir(serverdirectory):
+                self._journal.add_server_directory(serverdirectory, self._root)
+
+    def init_schedules(self):
+        """
+        creates the schedules of the directories to synchronize
+        """
+        self._concurrency = get_daemon_concurrency(self._config)
+        self._schedules = []
+        encryption = self._config.get_value(CONFIG_KEY_ENCRYPTION)
+        if encryption and encryption.lower().strip() == "true":
+            # the daemon can't ask for the password
+            debug_error("encrypted configurations are not synchronized")
+            return
+        for directory in self._directories:
+            interval = get_interval(self._config, directory)
+            self._schedules.append(DirectorySchedule(directory, interval))
+
+    def synchronize(self, directory, dirtydirectories = None):
+        """
+        synchronizes a directory
+        Parameters:
+        - directory
+          directory to synchronize
+        - dirtydirectories
+          list of changed directories or None to synchronize all
+          subdirectories
+        Returns:
+        - list of errors
+        """
+        processor = TreeSyncProcessor(self._config, self._root, directory,
+                                      get_hidden_policy(self._config))
+        processor.set_concurrency(get_concurrency(self._config))
+        processor.set_dirty_directories(dirtydirectories)
+        self._lock.acquire()
+        try:
+            self._processors[directory] = (processor, time.time())
+        finally:
+            self._lock.release()
+        try:
+            processor.startup()
+            while processor.has_open_actions():
+                processor.process_next_action()
+            # errors of parallel actions are logged when they finish
+            processor.wait_actions()
+            errors = processor.get_errors()
+            processor.clear_errors()
+        finally:
+            self._lock.acquire()
+            try:
+                del self._processors[directory]
+            finally:
+                self._lock.release()
+            processor.shutdown()
+        for error in errors:
+            debug_error(error)
+        return errors
+
+    def run_schedule(self, schedule, work):
+        """
+        synchronizes a scheduled directory and records the result
+        Parameters:
+        - schedule
+          DirectorySchedule of the directory
+        - work
+          list of changed directories or None for a full sync
+        """
+        directory = schedule.get_directory()
+        try:
+            try:
+                errors = self.synchronize(directory, work)
+            except Exception, e:
+                errors = [ str(e) ]
+                debug_error("sync of " + directory + " failed: " + str(e))
+            self._lock.acquire()
+            try:
+                if len(errors) > 0:
+                    schedule.failed(time.time(), work, errors[-1])
+                else:
+                    schedule.succeeded(time.time())
+            finally:
+                self._lock.release()
+        finally:
+            self._lock.acquire()
+            try:
+                del self._running[directory]
+                self._lock.notifyAll()
+            finally:
+                self._lock.release()
+
+    def is_blocked(self, schedule):
+        """
+        checks if a directory overlaps with a directory that is
+        synchronized at the moment
+        Parameters:
+        - schedule
+          DirectorySchedule of the directory
+        Returns:
+        - True:  directory has to wait
+        - False: directory can be synchronized
+        """
+        for directory in self._running.keys():
+            if schedule.contains(directory):
+                return True
+            if schedule.get_directory().startswith(directory + os.sep):
+                return True
+        return False
+
+    def dispatch(self, now = None):
+        """
+        distributes the recorded changes to the schedules and starts
+        the syncs of the due directories up to the concurrency limit
+        Parameters:
+        - now
+          current time
+        Returns:
+        - list of the started threads
+        """
+        if now == None:
+            now = time.time()
+        result = []
+        dirtydirectories = self._journal.take_dirty_directories(now)
+        fullrescan = self._journal.take_full_rescan()
+        self._lock.acquire()
+        try:
+            for schedule in self._schedules:
+                if fullrescan:
+                    schedule.mark_full_sync()
+                schedule.add_dirty_directories(dirtydirectories)
+            if self._state != STATE_RUNNING:
+                return result
+            for schedule in self._schedules:
+                if len(self._running) >= self._concurrency:
+                    break
+                if not schedule.is_due(now) or self.is_blocked(schedule):
+                    continue
+                work = schedule.take_work(now)
+                thread = Thread(target = self.run_schedule,
+                                args = (schedule, work))
+                self._running[schedule.get_directory()] = thread
+                result.append(thread)
+        finally:
+            self._lock.release()
+        for thread in result:
+            thread.start()
+        return result
+
+    def sync_now(self, directory = None):
+        """
+        requests the immediate full sync of a directory
+        Parameters:
+        - directory
+          directory to synchronize or None for all directories
+        Returns:
+        - True:  sync was requested
+        - False: directory isn't synchronized by the daemon
+        """
+        self._lock.acquire()
+        try:
+            if directory:
+                schedule = self.get_schedule(directory)
+                if schedule == None:
+                    return False
+                schedule.request_sync()
+            else:
+                for schedule in self._schedules:
+                    schedule.request_sync()
+        finally:
+            self._lock.release()
+        self.dispatch()
+        return True
+
+    def get_sync_status(self, directory, now):
+        """
+        returns the progress of a running sync
+        Parameters:
+        - directory
+          synchronized directory
+        - now
+          current time
+        Returns:
+        - dictionary with the progress or None if the directory isn't
+          synchronized at the moment
+        """
+        entry = self._processors.get(directory)
+        if entry == None:
+            return None
+        (processor, starttime) = entry
+        transferred = 0
+        processors = processor.get_processors()
+        if len(processors) > 0:
+            copystats = processors[0].get_server().get_copy_stats()
+            for backend in copystats.get_backends():
+                if backend != COPY_DEDUP:
+                    transferred = transferred + copystats.get_bytes(backend)
+        index = processor.get_action_index()
+        duration = max(now - starttime, 0.001)
+        return { "queue": processor.get_action_count() - index,
+                 "done": index,
+                 "action": processor.get_action_title(),
+                 "bytes": transferred,
+                 "throughput": transferred / duration,
+                 "started": starttime }
+
+    def get_status(self, now = None):
+        """
+        Parameters:
+        - now
+          current time
+        Returns:
+        - dictionary with the state of the daemon and of each directory
+        """
+        if now == None:
+            now = time.time()
+        directories = []
+        self._lock.acquire()
+        try:
+            for schedule in self._schedules:
+                status = schedule.get_status(now)
+                status["sync"] = self.get_sync_status(schedule.get_directory(),
+                                                      now)
+                directories.append(status)
+        finally:
+            self._lock.release()
+        return { "state": STATE_NAMES[self._state],
+                 "running": len(self._running),
+                 "directories": directories }
+
+    def get_timeout(self, now = None):
+        """
+        Parameters:
+        - now
+          current time
+        Returns:
+        - seconds to wait for changes before the next dispatch
+        """
+        if now == None:
+            now = time.time()
+        timeout = self._sleep_interval
+        if self._journal.has_dirty_directories():
+            timeout = COALESCE_DELAY
+        self._lock.acquire()
+        try:
+            for schedule in self._schedules:
+                timeout = min(timeout, schedule.get_delay(now))
+        finally:
+            self._lock.release()
+        return max(timeout, 0.1)
+
+    def wait_syncs(self):
+        """
+        waits until the running syncs are finished
+        """
+        self._lock.acquire()
+        try:
+            while len(self._running) > 0:
+                self._lock.wait()
+        finally:
+            self._lock.release()
+
+    def setup(self):
+        """
+        prepares the checksums, the journal and the schedules. This is
+        done before the control socket accepts requests.
+        """
+        setup_checksum(self._config, OutputBase())
+        self.init_journal()
+        self.init_schedules()
 
     def start(self):
         """
         starts the thread
         """
-        self._state = STATE_RUNNING
+        if self._journal == None:
+            self.setup()
+        if self._state != STATE_STOPPING:
+            # a stop request might have arrived during the setup
+            self._state = STATE_RUNNING
         while self.is_running():
-            print "loop entered."
-            if self._state == STATE_RUNNING:
-                print "SyncThread running."
-            if self._state == STATE_PAUSING:
-                print "SyncThread paused."
-            print "sleep"
-            time.sleep(self._sleep_interval)
-            print "wake up"
+            self.dispatch()
+            # waits for changes instead of sleeping
+            timeout = self.get_timeout()
+            while self.is_running() and self._journal.poll(timeout) > 0:
+                timeout = 0
+        self.wait_syncs()
+        self._journal.close()
         print "SyncThread stopped."
-        #if self._state == STATE_NOT_STARTED:
-        #    self._state = STATE_RUNNING
-        #    if self._state != STATE_STOPPING:
-        #        # TODO: implement file synchronization
-        #        if self._state == STATE_RUNNING:
-        #            print "DaemonSyncThread running"
-        #        if self._state == STATE_PAUSING:
-        #            print "DaemonSyncThread paused"
-        #        # time.sleep(self._sleep_interval)
-        #    print "SyncThread stopped."
+
+def get_control_path(path = None):
+    """
+    Parameters:
+    - path
+      path of the control socket or None for the default path
+    Returns:
+    - expanded path of the control socket
+    """
+    return os.path.expanduser(path or CONTROL_SOCKET_PATH)
+
+def read_line(connection):
+    """
+    reads a single line from a socket
+    Parameters:
+    - connection
+      connected socket
+    Returns:
+    - line without the line feed
+    """
+    data = ""
+    while not "\n" in data and len(data) < CONTROL_REQUEST_SIZE:
+        chunk = connection.recv(CONTROL_REQUEST_SIZE)
+        if not chunk:
+            break
+        data = data + chunk
+    return data.split("\n", 1)[0]
 
 class DaemonListenerThread(Thread):
+    """
+    thread that answers control requests on a Unix domain socket. A
+    request is a single line with a command and an optional argument,
+    the response is a single line with a JSON object.
+    """
 
-    def __init__(self, sync_thread, port):
+    def __init__(self, sync_thread, path = None):
         """
         create instance
         Parameters:
         - sync_thread
           sync thread to control
-        - port
-          port to communicate with the client
+        - path
+          path of the control socket
         """
         Thread.__init__(self)
         self._sync_thread = sync_thread
-        self._socket = self.init_socket(port)
+        self._path = get_control_path(path)
+        self._socket = self.init_socket(self._path)
 
-    def init_socket(self, port):
+    def init_socket(self, path):
         """
         initializes the socket to communicate with the client
         Parameters:
-        - port
-          port to use
+        - path
+          path of the socket
+        Returns:
+        - listening socket
+        Raises:
+        - socket.error if another daemon is listening already
         """
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_socket.bind(("", port))
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(path)
+                except socket.error:
+                    # left over by a daemon that was killed
+                    os.remove(path)
+                else:
+                    raise socket.error(errno.EADDRINUSE,
+                                       "daemon is running already")
+            finally:
+                probe.close()
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldmask = os.umask(0177)
+        try:
+            server_socket.bind(path)
+        finally:
+            os.umask(oldmask)
+        server_socket.listen(5)
+        server_socket.settimeout(1.0)
         return server_socket
 
+    def handle_request(self, request):
+        """
+        executes a control request
+        Parameters:
+        - request
+          line with a command and an optional argument
+        Returns:
+        - dictionary with the response
+        """
+        parts = request.strip().split(" ", 1)
+        command = parts[0]
+        argument = None
+        if len(parts) > 1:
+            argument = parts[1].strip()
+        if command == COMMAND_STATUS:
+            response = self._sync_thread.get_status()
+        elif command in [ COMMAND_START, COMMAND_CONTINUE, COMMAND_RESUME ]:
+            self._sync_thread.stop_pausing()
+            self._sync_thread.dispatch()
+            response = {}
+        elif command == COMMAND_PAUSE:
+            self._sync_thread.start_pausing()
+            response = {}
+        elif command == COMMAND_STOP:
+            self._sync_thread.stop()
+            response = {}
+        elif command == COMMAND_SYNC_NOW:
+            if not self._sync_thread.sync_now(argument):
+                return { "result": RESULT_ERROR,
+                         "message": "unknown directory: " + argument }
+            response = {}
+        else:
+            return { "result": RESULT_ERROR,
+                     "message": "unknown command: " + command }
+        response["result"] = RESULT_OK
+        return response
+
+    def handle_connection(self, connection):
+        """
+        answers the request of a client
+        Parameters:
+        - connection
+          connected socket
+        """
+        try:
+            connection.settimeout(CONTROL_TIMEOUT)
+            request = read_line(connection)
+            debug_value("control request", request)
+            try:
+                response = self.handle_request(request)
+            except Exception, e:
+                debug_error("control request failed: " + str(e))
+                response = { "result": RESULT_ERROR, "message": str(e) }
+            connection.sendall(json.dumps(response) + "\n")
+        except socket.error, e:
+            debug_error("control connection failed: " + str(e))
+        connection.close()
+
     def run(self):
         """
         starts the thread
         """
-        print "DaemonListenerThread started."
-        flag = True
-        while flag:
-            print "Read socket"
-            data, address = self._socket.recvfrom(256)
-            print "DaemonListenerThread received: " + data
-            if data == COMMAND_STOP:
-                self._sync_thread.stop()
-                flag = False
-            time.sleep(2)
-        #if data in COMMAND_LIST:
-        #    if data == COMMAND_PAUSE:
-        #        self._sync_thread.start_pausing()
-        #    if data == COMMAND_CONTINUE:
-        #        self._sync_thread.stop_pausing()
-        #    if data == COMMAND_STOP:
-        #         self._sync_thread.stop()
-        #         flag = False
-        #else:
-        #    print "unknown command received"
-        print "DaemonListenerThread stopped."
+        debug("DaemonListenerThread started.")
+        while self._sync_thread.is_running():
+            try:
+                (connection, address) = self._socket.accept()
+            except socket.timeout:
+                continue
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            self.handle_connection(connection)
+        self.close()
+        debug("DaemonListenerThread stopped.")
+
+    def close(self):
+        """
+        closes and removes the control socket
+        """
+        self._socket.close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
 
 class DaemonClient(object):
     """
     client to communicate with the listener thread
     """
 
-    def __init__(self, port):
+    def __init__(self, path = None):
         """
         create instance
         Parameters:
-        - port
-          port to use
+        - path
+          path of the control socket
         """
-        self._port = port
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._path = get_control_path(path)
 
-    def send(self, data):
+    def send(self, command, argument = None):
         """
-        sends data to the server
+        sends a request to the daemon and waits for the response
         Parameters:
-        - data
-          data to send
+        - command
+          command to execute
+        - argument
+          optional argument of the command
+        Returns:
+        - dictionary with the response
+        Raises:
+        - socket.error if the daemon isn't running
         """
-        self._socket.sendto(data, ("localhost", self._port))
+        request = command
+        if argument:
+            request = request + " " + argument
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client_socket.settimeout(CONTROL_TIMEOUT)
+            client_socket.connect(self._path)
+            client_socket.sendall(request + "\n")
+            response = ""
+            while True:
+                data = client_socket.recv(CONTROL_REQUEST_SIZE)
+                if not data:
+                    break
+                response = response + data
+        finally:
+            client_socket.close()
+        return json.loads(response)
+
+    def is_running(self):
+        """
+        Returns:
+        - True:  daemon answers requests
+        - False: daemon isn't running
+        """
+        try:
+            self.status()
+        except socket.error:
+            return False
+        return True
+
+    def start(self):
+        """
+        signals the server to start syncing
+        """
+        return self.send(COMMAND_START)
 
     def stop(self):
         """
         signals the server to stop
         """
-        self.send(COMMAND_STOP)
+        return self.send(COMMAND_STOP)
+
+    def pause(self):
+        """
+        signals the server to pause
+        """
+        return self.send(COMMAND_PAUSE)
+
+    def resume(self):
+        """
+        signals the server to continue
+        """
+        return self.send(COMMAND_RESUME)
+
+    def sync_now(self, directory = None):
+        """
+        requests the immediate sync of a directory
+        Parameters:
+        - directory
+          directory to synchronize or None for all directories
+        """
+        return self.send(COMMAND_SYNC_NOW, directory)
+
+    def status(self):
+        """
+        Returns:
+        - dictionary with the state of the daemon and its directories
+        """
+        return self.send(COMMAND_STATUS)
+
+def start_daemon(argv):
+    """
+    starts the daemon in this process
+    Parameters:
+    - argv
+      command line parameters
+    """
+    config_list = SyncConfigList()
+    config_name = None
+    if PARAMETER_CONFIG in argv:
+        index = argv.index(PARAMETER_CONFIG)
+        if index + 1 < len(argv):
+            config_name = argv[index + 1]
+    config = config_list.get_entry(config_name)
+    if config == None:
+        config = config_list.get_entries()[0]
+    sync_thread = DaemonSyncThread(config, config_list.get_directories())
+    sync_thread.setup()
+    listener_thread = DaemonListenerThread(sync_thread)
+    listener_thread.start()
+    try:
+        sync_thread.start()
+    finally:
+        # the listener only stops with the sync thread
+        sync_thread.stop()
+        listener_thread.join()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print "Parameter missing."
+    elif not sys.argv[1] in COMMAND_LIST:
+        print "Unknown parameter: %s." % sys.argv[1]
     else:
-        gtk.gdk.threads_init
-        if not sys.argv[1] in COMMAND_LIST:
-            print "Unknown parameter: %s." % sys.argv[1]
+        client = DaemonClient()
+        command = sys.argv[1]
+        if command == COMMAND_START and not client.is_running():
+            if gtk:
+                gtk.gdk.threads_init()
+            start_daemon(sys.argv)
         else:
-            if sys.argv[1] == COMMAND_START:
-                sync_thread = DaemonSyncThread()
-                listener_thread = DaemonListenerThread(sync_thread, 5000)
-                listener_thread.start()
-                sync_thread.start()
-            if sys.argv[1] == COMMAND_STOP:
-                client = DaemonClient(5000)
-                client.stop()
-            if sys.argv[1] == COMMAND_START:
-                pass
-            if sys.argv[1] == COMMAND_START:
-                pass
+            argument = None
+            if command == COMMAND_SYNC_NOW and len(sys.argv) > 2:
+                argument = os.path.abspath(os.path.expanduser(sys.argv[2]))
+            try:
+                response = client.send(command, argument)
+            except socket.error, e:
+                print "Daemon isn't running: %s." % str(e)
+                sys.exit(1)
+            print json.dumps(response, indent = 2, sort_keys = True)
+            if response.get("result") != RESULT_OK:
+                sys.exit(1)
@@ -12,17 +12,121 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import atexit
 import os
 import os.path
 import sys
+import time
 
 from cStringIO import StringIO
+from threading import Lock, Timer
 
+DEBUG_LEVEL_DETAIL = "DETAIL"
 DEBUG_LEVEL_INFO = "INFO"
 DEBUG_LEVEL_ERROR = "ERROR"
 
+# levels in ascending order. Lines below the level set by
+# --debug-level are skipped.
+DEBUG_LEVELS = [ DEBUG_LEVEL_DETAIL, DEBUG_LEVEL_INFO, DEBUG_LEVEL_ERROR ]
+
+# parameter to switch on debugging and to set the level
+PARAMETER_DEBUG = "--debug"
+PARAMETER_DEBUG_LEVEL = "--debug-level="
+
+# size of the buffer of the log file
+LOG_BUFFER_SIZE = 64 * 1024
+
+# maximum seconds buffered lines wait before they are written
+LOG_FLUSH_INTERVAL = 1.0
+
 debug_flag = None
+debug_level = DEBUG_LEVEL_INFO
 error_flag = None
+log_writer = None
+
+class LogWriter(object):
+    """
+    writes log lines to a file that is kept open. Lines are buffered
+    and written by a timer at most flushinterval seconds later, errors
+    are written at once.
+    """
+
+    def __init__(self, fd, flushinterval = LOG_FLUSH_INTERVAL):
+        """
+        creates an instance
+        Parameters:
+        - fd
+          open log file
+        - flushinterval
+          maximum seconds to buffer lines
+        """
+        self._fd = fd
+        self._flushinterval = flushinterval
+        self._lastflush = time.time()
+        self._timer = None
+        self._lock = Lock()
+
+    def write(self, line, level = DEBUG_LEVEL_INFO):
+        """
+        writes a line
+        Parameters:
+        - line
+          line to write including the line feed
+        - level
+          debug level of the line
+        Returns:
+        - True:  line was written
+        - False: writing failed
+        """
+        self._lock.acquire()
+        try:
+            if self._fd == None:
+                return False
+            try:
+                self._fd.write(line)
+                now = time.time()
+                if (level == DEBUG_LEVEL_ERROR or
+                    now - self._lastflush >= self._flushinterval):
+                    self._fd.flush()
+                    self._lastflush = now
+                elif self._timer == None:
+                    # the lines are written even if no further line follows
+                    self._timer = Timer(self._flushinterval, self.flush)
+                    self._timer.setDaemon(True)
+                    self._timer.start()
+            except IOError:
+                return False
+        finally:
+            self._lock.release()
+        return True
+
+    def flush(self):
+        """
+        writes the buffered lines
+        """
+        self._lock.acquire()
+        try:
+            self._timer = None
+            if self._fd != None:
+                self._fd.flush()
+                self._lastflush = time.time()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        writes the buffered lines and closes the file
+        """
+        self._lock.acquire()
+        try:
+            if self._timer != None:
+                self._timer.cancel()
+                self._timer = None
+            if self._fd != None:
+                self._fd.close()
+                self._fd = None
+        finally:
+            self._lock.release()
 
 def get_log_filename():
     """
@@ -52,7 +156,7 @@ def open_log_file():
     fd = None
     try:
         fname = get_log_filename()
-        fd = open(fname, "a")
+        fd = open(fname, "a", LOG_BUFFER_SIZE)
     except:
         if error_flag == None:
             message = "Unable to open: " + get_log_filename()
@@ -60,6 +164,35 @@ def open_log_file():
         error_flag = True
     return fd
 
+def get_log_writer():
+    """
+    Returns:
+    - LogWriter of the log file or None if it can't be opened
+    """
+    global log_writer
+    if log_writer == None and error_flag == None:
+        fd = open_log_file()
+        if fd != None:
+            log_writer = LogWriter(fd)
+            atexit.register(close_log_file)
+    return log_writer
+
+def flush_log_file():
+    """
+    writes the buffered log lines
+    """
+    if log_writer != None:
+        log_writer.flush()
+
+def close_log_file():
+    """
+    writes the buffered log lines and closes the log file
+    """
+    global log_writer
+    if log_writer != None:
+        log_writer.close()
+        log_writer = None
+
 def log_line(line, level=DEBUG_LEVEL_INFO):
     """
     logs a line
@@ -70,19 +203,9 @@ def log_line(line, level=DEBUG_LEVEL_INFO):
       debug level to use
     """
     logline = "[%s] %s\n" % (level, line)
-    success = True
-    fd = open_log_file()
-    if fd != None:
-        try:
-            fd.write(logline)
-            fd.close()
-            success = True
-        except:
-            success = False
-    else:
-        success = False
-    if success == False:
-        sys.stderr.write(line)
+    writer = get_log_writer()
+    if writer == None or not writer.write(logline, level):
+        sys.stderr.write(logline)
 
 def get_debug_flag():
     """
@@ -92,43 +215,106 @@ def get_debug_flag():
     - False: debugging switched off
     """
     global debug_flag
+    global debug_level
     if debug_flag == None:
         debug_flag = False
         for arg in sys.argv:
-            if arg == "--debug":
+            if arg.startswith(PARAMETER_DEBUG_LEVEL):
+                level = arg[len(PARAMETER_DEBUG_LEVEL):].upper()
+                if level in DEBUG_LEVELS:
+                    debug_level = level
+        for arg in sys.argv:
+            if arg == PARAMETER_DEBUG:
                 delete_log_file()
                 debug_flag = True
     return debug_flag
 
-def debug(line):
+def set_debug(flag, level = DEBUG_LEVEL_INFO):
+    """
+    switches debugging on or off without command line parameters
+    Parameters:
+    - flag
+      True to switch debugging on
+    - level
+      lowest level to log
+    """
+    global debug_flag
+    global debug_level
+    debug_flag = flag
+    debug_level = level
+
+def is_debug_enabled(level = DEBUG_LEVEL_INFO):
+    """
+    checks if lines of a level are logged. Callers use this to skip
+    expensive debug output.
+    Parameters:
+    - level
+      debug level
+    Returns:
+    - True:  lines of the level are logged
+    - False: lines of the level are skipped
+    """
+    if not get_debug_flag():
+        return False
+    return DEBUG_LEVELS.index(level) >= DEBUG_LEVELS.index(debug_level)
+
+def format_line(line, args):
+    """
+    formats a line only if it is logged
+    Parameters:
+    - line
+      line or format string
+    - args
+      tuple of values for the format string
+    Returns:
+    - formatted line
+    """
+    if args:
+        return line % args
+    return line
+
+def debug(line, *args):
     """
     debugs a line
     Parameters:
     - line
-      line to debug
+      line to debug. If values follow, the line is a format string
+      that is only formatted if the line is logged.
+    """
+    if is_debug_enabled(DEBUG_LEVEL_INFO):
+        log_line(format_line(line, args))
+
+def debug_detail(line, *args):
+    """
+    debugs a line at detail level
+    Parameters:
+    - line
+      line or format string to debug
     """
-    if get_debug_flag():
-        log_line(line)
+    if is_debug_enabled(DEBUG_LEVEL_DETAIL):
+        log_line(format_line(line, args), DEBUG_LEVEL_DETAIL)
 
-def debug_error(line):
+def debug_error(line, *args):
     """
     debugs a line at error level
     Parameters:
     - line
-      line to debug
+      line or format string to debug
     """
-    if get_debug_flag():
-        log_line(line, DEBUG_LEVEL_ERROR)
+    if is_debug_enabled(DEBUG_LEVEL_ERROR):
+        log_line(format_line(line, args), DEBUG_LEVEL_ERROR)
 
-def debug_value(label, value):
+def debug_value(label, value, level = DEBUG_LEVEL_INFO):
     """
     debugs a value
     - label
       label for a value
     - value
       value to log
+    - level
+      debug level to use
     """
-    if get_debug_flag():
+    if is_debug_enabled(level):
         stringio = StringIO()
         stringio.write(label)
         if value:
@@ -136,4 +322,4 @@ def debug_value(label, value):
             stringio.write(str(value))
         else:
             stringio.write(" = (None)")
-        log_line(stringio.getvalue())
+        log_line(stringio.getvalue(), level)
@@ -0,0 +1,449 @@
+# simplesync - block-level delta transfer
+#
+# Copyright 2011 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import hashlib
+import mmap
+import os
+import os.path
+import struct
+import zlib
+
+from syncdebug import *
+
+# default size of the blocks that are compared
+DELTA_BLOCKSIZE = 16 * 1024
+
+# count of blocks that are only compared at block boundaries before
+# rolling the weak checksum again after a mismatch
+DELTA_RESYNC_BLOCKS = 16
+
+# prefix of the signature files on the server. Server file names always
+# start with ":::", so signature files can't collide with them.
+SIGNATURE_PREFIX = "signature"
+
+# format of signature files
+SIGNATURE_MAGIC = "SSIG"
+SIGNATURE_HEADER = struct.Struct("<4sIQ")
+SIGNATURE_BLOCK = struct.Struct("<I16s")
+
+# modulus of the Adler-32 checksum
+ADLER_MODULUS = 65521
+
+# instructions of a delta
+DELTA_COPY = 0
+DELTA_DATA = 1
+
+def create_weak_checksum(data):
+    """
+    creates the weak checksum of a block
+    Parameters:
+    - data
+      content of the block
+    Returns:
+    - Adler-32 checksum of the block
+    """
+    return zlib.adler32(data) & 0xffffffff
+
+def roll_weak_checksum(checksum, length, outbyte, inbyte):
+    """
+    moves the window of a weak checksum by one byte
+    Parameters:
+    - checksum
+      weak checksum of the current window
+    - length
+      length of the window
+    - outbyte
+      byte value that leaves the window
+    - inbyte
+      byte value that enters the window
+    Returns:
+    - weak checksum of the moved window
+    """
+    a = checksum & 0xffff
+    b = checksum >> 16
+    a = (a - outbyte + inbyte) % ADLER_MODULUS
+    b = (b - length * outbyte + a - 1) % ADLER_MODULUS
+    return (b << 16) | a
+
+def create_strong_checksum(data):
+    """
+    creates the strong checksum of a block
+    Parameters:
+    - data
+      content of the block
+    Returns:
+    - MD5 digest of the block
+    """
+    return hashlib.md5(data).digest()
+
+def open_mmap(f):
+    """
+    maps a file into memory
+    Parameters:
+    - f
+      open file
+    Returns:
+    - read-only mmap or an empty string for empty files
+    """
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return ""
+    return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+class Signature(object):
+    """
+    weak and strong checksums of the blocks of a file
+    """
+
+    def __init__(self, blocksize = DELTA_BLOCKSIZE, filesize = 0):
+        """
+        creates an instance
+        Parameters:
+        - blocksize
+          size of the blocks
+        - filesize
+          size of the file
+        """
+        self._blocksize = blocksize
+        self._filesize = filesize
+        self._blocks = []
+        self._weakdict = {}
+
+    def get_blocksize(self):
+        return self._blocksize
+
+    def get_filesize(self):
+        return self._filesize
+
+    def get_block_count(self):
+        return len(self._blocks)
+
+    def append_block(self, weak, strong):
+        """
+        appends the checksums of the next block
+        Parameters:
+        - weak
+          weak checksum of the block
+        - strong
+          strong checksum of the block
+        """
+        index = len(self._blocks)
+        self._blocks.append((weak, strong))
+        self._weakdict.setdefault(weak, []).append(index)
+
+    def find_block(self, weak, data, preferred):
+        """
+        searches a block with the given content
+        Parameters:
+        - weak
+          weak checksum of the content
+        - data
+          content of the block
+        - preferred
+          index of the block to check first
+        Returns:
+        - index of the matching block or None
+        """
+        indices = self._weakdict.get(weak)
+        if not indices:
+            return None
+        strong = create_strong_checksum(data)
+        if preferred in indices and self._blocks[preferred][1] == strong:
+            return preferred
+        for index in indices:
+            if self._blocks[index][1] == strong:
+                return index
+        return None
+
+    def get_block_length(self, index):
+        """
+        Parameters:
+        - index
+          index of a block
+        Returns:
+        - length of the block
+        """
+        offset = index * self._blocksize
+        return min(self._blocksize, self._filesize - offset)
+
+    def save(self, filepath):
+        """
+        saves the signature to a file
+        Parameters:
+        - filepath
+          path of the signature file
+        """
+        f = open(filepath, "wb")
+        f.write(SIGNATURE_HEADER.pack(SIGNATURE_MAGIC, self._blocksize,
+                                      self._filesize))
+        for (weak, strong) in self._blocks:
+            f.write(SIGNATURE_BLOCK.pack(weak, strong))
+        f.close()
+
+def create_signature(filepath, blocksize = DELTA_BLOCKSIZE):
+    """
+    creates the signature of a file
+    Parameters:
+    - filepath
+      path of the file
+    - blocksize
+      size of the blocks
+    Returns:
+    - created Signature
+    """
+    f = open(filepath, "rb")
+    try:
+        filesize = os.fstat(f.fileno()).st_size
+        signature = Signature(blocksize, filesize)
+        while True:
+            data = f.read(blocksize)
+            if not data:
+                break
+            signature.append_block(create_weak_checksum(data),
+                                   create_strong_checksum(data))
+    finally:
+        f.close()
+    return signature
+
+def load_signature(filepath):
+    """
+    loads a signature file
+    Parameters:
+    - filepath
+      path of the signature file
+    Returns:
+    - loaded Signature or None if the file is missing or invalid
+    """
+    try:
+        f = open(filepath, "rb")
+    except IOError:
+        return None
+    try:
+        content = f.read()
+    finally:
+        f.close()
+    if len(content) < SIGNATURE_HEADER.size:
+        return None
+    (magic, blocksize, filesize) = SIGNATURE_HEADER.unpack_from(content, 0)
+    if magic != SIGNATURE_MAGIC or blocksize == 0:
+        return None
+    signature = Signature(blocksize, filesize)
+    pos = SIGNATURE_HEADER.size
+    while pos + SIGNATURE_BLOCK.size <= len(content):
+        (weak, strong) = SIGNATURE_BLOCK.unpack_from(content, pos)
+        signature.append_block(weak, strong)
+        pos = pos + SIGNATURE_BLOCK.size
+    return signature
+
+def create_delta(filepath, signature):
+    """
+    compares a file with the signature of an older version and creates
+    the instructions to build the file from the blocks of the older
+    version. Like rsync, a rolling weak checksum is used to find moved
+    blocks. To bound the CPU time, rolling stops after two blocks without
+    match and only block boundaries are compared for the next
+    DELTA_RESYNC_BLOCKS blocks.
+    Parameters:
+    - filepath
+      path of the new file
+    - signature
+      signature of the older version
+    Returns:
+    - list of instructions (DELTA_COPY, block index) and
+      (DELTA_DATA, offset in the new file, length)
+    """
+    delta = []
+    blocksize = signature.get_blocksize()
+    size = 0
+    f = open(filepath, "rb")
+    content = open_mmap(f)
+    try:
+        size = len(content)
+        pos = 0
+        literal = 0
+        weak = None
+        budget = 2 * blocksize
+        skipped = 0
+        while pos + blocksize <= size:
+            if weak == None:
+                weak = create_weak_checksum(content[pos:pos + blocksize])
+            index = signature.find_block(weak, content[pos:pos + blocksize],
+                                         pos // blocksize)
+            if index != None and signature.get_block_length(index) == blocksize:
+                if literal < pos:
+                    delta.append((DELTA_DATA, literal, pos - literal))
+                delta.append((DELTA_COPY, index))
+                pos = pos + blocksize
+                literal = pos
+                weak = None
+                budget = 2 * blocksize
+                skipped = 0
+            elif budget > 0 and pos + blocksize < size:
+                weak = roll_weak_checksum(weak, blocksize, ord(content[pos]),
+                                          ord(content[pos + blocksize]))
+                pos = pos + 1
+                budget = budget - 1
+            else:
+                pos = pos + blocksize
+                weak = None
+                skipped = skipped + 1
+                if skipped >= DELTA_RESYNC_BLOCKS:
+                    budget = 2 * blocksize
+                    skipped = 0
+        if pos < size:
+            # the last block of both files might be shorter
+            index = signature.get_block_count() - 1
+            if index >= 0 and signature.get_block_length(index) == size - pos:
+                data = content[pos:size]
+                if signature.find_block(create_weak_checksum(data), data,
+                                        index) == index:
+                    if literal < pos:
+                        delta.append((DELTA_DATA, literal, pos - literal))
+                    delta.append((DELTA_COPY, index))
+                    literal = size
+        if literal < size:
+            delta.append((DELTA_DATA, literal, size - literal))
+    finally:
+        if size > 0:
+            content.close()
+        f.close()
+    return delta
+
+def is_in_place_delta(delta, blocksize):
+    """
+    checks if a delta can be applied by patching the old file in place.
+    This is the case if every block is copied to its own position.
+    Parameters:
+    - delta
+      list of instructions
+    - blocksize
+      size of the blocks
+    Returns:
+    - True:  delta can be applied in place
+    - False: file has to be rebuilt
+    """
+    offset = 0
+    for instruction in delta:
+        if instruction[0] == DELTA_COPY:
+            if instruction[1] * blocksize != offset:
+                return False
+            offset = offset + blocksize
+        else:
+            offset = offset + instruction[2]
+    return True
+
+def get_delta_size(delta):
+    """
+    Parameters:
+    - delta
+      list of instructions
+    Returns:
+    - count of bytes that are not copied from the old file
+    """
+    result = 0
+    for instruction in delta:
+        if instruction[0] == DELTA_DATA:
+            result = result + instruction[2]
+    return result
+
+def apply_delta(srcpath, basepath, delta, signature, chunksize = 1024 * 1024):
+    """
+    updates a file by a delta. If possible only the changed blocks are
+    written, otherwise the file is rebuilt in a temporary file that
+    replaces the old file.
+    Parameters:
+    - srcpath
+      path of the new file the delta was created from
+    - basepath
+      path of the old file to update
+    - delta
+      list of instructions
+    - signature
+      signature of the old file
+    - chunksize
+      maximum size of the chunks to copy
+    Returns:
+    - count of bytes written
+    """
+    blocksize = signature.get_blocksize()
+    written = 0
+    srcfile = open(srcpath, "rb")
+    try:
+        size = os.fstat(srcfile.fileno()).st_size
+        if is_in_place_delta(delta, blocksize):
+            debug("apply delta in place")
+            destfile = open(basepath, "r+b")
+            try:
+                for instruction in delta:
+                    if instruction[0] == DELTA_DATA:
+                        written = written + copy_range(srcfile, instruction[1],
+                            destfile, instruction[1], instruction[2], chunksize)
+                destfile.truncate(size)
+            finally:
+                destfile.close()
+        else:
+            debug("rebuild file from delta")
+            temppath = basepath + ".delta"
+            basefile = open(basepath, "rb")
+            destfile = open(temppath, "wb")
+            try:
+                offset = 0
+                for instruction in delta:
+                    if instruction[0] == DELTA_COPY:
+                        length = signature.get_block_length(instruction[1])
+                        written = written + copy_range(basefile,
+                            instruction[1] * blocksize, destfile, offset,
+                            length, chunksize)
+                    else:
+                        length = instruction[2]
+                        written = written + copy_range(srcfile, instruction[1],
+                            destfile, offset, length, chunksize)
+                    offset = offset + length
+            finally:
+                destfile.close()
+                basefile.close()
+            os.rename(temppath, basepath)
+    finally:
+        srcfile.close()
+    return written
+
+def copy_range(srcfile, srcoffset, destfile, destoffset, length, chunksize):
+    """
+    copies a range of bytes between two files
+    Parameters:
+    - srcfile
+      file to read from
+    - srcoffset
+      offset to read from
+    - destfile
+      file to write to
+    - destoffset
+      offset to write to
+    - length
+      count of bytes to copy
+    - chunksize
+      maximum size of the chunks to copy
+    Returns:
+    - count of bytes written
+    """
+    srcfile.seek(srcoffset)
+    destfile.seek(destoffset)
+    remaining = length
+    while remaining > 0:
+        data = srcfile.read(min(chunksize, remaining))
+        if not data:
+            break
+        destfile.write(data)
+        remaining = remaining - len(data)
+    return length - remaining
@@ -0,0 +1,442 @@
+# simplesync - journal of changed directories
+#
+# Copyright 2011 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import select
+import stat
+import struct
+import time
+
+from threading import Lock
+
+from localproperty import *
+from synccrypt import DECRYPTION_EXTENSION
+from syncdebug import *
+
+# inotify flags and event masks, see inotify(7)
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# events that change the content of a directory
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR)
+
+# header of an inotify event: wd, mask, cookie, length of the name
+EVENT_HEADER = struct.Struct("iIII")
+
+# size of the buffer to read events
+EVENT_BUFFER_SIZE = 64 * 1024
+
+# seconds without events before a burst of changes is reported
+COALESCE_DELAY = 2.0
+
+# maximum seconds to delay changes while events keep arriving
+COALESCE_MAX_DELAY = 30.0
+
+# names of the server files with the meta data of directories start
+# with this prefix, see create_hash()
+SERVER_NAME_PREFIX = ":::"
+
+class Inotify(object):
+    """
+    minimal wrapper of the Linux inotify API
+    """
+
+    def __init__(self):
+        """
+        creates an instance
+        Raises:
+        - OSError if inotify isn't available
+        """
+        path = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(path, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify isn't available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path, mask = WATCH_MASK):
+        """
+        watches a directory
+        Parameters:
+        - path
+          path of the directory
+        - mask
+          events to watch
+        Returns:
+        - watch descriptor or -1 if the directory can't be watched
+        """
+        return self._libc.inotify_add_watch(self._fd, path, mask)
+
+    def rm_watch(self, wd):
+        """
+        stops watching a directory
+        Parameters:
+        - wd
+          watch descriptor
+        """
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self, timeout):
+        """
+        reads the pending events
+        Parameters:
+        - timeout
+          seconds to wait for events
+        Returns:
+        - list of tuples of watch descriptor, mask, cookie and name
+        """
+        result = []
+        try:
+            (readable, writable, failed) = select.select([ self._fd ], [], [],
+                                                         timeout)
+        except select.error:
+            return result
+        if not readable:
+            return result
+        try:
+            data = os.read(self._fd, EVENT_BUFFER_SIZE)
+        except OSError, e:
+            if e.errno in [ errno.EAGAIN, errno.EINTR ]:
+                return result
+            raise
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, length) = EVENT_HEADER.unpack_from(data, pos)
+            pos = pos + EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip("\0")
+            pos = pos + length
+            result.append((wd, mask, cookie, name))
+        return result
+
+    def close(self):
+        """
+        releases the inotify instance
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def get_existing_directory(path, root):
+    """
+    returns the nearest directory of a path that exists
+    Parameters:
+    - path
+      path of a file or directory
+    - root
+      directory to stop at
+    Returns:
+    - path itself, its nearest existing parent or None
+    """
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path or not parent.startswith(root):
+            return None
+        path = parent
+    return path
+
+class ChangeJournal(object):
+    """
+    records the directories that changed since the last sync. Bursts
+    of changes are coalesced and reported after a quiet period. If
+    events were lost the journal requests a full rescan.
+    """
+
+    def __init__(self, hiddenpolicy = HIDDEN_SKIP, coalescedelay = COALESCE_DELAY,
+                 maxdelay = COALESCE_MAX_DELAY):
+        """
+        creates an instance
+        Parameters:
+        - hiddenpolicy
+          policy for hidden files and directories
+        - coalescedelay
+          seconds without events before changes are reported
+        - maxdelay
+          maximum seconds to delay changes
+        """
+        self._hiddenpolicy = hiddenpolicy
+        self._coalescedelay = coalescedelay
+        self._maxdelay = maxdelay
+        self._lock = Lock()
+        self._watches = {}
+        self._paths = {}
+        self._servers = {}
+        self._dirty = {}
+        self._firstevent = None
+        self._lastevent = None
+        self._fullrescan = False
+        try:
+            self._inotify = Inotify()
+        except OSError, e:
+            debug_error("inotify isn't available: " + str(e))
+            self._inotify = None
+
+    def is_available(self):
+        """
+        Returns:
+        - True:  changes are watched
+        - False: changes can't be watched and every sync has to be a
+                 full rescan
+        """
+        return self._inotify != None
+
+    def is_ignored(self, name):
+        """
+        checks if changes of a file don't need a sync
+        Parameters:
+        - name
+          name of the file
+        Returns:
+        - True:  changes are ignored
+        - False: changes are recorded
+        """
+        if name in IGNORED_FILENAMES or name.endswith(DECRYPTION_EXTENSION):
+            return True
+        if self._hiddenpolicy == HIDDEN_SKIP and name.startswith("."):
+            return True
+        return False
+
+    def add_directory(self, directory, dirtyflag = False):
+        """
+        watches a directory and all of its subdirectories
+        Parameters:
+        - directory
+          directory to watch
+        - dirtyflag
+          marks the directories as changed, e.g. for new directories
+        """
+        if not self._inotify:
+            return
+        pending = [ directory ]
+        while len(pending) > 0:
+            path = pending.pop(0)
+            if not path in self._paths:
+                wd = self._inotify.add_watch(path)
+                if wd < 0:
+                    debug_error("unable to watch " + path)
+                    continue
+                self._watches[wd] = path
+                self._paths[path] = wd
+            if dirtyflag:
+                self.mark_dirty(path)
+            for (subpath, statresult) in scan_directory(path, self._hiddenpolicy):
+                if stat.S_ISDIR(statresult.st_mode):
+                    pending.append(subpath)
+
+    def add_server_directory(self, serverdirectory, root):
+        """
+        watches the meta files of a filesystem server, so changes of
+        other clients are recorded as well
+        Parameters:
+        - serverdirectory
+          directory of the server
+        - root
+          root directory of the local files
+        """
+        if not self._inotify:
+            return
+        wd = self._inotify.add_watch(serverdirectory,
+                                     IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR)
+        if wd < 0:
+            debug_error("unable to watch " + serverdirectory)
+        else:
+            self._servers[wd] = root
+
+    def remove_directory(self, directory):
+        """
+        stops watching a directory and its subdirectories
+        Parameters:
+        - directory
+          directory to stop watching
+        """
+        prefix = directory + os.sep
+        for path in self._paths.keys():
+            if path == directory or path.startswith(prefix):
+                wd = self._paths.pop(path)
+                del self._watches[wd]
+                self._inotify.rm_watch(wd)
+
+    def mark_dirty(self, directory, now = None):
+        """
+        records a changed directory
+        Parameters:
+        - directory
+          path of the directory
+        - now
+          time of the change
+        """
+        if now == None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            self._dirty[directory] = True
+            if self._firstevent == None:
+                self._firstevent = now
+            self._lastevent = now
+        finally:
+            self._lock.release()
+
+    def mark_full_rescan(self):
+        """
+        requests a full rescan, e.g. after events were lost
+        """
+        self._fullrescan = True
+
+    def poll(self, timeout = 0):
+        """
+        waits for changes and records them
+        Parameters:
+        - timeout
+          seconds to wait for the first event
+        Returns:
+        - count of events read
+        """
+        if not self._inotify:
+            time.sleep(timeout)
+            return 0
+        events = self._inotify.read_events(timeout)
+        for (wd, mask, cookie, name) in events:
+            self.handle_event(wd, mask, name)
+        return len(events)
+
+    def handle_event(self, wd, mask, name):
+        """
+        records a single inotify event
+        Parameters:
+        - wd
+          watch descriptor
+        - mask
+          event mask
+        - name
+          name of the changed entry
+        """
+        if mask & IN_Q_OVERFLOW:
+            debug("inotify queue overflow")
+            self.mark_full_rescan()
+            return
+        if wd in self._servers:
+            self.handle_server_event(self._servers[wd], name)
+            return
+        path = self._watches.get(wd)
+        if path == None:
+            return
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            if self._paths.get(path) == wd:
+                del self._paths[path]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.mark_dirty(os.path.dirname(path))
+            return
+        if self.is_ignored(name):
+            return
+        self.mark_dirty(path)
+        if mask & IN_ISDIR:
+            subpath = os.path.join(path, name)
+            if mask & IN_MOVED_FROM:
+                # the watches follow the moved directory
+                self.remove_directory(subpath)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_directory(subpath, True)
+
+    def handle_server_event(self, root, name):
+        """
+        records the directory of a changed server meta file
+        Parameters:
+        - root
+          root directory of the local files
+        - name
+          name of the changed server file
+        """
+        if not name.startswith(SERVER_NAME_PREFIX):
+            return
+        relativepath = name.replace(SERVER_NAME_PREFIX, "/")
+        directory = get_existing_directory(root + relativepath, root)
+        if directory:
+            self.mark_dirty(directory)
+
+    def has_dirty_directories(self):
+        """
+        Returns:
+        - True:  changes are recorded
+        - False: no changes since the last sync
+        """
+        return len(self._dirty) > 0
+
+    def take_dirty_directories(self, now = None):
+        """
+        returns the changed directories once a burst of changes ended
+        and clears them
+        Parameters:
+        - now
+          current time
+        Returns:
+        - sorted list of changed directories. The list is empty if
+          there are no changes or more changes are expected.
+        """
+        if now == None:
+            now = time.time()
+        result = []
+        self._lock.acquire()
+        try:
+            if len(self._dirty) > 0:
+                quiet = now - self._lastevent >= self._coalescedelay
+                overdue = now - self._firstevent >= self._maxdelay
+                if quiet or overdue:
+                    result = self._dirty.keys()
+                    result.sort()
+                    self._dirty = {}
+                    self._firstevent = None
+                    self._lastevent = None
+        finally:
+            self._lock.release()
+        return result
+
+    def take_full_rescan(self):
+        """
+        Returns:
+        - True:  a full rescan is needed. The request is cleared.
+        - False: the recorded changes are complete or changes aren't
+                 watched, see is_available()
+        """
+        result = self._fullrescan
+        self._fullrescan = False
+        return result
+
+    def close(self):
+        """
+        stops watching all directories
+        """
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
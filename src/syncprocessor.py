@@ -12,8 +12,16 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import os.path
+import sys
+import time
+
+from threading import Condition, Thread
+
 from syncdebug import *
 from syncserver import *
+from syncstats import *
+from synctrace import *
 from localproperty import *
 
 # Constants representing actions
@@ -22,19 +30,47 @@ ACTION_UPLOAD = 0
 ACTION_DOWNLOAD = 1
 ACTION_DEL_CLIENT = 2
 ACTION_DEL_SERVER = 3
+ACTION_MOVE = 4
+
+# names of the actions in traces
+ACTION_NAMES = { ACTION_CONFLICT: "conflict", ACTION_UPLOAD: "upload",
+                 ACTION_DOWNLOAD: "download", ACTION_DEL_CLIENT: "delete-local",
+                 ACTION_DEL_SERVER: "delete-server", ACTION_MOVE: "move" }
+
+# Constants for the phases of processing. Actions of a phase are
+# only started after all actions of the previous phase are finished.
+PHASE_DIRECTORIES = 0
+PHASE_TRANSFERS = 1
+PHASE_DELETES = 2
+
+# default count of actions to process in parallel
+DEFAULT_CONCURRENCY = 1
+
+# names of the timed phases of planning. The local directory is scanned
+# while the server meta data is loaded, "wait" is the time the scan
+# had to wait for the server afterwards.
+TIMING_SCAN = "scan"
+TIMING_META = "meta"
+TIMING_WAIT = "wait"
+TIMING_MERGE = "merge"
+
+TIMING_PHASES = [ TIMING_SCAN, TIMING_META, TIMING_WAIT, TIMING_MERGE ]
 
 # Constants for action titles
 TITLE_UPLOAD = "Uploading %s"
 TITLE_DOWNLOAD = "Downloading %s"
 TITLE_DEL_LOCAL = "Deleting %s locally"
 TITLE_DEL_SERVER = "Deleting %s on server"
+TITLE_MOVE_LOCAL = "Moving %s to %s locally"
+TITLE_MOVE_SERVER = "Moving %s to %s on server"
 
 class ActionEntry(object):
     """
     manages a single action to process
     """
 
-    def __init__(self, localproperty, serverproperty, action):
+    def __init__(self, localproperty, serverproperty, action, source = None,
+                 sourceprocessor = None):
         """
         creates an instance
         Parameters:
@@ -44,10 +80,17 @@ class ActionEntry(object):
           file property on server side
         - action
           action to process
+        - source
+          for ACTION_MOVE the ActionEntry that deletes the old name
+        - sourceprocessor
+          for ACTION_MOVE the SyncProcessor of the old name if it
+          differs from the processor of the action
         """
         self._localproperty = localproperty
         self._serverproperty = serverproperty
         self._action = action
+        self._source = source
+        self._sourceprocessor = sourceprocessor
 
     def get_name(self):
         """
@@ -82,6 +125,50 @@ class ActionEntry(object):
         """
         return self._action
 
+    def get_source(self):
+        """
+        Returns:
+        - ActionEntry that deletes the old name of a moved file or None
+        """
+        return self._source
+
+    def get_source_processor(self):
+        """
+        Returns:
+        - SyncProcessor of the old name of a moved file or None if it
+          is the processor of the action
+        """
+        return self._sourceprocessor
+
+    def get_move_key(self):
+        """
+        returns the key to match deletions and transfers of the same
+        content. A deletion on the server and an upload of the same
+        content is a rename on the client, a local deletion and a
+        download is a rename on another client.
+        Returns:
+        - tuple of the transfer action and the checksum or None if
+          the action can't be part of a move
+        """
+        result = None
+        if self.is_directory_action():
+            return result
+        local = self._localproperty
+        server = self._serverproperty
+        if self._action == ACTION_DEL_SERVER and server:
+            if server.get_state() != STATE_DELETED:
+                result = (ACTION_UPLOAD, server.get_checksum())
+        if self._action == ACTION_UPLOAD and local:
+            if server == None or server.get_state() == STATE_DELETED:
+                result = (ACTION_UPLOAD, local.get_checksum())
+        if self._action == ACTION_DEL_CLIENT and local:
+            result = (ACTION_DOWNLOAD, local.get_checksum())
+        if self._action == ACTION_DOWNLOAD and server and local == None:
+            result = (ACTION_DOWNLOAD, server.get_checksum())
+        if result and result[1] == None:
+            result = None
+        return result
+
     def get_title(self):
         """
         Returns:
@@ -102,6 +189,11 @@ class ActionEntry(object):
         if self._action == ACTION_DEL_SERVER and self._serverproperty:
             name = self._serverproperty.get_name()
             title = TITLE_DEL_SERVER
+        if self._action == ACTION_MOVE:
+            if self._source.get_action() == ACTION_DEL_SERVER:
+                return TITLE_MOVE_SERVER % (self._source.get_name(),
+                                            self.get_name())
+            return TITLE_MOVE_LOCAL % (self._source.get_name(), self.get_name())
         if title != None and name != None:
             result = title % name
         return result
@@ -120,26 +212,269 @@ class ActionEntry(object):
             result = self._serverproperty.is_directory()
         return result
 
-    def is_obsolete(self):
+    def is_obsolete(self, root = None):
         """
         checks, if the action is obsolete
+        Parameters:
+        - root
+          optional root directory of the local files. If the checksums
+          were created by different algorithms, the local checksum is
+          created again with the algorithm of the server checksum.
         Returns:
         - True:  action is obsolete
         - False: action is not obsolete
         """
         result = False
         if self._action == ACTION_UPLOAD or self._action == ACTION_DOWNLOAD:
-            if not self.is_directory_action():
+            if self.is_directory_action():
+                # the content of directories is synchronized separately,
+                # so a directory that exists on both sides is up to date
+                if self._localproperty and self._serverproperty:
+                    if self._serverproperty.get_state() != STATE_DELETED:
+                        result = True
+            else:
                 localchecksum = None
                 if self._localproperty:
                     localchecksum = self._localproperty.get_checksum()
                 serverchecksum = None
                 if self._serverproperty:
                     serverchecksum = self._serverproperty.get_checksum()
+                localalgorithm = get_checksum_algorithm(localchecksum)
+                serveralgorithm = get_checksum_algorithm(serverchecksum)
+                if root != None and localalgorithm != serveralgorithm:
+                    if localalgorithm != None and serveralgorithm != None:
+                        localpath = root + self._localproperty.get_path()
+                        localchecksum = create_checksum(localpath, serveralgorithm)
                 if localchecksum == serverchecksum:
                     result = True
         return result
 
+    def get_phase(self):
+        """
+        Returns:
+        - phase in which the action has to be processed
+        """
+        result = PHASE_TRANSFERS
+        if self._action == ACTION_DEL_CLIENT or self._action == ACTION_DEL_SERVER:
+            result = PHASE_DELETES
+        elif self.is_directory_action():
+            result = PHASE_DIRECTORIES
+        return result
+
+def detect_moves(entries):
+    """
+    replaces deletions and transfers of the same content by moves
+    Parameters:
+    - entries
+      list of tuples of SyncProcessor and ActionEntry
+    Returns:
+    - list of tuples of SyncProcessor and ActionEntry. Each move
+      replaces the deletion of the old name and the transfer of the
+      new name.
+    """
+    deletions = {}
+    for entry in entries:
+        action = entry[1]
+        if action.get_action() in [ ACTION_DEL_SERVER, ACTION_DEL_CLIENT ]:
+            key = action.get_move_key()
+            if key:
+                deletions.setdefault(key, []).append(entry)
+    if len(deletions) == 0:
+        return entries
+    moves = {}
+    moved = {}
+    for entry in entries:
+        (processor, action) = entry
+        if action.get_action() in [ ACTION_UPLOAD, ACTION_DOWNLOAD ]:
+            key = action.get_move_key()
+            if key and deletions.get(key):
+                (sourceprocessor, source) = deletions[key].pop(0)
+                if sourceprocessor is processor:
+                    sourceprocessor = None
+                moveaction = ActionEntry(action.get_local_property(),
+                                         action.get_server_property(),
+                                         ACTION_MOVE, source, sourceprocessor)
+                if is_debug_enabled():
+                    debug("move = %s", moveaction.get_title())
+                moves[id(action)] = (processor, moveaction)
+                moved[id(source)] = True
+    result = []
+    for entry in entries:
+        action = entry[1]
+        if id(action) in moves:
+            result.append(moves[id(action)])
+        elif not id(action) in moved:
+            result.append(entry)
+    return result
+
+class ActionExecutor(object):
+    """
+    processes actions by a pool of worker threads. Directory actions
+    are processed one after another in the calling thread, so parent
+    directories always exist before their content is transferred.
+    """
+
+    def __init__(self, concurrency = DEFAULT_CONCURRENCY):
+        """
+        creates an instance
+        Parameters:
+        - concurrency
+          maximum count of actions processed in parallel
+        """
+        self._concurrency = max(1, concurrency)
+        self._condition = Condition()
+        self._tasks = []
+        self._running = 0
+        self._threads = []
+        self._stopped = False
+        self._phase = PHASE_DIRECTORIES
+
+    def get_concurrency(self):
+        """
+        Returns:
+        - maximum count of actions processed in parallel
+        """
+        return self._concurrency
+
+    def get_running_count(self):
+        """
+        Returns:
+        - count of the actions that are queued or processed
+        """
+        return self._running
+
+    def _start_threads(self):
+        """
+        starts the worker threads
+        """
+        for i in range(self._concurrency):
+            thread = Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        """
+        main loop of a worker thread
+        """
+        while True:
+            self._condition.acquire()
+            while len(self._tasks) == 0 and not self._stopped:
+                self._condition.wait()
+            if self._stopped and len(self._tasks) == 0:
+                self._condition.release()
+                break
+            (function, action, errorfunction) = self._tasks.pop(0)
+            self._condition.release()
+            try:
+                function(action)
+            except:
+                # there is no caller to raise the error to
+                self._report_error(action, errorfunction)
+            self._condition.acquire()
+            self._running = self._running - 1
+            self._condition.notifyAll()
+            self._condition.release()
+
+    def _report_error(self, action, errorfunction):
+        """
+        reports the exception of a failed action
+        Parameters:
+        - action
+          ActionEntry that failed
+        - errorfunction
+          function that logs an error message or None
+        """
+        message = "Unable to process %s: %s" % (action.get_title(),
+                                                 sys.exc_info()[1])
+        debug_error(message)
+        if errorfunction != None:
+            errorfunction(message)
+
+    def process(self, action, function, errorfunction = None):
+        """
+        processes an action. The call blocks while all workers are busy
+        or the action starts a new phase. A failed action doesn't stop
+        the sync: its error is passed to errorfunction, no matter if the
+        action is processed in the calling thread or by a worker.
+        Parameters:
+        - action
+          ActionEntry to process
+        - function
+          function that processes the action
+        - errorfunction
+          function that logs the error message if the action fails,
+          e.g. SyncServer.error()
+        """
+        phase = action.get_phase()
+        if phase != self._phase:
+            self.wait()
+            self._phase = phase
+        if self._concurrency == 1 or phase == PHASE_DIRECTORIES:
+            try:
+                function(action)
+            except:
+                self._report_error(action, errorfunction)
+        else:
+            if len(self._threads) == 0:
+                self._start_threads()
+            self._condition.acquire()
+            while self._running >= self._concurrency:
+                self._condition.wait()
+            self._running = self._running + 1
+            self._tasks.append((function, action, errorfunction))
+            self._condition.notifyAll()
+            self._condition.release()
+
+    def wait(self):
+        """
+        waits until all queued actions are processed
+        """
+        self._condition.acquire()
+        while self._running > 0:
+            self._condition.wait()
+        self._condition.release()
+
+    def stop(self):
+        """
+        waits for all queued actions and stops the worker threads
+        """
+        self.wait()
+        self._condition.acquire()
+        self._stopped = True
+        self._condition.notifyAll()
+        self._condition.release()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped = False
+        self._phase = PHASE_DIRECTORIES
+
+def start_crypt_pool(synccrypt, executor):
+    """
+    creates the process pool of a SyncCrypt instance if actions are
+    processed one after another. The pool is created before the first
+    action, while no worker threads are running. Actions processed in
+    parallel encrypt their chunks in their own thread instead.
+    Parameters:
+    - synccrypt
+      SyncCrypt instance or None
+    - executor
+      ActionExecutor that processes the actions
+    """
+    if synccrypt != None and executor.get_concurrency() <= 1:
+        synccrypt.start_pool()
+
+def stop_crypt_pool(synccrypt):
+    """
+    terminates the process pool of a SyncCrypt instance
+    Parameters:
+    - synccrypt
+      SyncCrypt instance or None
+    """
+    if synccrypt != None:
+        synccrypt.stop_pool()
+
 class PropertyEntry(object):
     """
     manages local and server properties
@@ -180,10 +515,75 @@ class SyncProcessor(object):
         self._synclocal = synclocal
         self._syncserver = syncserver
         self._actions = []
+        self._actionnames = {}
         self._actionindex = 0
         self._directory = directory
         self._synccrypt = None
         self._encryptupload = False
+        self._executor = ActionExecutor()
+        self._timings = {}
+        self._stats = None
+        self.set_stats(SyncStats())
+
+    def set_concurrency(self, concurrency):
+        """
+        sets the count of actions to process in parallel
+        Parameters:
+        - concurrency
+          maximum count of parallel actions
+        """
+        self._executor.stop()
+        self._executor = ActionExecutor(concurrency)
+
+    def get_timings(self):
+        """
+        Returns:
+        - dictionary with the seconds of each phase of the planning,
+          see TIMING_PHASES
+        """
+        return dict(self._timings)
+
+    def get_stats(self):
+        """
+        Returns:
+        - SyncStats with the timers and counters of the sync
+        """
+        return self._stats
+
+    def set_stats(self, stats):
+        """
+        sets the SyncStats to use. The local files and the server use
+        it as well.
+        Parameters:
+        - stats
+          SyncStats instance
+        """
+        self._stats = stats
+        self._synclocal.set_stats(stats)
+        if self._syncserver:
+            self._syncserver.set_stats(stats)
+
+    def get_transfer_size(self, action):
+        """
+        Parameters:
+        - action
+          processed ActionEntry
+        Returns:
+        - size of the local file of a transfer or 0
+        """
+        if action.get_action() == ACTION_UPLOAD:
+            fileproperty = action.get_local_property()
+        elif action.get_action() == ACTION_DOWNLOAD:
+            fileproperty = action.get_server_property()
+        else:
+            return 0
+        root = self._synclocal.get_root()
+        if fileproperty == None or fileproperty.is_directory() or not root:
+            return 0
+        try:
+            return os.path.getsize(root + fileproperty.get_path())
+        except OSError:
+            return 0
 
     def append_action(self, newaction):
         """
@@ -192,21 +592,36 @@ class SyncProcessor(object):
           new action to append
         """
         debug("entering SyncProcessor.append_action()")
-        debug_value("new action", newaction.get_title())
+        if is_debug_enabled():
+            debug("new action = %s", newaction.get_title())
         appendflag = True
-        if newaction.is_obsolete():
+        if newaction.is_obsolete(self._synclocal.get_root()):
             appendflag = False
             debug("action is obsolete")
-        for action in self._actions:
-            if action.get_name() == newaction.get_name():
-                appendflag = False
-                debug("action already exists")
-                break
+        elif newaction.get_name() in self._actionnames:
+            appendflag = False
+            debug("action already exists")
         if appendflag == True:
             self._actions.append(newaction)
+            self._actionnames[newaction.get_name()] = newaction
             debug("action appended")
         debug("exiting SyncProcessor.append_action()")
 
+    def set_actions(self, actions):
+        """
+        replaces the planned actions
+        Parameters:
+        - actions
+          list of ActionEntries
+        """
+        self._actions = []
+        self._actionnames = {}
+        for action in actions:
+            self._actions.append(action)
+            self._actionnames[action.get_name()] = action
+            if action.get_source():
+                self._actionnames[action.get_source().get_name()] = action
+
     def needs_encryption(self):
         """
         checks if the SyncProcessor needs a SyncCrypt instance to
@@ -246,9 +661,72 @@ class SyncProcessor(object):
         """
         should be called after processing
         """
+        self.wait_actions()
+        stop_crypt_pool(self._synccrypt)
+        self.save_meta()
+        self._syncserver.disconnect()
+
+    def wait_actions(self):
+        """
+        waits until all actions that are processed in parallel are
+        finished
+        """
+        self._executor.stop()
+
+    def save_meta(self):
+        """
+        saves the local and the server meta data
+        """
         self._synclocal.save_meta()
         self._syncserver.save_meta()
-        self._syncserver.disconnect()
+
+    def get_directory(self):
+        """
+        Returns:
+        - local directory to synchronize
+        """
+        return self._directory
+
+    def get_local(self):
+        """
+        Returns:
+        - SyncLocal to access local files
+        """
+        return self._synclocal
+
+    def get_server(self):
+        """
+        Returns:
+        - SyncServer to use
+        """
+        return self._syncserver
+
+    def get_subdirectories(self):
+        """
+        determines the subdirectories that exist after processing the
+        planned actions. Directories that are deleted are not included.
+        Returns:
+        - list of full paths of the subdirectories
+        """
+        result = []
+        deleted = {}
+        for action in self._actions:
+            if action.get_action() in [ ACTION_DEL_CLIENT, ACTION_DEL_SERVER ]:
+                deleted[action.get_name()] = True
+        names = {}
+        for prop in self._synclocal.get_properties():
+            current = prop.get_current()
+            if current and current.is_directory():
+                names[current.get_name()] = True
+        for prop in self._syncserver.get_property_list():
+            if prop.is_directory() and prop.get_state() != STATE_DELETED:
+                names[prop.get_name()] = True
+        namelist = names.keys()
+        namelist.sort()
+        for name in namelist:
+            if not name in deleted:
+                result.append(os.path.join(self._directory, name))
+        return result
 
     def has_open_actions(self):
         """
@@ -272,6 +750,17 @@ class SyncProcessor(object):
         """
         return len(self._actions)
 
+    def get_action_by_name(self, name):
+        """
+        returns the action for a file name
+        Parameters:
+        - name
+          name of the file
+        Returns:
+        - ActionEntry or None
+        """
+        return self._actionnames.get(name)
+
     def get_action_index(self):
         """
         Returns:
@@ -296,28 +785,95 @@ class SyncProcessor(object):
         if self.has_open_actions():
             action = self._actions[self._actionindex]
             self._actionindex = self._actionindex + 1
-            if action.get_action() == ACTION_UPLOAD:
-                localproperty = action.get_local_property()
-                if self._encryptupload:
-                    self._syncserver.upload(localproperty, self._synccrypt)
-                else:
-                    self._syncserver.upload(localproperty, False)
-            if action.get_action() == ACTION_DOWNLOAD:
-                serverproperty = action.get_server_property()
-                self._syncserver.download(serverproperty, self._synccrypt)
-            if action.get_action() == ACTION_DEL_CLIENT:
-                localproperty = action.get_local_property()
-                self._synclocal.delete(localproperty)
-            if action.get_action() == ACTION_DEL_SERVER:
-                serverproperty = action.get_server_property()
-                self._syncserver.delete(serverproperty)
+            start_crypt_pool(self._synccrypt, self._executor)
+            self._executor.process(action, self.process_action,
+                                   self._syncserver.error)
+
+    def process_action(self, action):
+        """
+        processes a single action
+        Parameters:
+        - action
+          ActionEntry to process
+        """
+        start = time.time()
+        try:
+            self._process_action(action)
+        finally:
+            duration = time.time() - start
+            name = ACTION_NAMES.get(action.get_action())
+            self._stats.add_action(name, self.get_transfer_size(action),
+                                   duration)
+            if is_trace_enabled():
+                trace_action(self._syncserver.get_relative_path(),
+                             action.get_name(), name, action.get_phase(),
+                             duration)
+
+    def _process_action(self, action):
+        """
+        processes a single action without tracing it
+        Parameters:
+        - action
+          ActionEntry to process
+        """
+        if action.get_action() == ACTION_UPLOAD:
+            localproperty = action.get_local_property()
+            if self._encryptupload:
+                self._syncserver.upload(localproperty, self._synccrypt)
+            else:
+                self._syncserver.upload(localproperty, False)
+        if action.get_action() == ACTION_DOWNLOAD:
+            serverproperty = action.get_server_property()
+            self._syncserver.download(serverproperty, self._synccrypt)
+        if action.get_action() == ACTION_DEL_CLIENT:
+            localproperty = action.get_local_property()
+            self._synclocal.delete(localproperty)
+        if action.get_action() == ACTION_DEL_SERVER:
+            serverproperty = action.get_server_property()
+            self._syncserver.delete(serverproperty)
+        if action.get_action() == ACTION_MOVE:
+            self.process_move(action)
+
+    def process_move(self, action):
+        """
+        renames a file on the server or locally. If the rename fails the
+        file is transferred and the old name is deleted. The fallback
+        is counted and traced as part of the move.
+        Parameters:
+        - action
+          ActionEntry with ACTION_MOVE
+        """
+        source = action.get_source()
+        sourceprocessor = action.get_source_processor()
+        if sourceprocessor == None:
+            sourceprocessor = self
+        if source.get_action() == ACTION_DEL_SERVER:
+            localproperty = action.get_local_property()
+            if not self._syncserver.move(localproperty,
+                                         source.get_server_property(),
+                                         sourceprocessor.get_server()):
+                debug("move failed, upload file")
+                self._process_action(ActionEntry(localproperty, None,
+                                                 ACTION_UPLOAD))
+                sourceprocessor._process_action(source)
+        else:
+            serverproperty = action.get_server_property()
+            if not self._synclocal.move(source.get_local_property(),
+                                        serverproperty,
+                                        sourceprocessor.get_local()):
+                debug("move failed, download file")
+                self._process_action(ActionEntry(None, serverproperty,
+                                                 ACTION_DOWNLOAD))
+                sourceprocessor._process_action(source)
 
     def _init_actions(self):
         """
         initiates the actions to process
         """
         debug("entering SyncProcessor._init_actions()")
-        for entry in self._merge_properties():
+        propertyentries = self._merge_properties()
+        start = time.time()
+        for entry in propertyentries:
             local = entry.get_local_property()
             localcurrent = None
             if local:
@@ -325,24 +881,20 @@ class SyncProcessor(object):
             server = entry.get_server_property()
             if local != None and server == None:
                 debug("local != None and server == None")
-                debug_value("local.get_name()", local.get_name())   
-                debug_value("local.get_state()", local.get_state())
+                debug("local %s: %s", local.get_name(), local.get_state())
                 if local.get_state() != STATE_DELETED:
                     action = ActionEntry(localcurrent, server, ACTION_UPLOAD)
                     self.append_action(action)
             if local == None and server != None:
                 debug("local == None and server != None")
-                debug_value("server.get_name()", server.get_name()) 
-                debug_value("server.get_state()", server.get_state())
+                debug("server %s: %s", server.get_name(), server.get_state())
                 if server.get_state() != STATE_DELETED:
                     action = ActionEntry(localcurrent, server, ACTION_DOWNLOAD)
                     self.append_action(action)
             if local != None and server != None:
                 debug("local != None and server != None")
-                debug_value("local.get_name()", local.get_name())   
-                debug_value("local.get_state()", local.get_state())
-                debug_value("server.get_name()", server.get_name()) 
-                debug_value("server.get_state()", server.get_state())
+                debug("local %s: %s", local.get_name(), local.get_state())
+                debug("server %s: %s", server.get_name(), server.get_state())
                 delflag = False
                 if server.get_state() == STATE_DELETED:
                     localstamp = local.get_timestamp()
@@ -360,16 +912,23 @@ class SyncProcessor(object):
                 if not delflag:
                     localstamp = local.get_timestamp()
                     serverstamp = server.get_timestamp()
-                    debug_value("localstamp - serverstamp", localstamp - serverstamp)
+                    debug("localstamp = %s, serverstamp = %s", localstamp,
+                          serverstamp)
                     if localstamp - serverstamp > 0.1:
                         action = ActionEntry(localcurrent, server, ACTION_UPLOAD)
                         self.append_action(action)
-                        debug_value("action", action.get_title())
-                    debug_value("serverstamp - localstamp", serverstamp - localstamp)
                     if serverstamp - localstamp > 0.1:
                         action = ActionEntry(localcurrent, server, ACTION_DOWNLOAD)
                         self.append_action(action)
-                        debug_value("action", action.get_title())
+        entries = []
+        for action in self._actions:
+            entries.append((self, action))
+        actions = []
+        for (processor, action) in detect_moves(entries):
+            actions.append(action)
+        actions.sort(key=lambda action: action.get_phase())
+        self.set_actions(actions)
+        self._stats.add_time(STATS_PLAN, time.time() - start)
         debug("exiting SyncProcessor._init_actions()")
 
     def _merge_properties(self):
@@ -381,22 +940,358 @@ class SyncProcessor(object):
         debug("entering SyncProcessor._merge_properties()")
         propertylist = []
         propertydict = {}
-        self._synclocal.read_directory(self._directory)
+        # the server meta data is loaded while the local files are hashed
+        failure = []
+        loader = Thread(target=self._load_server_meta, args=(failure,))
+        loader.start()
+        start = time.time()
+        try:
+            self._synclocal.read_directory(self._directory)
+        finally:
+            self._timings[TIMING_SCAN] = time.time() - start
+            start = time.time()
+            loader.join()
+            self._timings[TIMING_WAIT] = time.time() - start
+        if len(failure) > 0:
+            (exctype, value, traceback) = failure[0]
+            raise exctype, value, traceback
+        start = time.time()
         for prop in self._synclocal.get_properties():
             entry = PropertyEntry(prop, None)
             propertylist.append(entry)
-            debug_value("local property", prop.get_name())
+            debug("local property = %s", prop.get_name())
             propertydict[prop.get_name()] = entry
-        self._syncserver.connect()
-        self._syncserver.load_meta()
         for prop in self._syncserver.get_property_list():
             name = prop.get_name()
-            debug_value("server property", name)
-            if name in propertydict.keys():
+            debug("server property = %s", name)
+            if name in propertydict:
                 entry = propertydict[name]
                 entry.set_server_property(prop)
             else:
                 entry = PropertyEntry(None, prop)
                 propertylist.append(entry)
+        self._timings[TIMING_MERGE] = time.time() - start
+        self._stats.add_time(STATS_SCAN, self._timings[TIMING_SCAN])
+        debug("timings = %s", self._timings)
+        if is_trace_enabled():
+            for phase in TIMING_PHASES:
+                trace_phase(self._syncserver.get_relative_path(), phase,
+                            self._timings.get(phase, 0.0))
         debug("exiting SyncProcessor._merge_properties()")
         return propertylist
+
+    def _load_server_meta(self, failure):
+        """
+        connects to the server and loads its meta data
+        Parameters:
+        - failure
+          list to append the exception info to if loading fails
+        """
+        start = time.time()
+        try:
+            self._syncserver.connect()
+            self._syncserver.load_meta()
+        except:
+            failure.append(sys.exc_info())
+        self._timings[TIMING_META] = time.time() - start
+
+class TreeSyncProcessor(object):
+    """
+    synchronizes a directory and all of its subdirectories in a single
+    session. The tree is walked once, the actions of all directories are
+    planned together, one server connection is used and the meta data
+    of each directory is saved once at the end.
+    """
+
+    def __init__(self, config, root, directory, hiddenpolicy = HIDDEN_SKIP):
+        """
+        creates an instance
+        Parameters:
+        - config
+          configuration entry to use
+        - root
+          root directory of the local files
+        - directory
+          local directory to synchronize recursively
+        - hiddenpolicy
+          policy for hidden files and directories
+        """
+        self._config = config
+        self._root = root
+        self._directory = directory
+        self._hiddenpolicy = hiddenpolicy
+        self._checksumcache = None
+        self._connection = None
+        self._processors = []
+        self._actions = []
+        self._actionindex = 0
+        self._synccrypt = None
+        self._encryptupload = False
+        self._executor = ActionExecutor()
+        self._dirtydirectories = None
+        self._stats = SyncStats()
+
+    def set_concurrency(self, concurrency):
+        """
+        sets the count of actions to process in parallel
+        Parameters:
+        - concurrency
+          maximum count of parallel actions
+        """
+        self._executor.stop()
+        self._executor = ActionExecutor(concurrency)
+
+    def set_dirty_directories(self, directories):
+        """
+        restricts the sync to changed directories. Subdirectories are
+        only visited if they changed as well or were never synchronized.
+        Parameters:
+        - directories
+          list of changed directories or None to synchronize the whole
+          tree
+        """
+        self._dirtydirectories = directories
+
+    def get_start_directories(self):
+        """
+        Returns:
+        - list of directories to start walking the tree
+        """
+        if self._dirtydirectories == None:
+            return [ self._directory ]
+        result = []
+        prefix = self._directory + os.sep
+        for directory in self._dirtydirectories:
+            if directory == self._directory or directory.startswith(prefix):
+                # deleted directories are handled by their parents
+                if os.path.isdir(directory):
+                    result.append(directory)
+        result.sort(key=lambda directory: directory.count(os.sep))
+        return result
+
+    def is_walked(self, directory):
+        """
+        checks if a subdirectory has to be synchronized
+        Parameters:
+        - directory
+          full path of the subdirectory
+        Returns:
+        - True:  subdirectory is synchronized
+        - False: subdirectory is unchanged
+        """
+        if self._dirtydirectories == None:
+            return True
+        if not os.path.isdir(directory):
+            # the directory is created by the sync
+            return True
+        return not os.path.exists(os.path.join(directory, META_FILENAME))
+
+    def create_processor(self, directory):
+        """
+        creates the SyncProcessor for a single directory of the tree
+        Parameters:
+        - directory
+          directory to synchronize
+        Returns:
+        - created SyncProcessor
+        """
+        local = SyncLocal(self._root, self._hiddenpolicy)
+        if self._checksumcache == None:
+            self._checksumcache = local.get_checksum_cache()
+        else:
+            local.set_checksum_cache(self._checksumcache)
+        server = SyncServer(self._config, local, directory, self._connection)
+        if self._connection == None:
+            self._connection = server
+        processor = SyncProcessor(local, directory, server)
+        processor.set_encryption(self._synccrypt, self._encryptupload)
+        processor.set_stats(self._stats)
+        return processor
+
+    def set_encryption(self, synccrypt, uploadflag=False):
+        """
+        sets the SyncCrypt instance
+        Parameters:
+        - synccrypt
+          SyncCrypt instance
+        - uploadflag
+          determines if uploads should be encrypted
+        """
+        self._synccrypt = synccrypt
+        self._encryptupload = uploadflag
+        for processor in self._processors:
+            processor.set_encryption(synccrypt, uploadflag)
+
+    def needs_encryption(self):
+        """
+        Returns:
+        - True:  a SyncCrypt instance is needed to decrypt downloads
+        - False: no SyncCrypt instance is needed
+        """
+        result = False
+        for processor in self._processors:
+            if processor.needs_encryption():
+                result = True
+                break
+        return result
+
+    def startup(self):
+        """
+        walks the directory tree and plans the actions of all
+        directories
+        """
+        debug("entering TreeSyncProcessor.startup()")
+        pending = self.get_start_directories()
+        visited = {}
+        while len(pending) > 0:
+            directory = pending.pop(0)
+            if directory in visited:
+                continue
+            visited[directory] = True
+            debug("directory = %s", directory)
+            processor = self.create_processor(directory)
+            processor.startup()
+            self._processors.append(processor)
+            for action in processor.get_actions():
+                self._actions.append((processor, action))
+            for subdir in processor.get_subdirectories():
+                name = os.path.basename(subdir)
+                if self._hiddenpolicy == HIDDEN_SKIP and name.startswith("."):
+                    continue
+                if self.is_walked(subdir):
+                    pending.append(subdir)
+        # files that were moved to another directory
+        start = time.time()
+        self._actions = detect_moves(self._actions)
+        processoractions = {}
+        for (processor, action) in self._actions:
+            processoractions.setdefault(id(processor), []).append(action)
+        for processor in self._processors:
+            processor.set_actions(processoractions.get(id(processor), []))
+        self._actions.sort(key=lambda entry: entry[1].get_phase())
+        self._stats.add_time(STATS_PLAN, time.time() - start)
+        debug("directories = %s", len(self._processors))
+        debug("actions = %s", len(self._actions))
+        debug("exiting TreeSyncProcessor.startup()")
+
+    def wait_actions(self):
+        """
+        waits until all actions that are processed in parallel are
+        finished
+        """
+        self._executor.stop()
+
+    def shutdown(self):
+        """
+        saves the meta data of all directories and disconnects
+        """
+        self.wait_actions()
+        stop_crypt_pool(self._synccrypt)
+        for processor in self._processors:
+            local = processor.get_local()
+            if local.get_directory() == None:
+                # directory was created while synchronizing
+                local.set_directory(processor.get_directory())
+            processor.save_meta()
+        if self._connection:
+            self._connection.disconnect()
+
+    def get_stats(self):
+        """
+        Returns:
+        - SyncStats with the timers and counters of all directories
+        """
+        return self._stats
+
+    def get_timings(self):
+        """
+        Returns:
+        - dictionary with the seconds of each phase of the planning
+          summed up over all directories, see TIMING_PHASES
+        """
+        result = {}
+        for phase in TIMING_PHASES:
+            result[phase] = 0.0
+        for processor in self._processors:
+            for (phase, seconds) in processor.get_timings().items():
+                result[phase] = result[phase] + seconds
+        return result
+
+    def get_processors(self):
+        """
+        Returns:
+        - list of the SyncProcessors of all directories
+        """
+        return self._processors
+
+    def get_errors(self):
+        """
+        Returns:
+        - list of the errors of all server instances
+        """
+        result = []
+        for processor in self._processors:
+            result.extend(processor.get_server().get_errors())
+        return result
+
+    def clear_errors(self):
+        """
+        clears the errors of all server instances
+        """
+        for processor in self._processors:
+            processor.get_server().clear_errors()
+
+    def has_open_actions(self):
+        """
+        Returns:
+        - True:  there are actions to process
+        - False: no actions to process
+        """
+        return self._actionindex < len(self._actions)
+
+    def get_action_count(self):
+        """
+        Returns:
+        - total count of all actions
+        """
+        return len(self._actions)
+
+    def get_action_index(self):
+        """
+        Returns:
+        - index of the next action to process
+        """
+        return self._actionindex
+
+    def get_action_title(self):
+        """
+        Returns:
+        - title of the next action to process
+        """
+        result = None
+        if self._actionindex < len(self._actions):
+            (processor, action) = self._actions[self._actionindex]
+            result = action.get_title()
+        return result
+
+    def get_action_directory(self):
+        """
+        Returns:
+        - directory of the next action to process
+        """
+        result = None
+        if self._actionindex < len(self._actions):
+            (processor, action) = self._actions[self._actionindex]
+            result = processor.get_directory()
+        return result
+
+    def process_next_action(self):
+        """
+        processes the next action
+        """
+        if self.has_open_actions():
+            (processor, action) = self._actions[self._actionindex]
+            self._actionindex = self._actionindex + 1
+            start_crypt_pool(self._synccrypt, self._executor)
+            self._executor.process(action, processor.process_action,
+                                   processor.get_server().error)
@@ -12,34 +12,61 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import copy
 import hashlib
 import shutil
 import os
 import os.path
 import stat
+import time
 
 from cStringIO import StringIO
+from threading import Lock, current_thread
 
 from errorlog import *
 from fileproperty import *
 from localproperty import *
 from syncconfig import *
+from synccopy import *
 from synccrypt import *
 from syncdebug import *
+from syncdelta import *
+from synctrace import *
 
 # Constants for config keys
 CONFIG_KEY_TYPE = "type"
 CONFIG_KEY_ROOT = "root"
 CONFIG_KEY_SERVER_DIRECTORY = "server-directory"
 CONFIG_KEY_ENCRYPTION = "encryption"
+CONFIG_KEY_CONCURRENCY = "concurrency"
+CONFIG_KEY_DELTA = "delta"
+CONFIG_KEY_DELTA_BLOCKSIZE = "delta-blocksize"
+CONFIG_KEY_STORE = "store"
 
 CONFIG_VALUE_FILE = "filesystem"
 CONFIG_VALUE_FTP = "ftp"
 CONFIG_VALUE_TRUE = "true"
+CONFIG_VALUE_CONTENT = "content"
 
 # Name of the server meta file
 SERVER_META_FILENAME = "syncsrvmeta"
 
+# Name of the file with the salt of the key derivation
+SERVER_SALT_FILENAME = "syncsrvsalt"
+
+# attempts to read a salt that is invalid, e.g. while a client of a
+# former version writes it
+SALT_READ_ATTEMPTS = 3
+SALT_READ_DELAY = 0.2
+
+# Name of the directory with the blobs of the content-addressed store
+OBJECT_DIRECTORY = "objects"
+
+# seconds a blob is kept after it was stored or reused, so a blob that
+# another client just references isn't collected before its meta data
+# is written
+BLOB_GRACE_SECONDS = 600
+
 def create_hash(s):
     """
     creates a hash value of a string
@@ -66,7 +93,7 @@ class SyncServer(ErrorLog):
     facade for server-related operations
     """
 
-    def __init__(self, config, local, localdir):
+    def __init__(self, config, local, localdir, connection = None):
         """
         creates an instance
         Parameters:
@@ -76,8 +103,13 @@ class SyncServer(ErrorLog):
           SyncLocal to access the local files
         - localdir
           local directory to syncronize
+        - connection
+          optional SyncServer whose connection is shared. connect()
+          and disconnect() are left to the owner of the connection.
         """
         ErrorLog.__init__(self)
+        self._connection = connection
+        self._connected = False
         self._instance = None
         self._config = config
         self._local = local
@@ -93,6 +125,10 @@ class SyncServer(ErrorLog):
             self._relative_path = self._localdir
         self._list = []
         self._dict = {}
+        self._lock = Lock()
+        self._stats = None
+        self._salt = None
+        self._modified = False
         typeconfig = self._config.get_value(CONFIG_KEY_TYPE)
         if typeconfig == CONFIG_VALUE_FILE:
             self._instance = SyncFileServer(self)
@@ -110,6 +146,21 @@ class SyncServer(ErrorLog):
         """
         self._list = []
         self._dict = {}
+        self._modified = False
+
+    def is_modified(self):
+        """
+        Returns:
+        - True:  properties were changed since they were loaded
+        - False: properties are unchanged
+        """
+        return self._modified
+
+    def set_modified(self):
+        """
+        marks the properties as changed
+        """
+        self._modified = True
 
     def append_property(self, fileproperty):
         """
@@ -129,24 +180,43 @@ class SyncServer(ErrorLog):
         """
         debug("entering SyncServer.update_property()")
         name = fileproperty.get_name()
-        if name in self._dict.keys():
-            debug("updating existing property")
-            existingproperty = self._dict[name]
-            existingproperty.set_values(fileproperty)
-        else:
-            debug("adding new property")
-            self.append_property(fileproperty)
-        if get_debug_flag():
-            for fileproperty in self._list:
-                debug_value("fileproperty.name", fileproperty.get_name())
-                debug_value("fileproperty.path", fileproperty.get_path())
-                debug_value("fileproperty.hostname", fileproperty.get_hostname())
-                debug_value("fileproperty.timestamp", fileproperty.get_timestamp())
-                debug_value("fileproperty.checksum", fileproperty.get_checksum())
-                debug_value("fileproperty.state", fileproperty.get_state())
-                debug_value("fileproperty.type", fileproperty.get_type())
+        start = time.time()
+        oldstate = None
+        self._lock.acquire()
+        try:
+            if name in self._dict:
+                debug("updating existing property")
+                existingproperty = self._dict[name]
+                oldstate = existingproperty.get_state()
+                existingproperty.set_values(fileproperty)
+            else:
+                debug("adding new property")
+                self.append_property(fileproperty)
+            self._modified = True
+            # the journal is written after the lock is released
+            journalproperty = copy.copy(self._dict[name])
+        finally:
+            self._lock.release()
+        self.journal_property(journalproperty)
+        if is_debug_enabled(DEBUG_LEVEL_DETAIL):
+            debug_property(fileproperty)
+        if is_trace_enabled():
+            trace_mutation(self._relative_path, name, oldstate,
+                           fileproperty.get_state(), time.time() - start)
+            trace_snapshot(self._relative_path, self._list)
         debug("exiting SyncServer.update_property()")
 
+    def journal_property(self, fileproperty):
+        """
+        writes a changed file property to the journal of the meta data,
+        so the change survives an interrupted sync
+        Parameters:
+        - fileproperty
+          changed file property
+        """
+        if self._instance:
+            self._instance.journal_property(fileproperty)
+
     def get_property_list(self):
         """
         Returns:
@@ -164,7 +234,7 @@ class SyncServer(ErrorLog):
         - property with the given name
         """
         result = None
-        if name in self._dict.keys():
+        if name in self._dict:
             result = self._dict[name]
         return result
 
@@ -182,6 +252,22 @@ class SyncServer(ErrorLog):
         """
         return self._localdir
 
+    def get_stats(self):
+        """
+        Returns:
+        - SyncStats that times the meta data access or None
+        """
+        return self._stats
+
+    def set_stats(self, stats):
+        """
+        sets the SyncStats to time the meta data access
+        Parameters:
+        - stats
+          SyncStats instance or None
+        """
+        self._stats = stats
+
     def get_relative_path(self):
         """
         Returns:
@@ -196,12 +282,34 @@ class SyncServer(ErrorLog):
         """
         return self._local
 
+    def get_connection(self):
+        """
+        Returns:
+        - SyncServer whose connection is shared or None
+        """
+        return self._connection
+
+    def is_connected(self):
+        """
+        Returns:
+        - True:  server is connected
+        - False: server is not connected
+        """
+        if self._connection:
+            return self._connection.is_connected()
+        return self._connected
+
     def connect(self):
         """
         connects to server
         """
+        if self._connection:
+            return
+        if self._connected:
+            return
         if self._instance:
             self._instance.connect()
+            self._connected = True
         else:
             self.error("connect() failed. No server instance.")
 
@@ -209,8 +317,11 @@ class SyncServer(ErrorLog):
         """
         disconnects from server
         """
+        if self._connection:
+            return
         if self._instance:
             self._instance.disconnect()
+            self._connected = False
         else:
             self.error("disconnect() failed. No server instance.")
 
@@ -255,23 +366,114 @@ class SyncServer(ErrorLog):
         else:
             self.error("delete() failed. No server instance.")
 
+    def move(self, fileproperty, srcproperty, srcserver=None):
+        """
+        renames a file on the server
+        Parameters:
+        - fileproperty
+          property of the local file with the new name
+        - srcproperty
+          server property of the old name
+        - srcserver
+          optional SyncServer with the meta data of the old name
+        Returns:
+        - True:  file was renamed
+        - False: file could not be renamed
+        """
+        result = False
+        if srcserver == None:
+            srcserver = self
+        if self._instance:
+            result = self._instance.move(fileproperty, srcproperty, srcserver)
+        else:
+            self.error("move() failed. No server instance.")
+        return result
+
+    def get_copy_stats(self):
+        """
+        Returns:
+        - CopyStats of the server instance or None
+        """
+        result = None
+        if self._instance:
+            result = self._instance.get_copy_stats()
+        return result
+
+    def get_released_blobs(self):
+        """
+        Returns:
+        - set of the paths of blobs that lost a reference or None
+        """
+        result = None
+        if self._instance:
+            result = self._instance.get_released_blobs()
+        return result
+
+    def get_salt(self, createflag=False):
+        """
+        returns the salt to derive the encryption key. The salt is read
+        once per connection.
+        Parameters:
+        - createflag
+          creates a salt if the server doesn't have one
+        Returns:
+        - tuple of salt and iterations or None if the server has no salt
+        """
+        if self._connection:
+            return self._connection.get_salt(createflag)
+        self._lock.acquire()
+        try:
+            if self._salt == None and self._instance:
+                self._salt = self._instance.load_salt(createflag)
+            return self._salt
+        finally:
+            self._lock.release()
+
+    def set_salt(self, synccrypt, createflag=False):
+        """
+        sets the salt of the server for a SyncCrypt instance
+        Parameters:
+        - synccrypt
+          SyncCrypt instance
+        - createflag
+          creates a salt if the server doesn't have one. This is needed
+          to encrypt files, so they never use the key of former versions.
+        Raises:
+        - IOError if the salt is invalid or couldn't be created
+        """
+        salt = self.get_salt(createflag)
+        if salt:
+            synccrypt.set_salt(salt[0], salt[1])
+        elif createflag:
+            raise IOError("salt of the server is not available")
+        else:
+            synccrypt.set_salt(None)
+
     def load_meta(self):
         """
         loads the meta data
         """
+        start = time.time()
         if self._instance:
             self._instance.load_meta()
         else:
             self.error("load_meta() failed. No server instance.")
+        if self._stats != None:
+            self._stats.add_time(STATS_META_LOAD, time.time() - start)
 
     def save_meta(self):
         """
         saves the meta data
         """
+        if is_trace_enabled():
+            trace_snapshot(self._relative_path, self._list, True)
+        start = time.time()
         if self._instance:
             self._instance.save_meta()
         else:
             self.error("save_meta() failed. No server instance.")
+        if self._stats != None:
+            self._stats.add_time(STATS_META_SAVE, time.time() - start)
 
 
 class SyncFileServer(object):
@@ -291,6 +493,84 @@ class SyncFileServer(object):
         config = self._parent.get_config()
         self._root = config.get_value(CONFIG_KEY_ROOT)
         self._serverdirectory = config.get_value(CONFIG_KEY_SERVER_DIRECTORY)
+        self._delta = config.get_value(CONFIG_KEY_DELTA) == CONFIG_VALUE_TRUE
+        self._deltablocksize = DELTA_BLOCKSIZE
+        blocksize = config.get_value(CONFIG_KEY_DELTA_BLOCKSIZE)
+        if blocksize and blocksize.isdigit():
+            self._deltablocksize = max(512, int(blocksize))
+        if self._parent.get_connection():
+            # servers that share a connection count the copies together
+            self._copystats = self._parent.get_connection().get_copy_stats()
+            self._releasedblobs = \
+                self._parent.get_connection().get_released_blobs()
+        else:
+            self._copystats = CopyStats()
+            self._releasedblobs = set()
+        self._contentstore = config.get_value(CONFIG_KEY_STORE) == CONFIG_VALUE_CONTENT
+        if self._contentstore:
+            # blobs are never modified, so delta transfers don't apply
+            self._delta = False
+        self._journal = None
+
+    def get_copy_stats(self):
+        """
+        Returns:
+        - CopyStats with the backends used to copy files
+        """
+        return self._copystats
+
+    def get_released_blobs(self):
+        """
+        Returns:
+        - set of the paths of blobs that lost a reference in this session
+        """
+        return self._releasedblobs
+
+    def release_blob(self, fileproperty):
+        """
+        notes that a server property doesn't reference its blob anymore.
+        The blob is removed by collect_blobs() if no other property
+        references it.
+        Parameters:
+        - fileproperty
+          server property that is deleted or replaced
+        """
+        if not self._contentstore or fileproperty == None:
+            return
+        checksum = fileproperty.get_checksum()
+        if checksum and not fileproperty.is_directory():
+            self._releasedblobs.add(self.get_blob_path(checksum,
+                                    fileproperty.get_encrypted()))
+
+    def copy(self, srcpath, destpath, relativepath):
+        """
+        copies a file with the fastest available backend
+        Parameters:
+        - srcpath
+          path of the source file
+        - destpath
+          path of the destination file
+        - relativepath
+          relative path of the file within the root directory
+        """
+        backend = copy_file(srcpath, destpath)
+        self.count_copy(backend, os.path.getsize(destpath), relativepath)
+
+    def count_copy(self, backend, size, relativepath):
+        """
+        counts a copied file in the CopyStats and the SyncStats
+        Parameters:
+        - backend
+          name of the backend that copied the file
+        - size
+          size of the file
+        - relativepath
+          relative path of the file within the root directory
+        """
+        self._copystats.add(backend, size, relativepath)
+        stats = self._parent.get_stats()
+        if stats != None:
+            stats.add_copy(backend, size)
 
     def connect(self):
         """
@@ -300,9 +580,240 @@ class SyncFileServer(object):
 
     def disconnect(self):
         """
-        disconnects from server
+        disconnects from server. Blobs that lost their last reference
+        are removed.
         """
-        pass
+        if len(self._releasedblobs) > 0:
+            self.collect_blobs()
+            self._releasedblobs.clear()
+
+    def get_referenced_blobs(self):
+        """
+        reads all meta files and their journals on the server
+        Returns:
+        - set of the paths of the blobs that properties reference or
+          None if a meta file couldn't be read
+        """
+        result = set()
+        directory = self._serverdirectory
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(META_JOURNAL_PREFIX):
+                # journal of a meta file that was never saved
+                metaname = name[len(META_JOURNAL_PREFIX):]
+                if os.path.exists(os.path.join(directory, metaname)):
+                    continue
+            elif name.startswith(META_TEMP_PREFIX) or \
+                 name.startswith(SIGNATURE_PREFIX) or \
+                 name == SERVER_SALT_FILENAME or not os.path.isfile(path):
+                continue
+            else:
+                metaname = name
+            try:
+                if metaname == name and not is_meta_file(path):
+                    continue
+                propertylist = load_property_file(directory, metaname)
+            except Exception, e:
+                debug_error("Unable to read meta file %s: %s", path, e)
+                return None
+            for fileproperty in propertylist:
+                checksum = fileproperty.get_checksum()
+                if checksum and fileproperty.get_state() != STATE_DELETED:
+                    result.add(self.get_blob_path(checksum,
+                                                  fileproperty.get_encrypted()))
+        return result
+
+    def collect_blobs(self):
+        """
+        removes the blobs that no meta file references anymore. All
+        meta files are marked and all blobs of the store are swept.
+        Blobs that were stored or reused recently are kept, see
+        BLOB_GRACE_SECONDS.
+        Returns:
+        - count of the removed blobs
+        """
+        debug("entering SyncFileServer.collect_blobs()")
+        result = 0
+        objectdirectory = os.path.join(self._serverdirectory, OBJECT_DIRECTORY)
+        referenced = None
+        if os.path.isdir(objectdirectory):
+            referenced = self.get_referenced_blobs()
+        if referenced != None:
+            limit = time.time() - BLOB_GRACE_SECONDS
+            for subdirectory in os.listdir(objectdirectory):
+                blobdirectory = os.path.join(objectdirectory, subdirectory)
+                if not os.path.isdir(blobdirectory):
+                    continue
+                for name in os.listdir(blobdirectory):
+                    blobpath = os.path.join(blobdirectory, name)
+                    if blobpath in referenced:
+                        continue
+                    try:
+                        if os.path.getmtime(blobpath) > limit:
+                            continue
+                        os.remove(blobpath)
+                        result = result + 1
+                    except OSError, e:
+                        debug_error("Unable to remove blob %s: %s", blobpath, e)
+        debug("removed blobs = %s", result)
+        debug("exiting SyncFileServer.collect_blobs()")
+        return result
+
+    def get_blob_path(self, checksum, encrypted):
+        """
+        returns the path of a blob in the content-addressed store. The
+        checksum of a file property references the blob with its content.
+        Parameters:
+        - checksum
+          checksum of the content
+        - encrypted
+          True if the blob contains the encrypted content
+        Returns:
+        - path of the blob
+        """
+        name = checksum.replace(CHECKSUM_SEPARATOR, "-")
+        if encrypted:
+            name = name + ENCRYPTION_EXTENSION
+        return os.path.join(self._serverdirectory, OBJECT_DIRECTORY,
+                            name[-2:], name)
+
+    def upload_blob(self, fileproperty, srcpath, synccrypt):
+        """
+        stores a file in the content-addressed store. If the server
+        already has the content only the meta data is updated.
+        Parameters:
+        - fileproperty
+          property of the file to upload
+        - srcpath
+          path of the local file
+        - synccrypt
+          optional SyncCrypt instance
+        Returns:
+        - path of the blob
+        """
+        debug("entering SyncFileServer.upload_blob()")
+        relativepath = fileproperty.get_path()
+        checksum = fileproperty.get_checksum()
+        if checksum == None:
+            checksum = create_checksum(srcpath)
+            fileproperty.set_checksum(checksum)
+        if synccrypt:
+            fileproperty.set_encrypted(True)
+        blobpath = self.get_blob_path(checksum, fileproperty.get_encrypted())
+        debug("blobpath = %s", blobpath)
+        stored = False
+        if os.path.exists(blobpath):
+            try:
+                # a reused blob is recent again, so it isn't collected
+                os.utime(blobpath, None)
+                stored = True
+            except OSError:
+                debug("blob was collected")
+        if stored:
+            debug("content already stored")
+            self.count_copy(COPY_DEDUP, os.path.getsize(blobpath),
+                            relativepath)
+        else:
+            blobdirectory = os.path.dirname(blobpath)
+            if not os.path.isdir(blobdirectory):
+                try:
+                    os.makedirs(blobdirectory)
+                except OSError:
+                    # created by a concurrent upload
+                    if not os.path.isdir(blobdirectory):
+                        raise
+            # a blob must never be visible with partial content
+            temppath = "%s.%i.%i" % (blobpath, os.getpid(),
+                                     current_thread().ident)
+            try:
+                if synccrypt:
+                    self._parent.set_salt(synccrypt, True)
+                    synccrypt.encrypt_to(srcpath, temppath)
+                else:
+                    self.copy(srcpath, temppath, relativepath)
+                    # the file might have changed since it was scanned
+                    algorithm = get_checksum_algorithm(checksum)
+                    actual = create_checksum(temppath, algorithm)
+                    if actual != checksum:
+                        debug("checksum changed since scan")
+                        fileproperty.set_checksum(actual)
+                        blobpath = self.get_blob_path(actual, False)
+                        blobdirectory = os.path.dirname(blobpath)
+                        if not os.path.isdir(blobdirectory):
+                            os.makedirs(blobdirectory)
+                flag = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
+                os.chmod(temppath, flag)
+                os.rename(temppath, blobpath)
+            finally:
+                if os.path.exists(temppath):
+                    os.remove(temppath)
+        debug("exiting SyncFileServer.upload_blob()")
+        return blobpath
+
+    def get_download_path(self, fileproperty):
+        """
+        Parameters:
+        - fileproperty
+          property of the file to download
+        Returns:
+        - path of the blob with the content of the file or the path of
+          the file in the former layout
+        """
+        relativepath = fileproperty.get_path()
+        legacypath = os.path.join(self._serverdirectory, create_hash(relativepath))
+        checksum = fileproperty.get_checksum()
+        if self._contentstore and checksum:
+            blobpath = self.get_blob_path(checksum, fileproperty.get_encrypted())
+            if os.path.exists(blobpath) or not os.path.exists(legacypath):
+                return blobpath
+        return legacypath
+
+    def get_signature_path(self, destname):
+        """
+        Parameters:
+        - destname
+          name of a file on the server
+        Returns:
+        - path of the signature file for delta transfers
+        """
+        return os.path.join(self._serverdirectory, SIGNATURE_PREFIX + destname)
+
+    def transfer_delta(self, srcpath, destpath, destname, relativepath):
+        """
+        copies a file to the server and writes only the blocks that
+        differ from the existing server copy
+        Parameters:
+        - srcpath
+          path of the local file
+        - destpath
+          path of the file on the server
+        - destname
+          name of the file on the server
+        - relativepath
+          relative path of the file within the root directory
+        """
+        debug("entering SyncFileServer.transfer_delta()")
+        sigpath = self.get_signature_path(destname)
+        signature = None
+        try:
+            deststat = os.stat(destpath)
+            sigstat = os.stat(sigpath)
+            # a signature older than the server copy is stale
+            if sigstat.st_mtime >= deststat.st_mtime:
+                signature = load_signature(sigpath)
+            if signature and signature.get_filesize() != deststat.st_size:
+                signature = None
+        except OSError:
+            signature = None
+        if signature:
+            delta = create_delta(srcpath, signature)
+            written = apply_delta(srcpath, destpath, delta, signature)
+            debug("bytes written = %s", written)
+        else:
+            self.copy(srcpath, destpath, relativepath)
+            debug("full copy")
+        create_signature(srcpath, self._deltablocksize).save(sigpath)
+        debug("exiting SyncFileServer.transfer_delta()")
 
     def upload(self, fileproperty, synccrypt):
         """
@@ -322,51 +833,53 @@ class SyncFileServer(object):
         else:
             # create source path
             relativepath = fileproperty.get_path()
-            debug_value("relativepath", relativepath)
+            debug("relativepath = %s", relativepath)
             root = self._parent.get_local().get_root()
-            debug_value("root", root)
+            debug("root = %s", root)
             srcpath = root + relativepath
-            debug_value("srcpath", srcpath)
+            debug("srcpath = %s", srcpath)
             # create destination path
             destdirectory = self._serverdirectory
-            debug_value("destdirectory", destdirectory)
+            debug("destdirectory = %s", destdirectory)
             destname = create_hash(relativepath)
-            debug_value("destname", destname)
+            debug("destname = %s", destname)
             destpath = os.path.join(destdirectory, destname)
-            debug_value("destpath", destpath)
+            debug("destpath = %s", destpath)
             # copy file
             success = True
             try:
-                if synccrypt:
+                debug("copy file")
+                if self._contentstore:
+                    previous = self._parent.get_property(fileproperty.get_name())
+                    destpath = self.upload_blob(fileproperty, srcpath,
+                                                synccrypt)
+                    if previous and previous.get_checksum() and \
+                       self.get_blob_path(previous.get_checksum(),
+                           previous.get_encrypted()) != destpath:
+                        self.release_blob(previous)
+                elif synccrypt:
+                    # encrypt directly into the server file
                     try:
                         debug("encrypt file")
-                        cryptpath = synccrypt.encrypt_file(srcpath)
+                        self._parent.set_salt(synccrypt, True)
+                        synccrypt.encrypt_to(srcpath, destpath)
                         fileproperty.set_encrypted(True)
                         debug("encrypting finished.")
                     except:
-                        debug(str(sys.exc_info()[0]))
+                        debug("%s", sys.exc_info()[0])
                         message = "Unable to encrypt: " + srcpath
                         self._parent.error(message)
-                    srcpath = cryptpath
-                    debug_value("srcpath", srcpath)
-                debug("copy file")
-                shutil.copyfile(srcpath, destpath)
+                        raise
+                elif self._delta:
+                    self.transfer_delta(srcpath, destpath, destname, relativepath)
+                else:
+                    self.copy(srcpath, destpath, relativepath)
                 debug("copying file finished.")
                 debug("change permissions")
                 flag = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
                 os.chmod(destpath, flag)
-                os.chmod(fpath, flag)
-                if synccrypt:
-                    try:
-                        debug("remove temporary file.")
-                        os.remove(srcpath)
-                        debug("removing temporary file finished.")
-                    except OSError:
-                        debug(str(sys.exc_info()[0]))
-                        message = "Unable to delete: " + srcpath
-                        self._parent.error(message)
             except:
-                debug(str(sys.exc_info()[0]))
+                debug("%s", sys.exc_info()[0])
                 message = "Unable to upload: " + srcpath
                 self._parent.error(message)
                 success = False
@@ -388,19 +901,19 @@ class SyncFileServer(object):
         debug("entering SyncFileServer.download()")
         success = True
         relativepath = fileproperty.get_path()
-        debug_value("relativepath", relativepath)
+        debug("relativepath = %s", relativepath)
         if fileproperty.is_directory():
             debug("is directory")
             # create directory path
             root = self._parent.get_local().get_root()
-            debug_value("root", root)
+            debug("root = %s", root)
             dirpath = root + relativepath
-            debug_value("dirpath", dirpath)
+            debug("dirpath = %s", dirpath)
             # check if directory already exists
             exist = os.path.exists(dirpath)
-            debug_value("exist", exist)
+            debug("exist = %s", exist)
             isdir = os.path.isdir(dirpath)
-            debug_value("isdir", isdir)
+            debug("isdir = %s", isdir)
             if not exist and not isdir:
                 # create the directory
                 success = True
@@ -414,45 +927,32 @@ class SyncFileServer(object):
                     success =  False
         else:
             # create source path
-            srcname = create_hash(relativepath)
-            debug_value("srcname", srcname)
-            srcdirectory = self._serverdirectory
-            debug_value("srcdirectory", srcdirectory)
-            srcpath = os.path.join(srcdirectory, srcname)
-            debug_value("srcpath", srcpath)
+            srcpath = self.get_download_path(fileproperty)
+            debug("srcpath = %s", srcpath)
             # create destination path
             root = self._parent.get_local().get_root()
-            debug_value("root", root)
+            debug("root = %s", root)
             destpath = root + relativepath
-            debug_value("destpath", destpath)
+            debug("destpath = %s", destpath)
             # copy file
             success = True
             try:
-                origpath = None
-                if synccrypt:
-                    origdestpath = destpath
-                    destpath = destpath + ENCRYPTION_EXTENSION
-                    debug_value("destpath", destpath)
                 debug("copy file")
-                shutil.copyfile(srcpath, destpath)
-                debug("copying file finished")
-                if synccrypt:
+                if synccrypt and fileproperty.get_encrypted():
+                    # the local file is only replaced if the file is valid
                     try:
                         debug("decrypt file")
-                        synccrypt.decrypt_file(destpath)
+                        self._parent.set_salt(synccrypt)
+                        synccrypt.decrypt_to(srcpath, destpath)
                         debug("decrypting file finished.")
                     except:
-                        message = "Unable to decrypt: " + destpath
+                        message = "Unable to decrypt: " + srcpath
                         debug_error(message)
                         self._parent.error(message)
-                    if os.path.exists(origdestpath):
-                        try:
-                            debug("remove temporary path")
-                            os.remove(destpath)
-                        except OSError:
-                            message = "Unable to delete: " + destpath
-                            debug_error(message)
-                            self._parent.error(message)
+                        raise
+                else:
+                    self.copy(srcpath, destpath, relativepath)
+                debug("copying file finished")
             except:
                 message = "Unable to download: " + srcpath
                 debug_error(message)
@@ -476,12 +976,18 @@ class SyncFileServer(object):
         delname = create_hash(relativepath)
         deldirectory = self._serverdirectory
         delpath = os.path.join(deldirectory, delname)
-        debug_value("delpath", delpath)
+        debug("delpath = %s", delpath)
         success = True
-        if not fileproperty.is_directory():
+        if self._contentstore and not os.path.exists(delpath):
+            # blobs might be referenced by other files and are kept
+            debug("content-addressed file")
+        elif not fileproperty.is_directory():
             try:
                 os.remove(delpath)
                 debug("file deleted")
+                sigpath = self.get_signature_path(delname)
+                if os.path.exists(sigpath):
+                    os.remove(sigpath)
             except:
                 message = "Unable to delete: " + delpath
                 debug(message)
@@ -490,11 +996,123 @@ class SyncFileServer(object):
         if success:
             name = fileproperty.get_name()
             prop = self._parent.get_property(name)
+            self.release_blob(prop)
             prop.set_state(STATE_DELETED)
-            debug_value("property name", prop.get_name())
-            debug_value("propety state", prop.get_state())
+            self._parent.set_modified()
+            self._parent.journal_property(prop)
+            debug("property name = %s", prop.get_name())
+            debug("propety state = %s", prop.get_state())
         debug("exiting SyncFileServer.delete()")
 
+    def move(self, fileproperty, srcproperty, srcserver):
+        """
+        renames a file on the server. In the content-addressed store
+        only the meta data changes.
+        Parameters:
+        - fileproperty
+          property of the local file with the new name
+        - srcproperty
+          server property of the old name
+        - srcserver
+          SyncServer with the meta data of the old name
+        Returns:
+        - True:  file was renamed
+        - False: file could not be renamed
+        """
+        debug("entering SyncFileServer.move()")
+        srcname = create_hash(srcproperty.get_path())
+        srcpath = os.path.join(self._serverdirectory, srcname)
+        destname = create_hash(fileproperty.get_path())
+        destpath = os.path.join(self._serverdirectory, destname)
+        debug("srcpath = %s", srcpath)
+        debug("destpath = %s", destpath)
+        success = True
+        if os.path.exists(srcpath):
+            try:
+                os.rename(srcpath, destpath)
+                sigpath = self.get_signature_path(srcname)
+                if os.path.exists(sigpath):
+                    os.rename(sigpath, self.get_signature_path(destname))
+            except OSError:
+                debug_error("Unable to move: " + srcpath)
+                success = False
+        elif not self._contentstore:
+            success = False
+        if success:
+            # the content on the server is unchanged
+            fileproperty.set_encrypted(srcproperty.get_encrypted())
+            prop = srcserver.get_property(srcproperty.get_name())
+            prop.set_state(STATE_DELETED)
+            srcserver.set_modified()
+            srcserver.journal_property(prop)
+            self._parent.update_property(fileproperty)
+        debug("exiting SyncFileServer.move()")
+        return success
+
+    def load_salt(self, createflag):
+        """
+        reads the salt of the key derivation
+        Parameters:
+        - createflag
+          creates a salt if the server doesn't have one
+        Returns:
+        - tuple of salt and iterations or None if the server has no salt
+        Raises:
+        - IOError if the salt is invalid
+        """
+        debug("entering SyncFileServer.load_salt()")
+        result = None
+        saltpath = os.path.join(self._serverdirectory, SERVER_SALT_FILENAME)
+        if createflag and not os.path.exists(saltpath):
+            self.create_salt(saltpath)
+        for attempt in range(SALT_READ_ATTEMPTS):
+            if not os.path.exists(saltpath):
+                break
+            if attempt > 0:
+                time.sleep(SALT_READ_DELAY)
+            f = open(saltpath)
+            try:
+                result = parse_salt(f.read())
+            finally:
+                f.close()
+            if result != None:
+                break
+        if result == None and os.path.exists(saltpath):
+            message = "Invalid salt: " + saltpath
+            self._parent.error(message)
+            raise IOError(message)
+        debug("exiting SyncFileServer.load_salt()")
+        return result
+
+    def create_salt(self, saltpath):
+        """
+        creates the salt of the server. The salt is written to a
+        temporary file that is linked to the salt file, so other clients
+        never read a partial salt and all clients use the same salt.
+        Parameters:
+        - saltpath
+          path of the salt file
+        """
+        temppath = "%s.%i.%i" % (saltpath, os.getpid(), current_thread().ident)
+        try:
+            f = open(temppath, "w")
+            try:
+                f.write(format_salt(create_salt()))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.chmod(temppath, 0644)
+            # unlike rename() link() fails if another client created a salt
+            os.link(temppath, saltpath)
+            fsync_directory(self._serverdirectory)
+        except (IOError, OSError), e:
+            if not os.path.exists(saltpath):
+                debug_error("unable to create salt %s: %s", saltpath, e)
+        finally:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+
     def get_meta_filename(self):
         """
         Returns:
@@ -503,6 +1121,25 @@ class SyncFileServer(object):
         relativepath = self._parent.get_relative_path()
         return create_hash(relativepath)
 
+    def get_journal(self):
+        """
+        Returns:
+        - MetaJournal of the meta file
+        """
+        if self._journal == None:
+            self._journal = MetaJournal(self._serverdirectory,
+                                        self.get_meta_filename())
+        return self._journal
+
+    def journal_property(self, fileproperty):
+        """
+        writes a changed file property to the journal of the meta file
+        Parameters:
+        - fileproperty
+          changed file property
+        """
+        self.get_journal().append(fileproperty)
+
     def load_meta(self):
         """
         loads the meta data
@@ -510,12 +1147,16 @@ class SyncFileServer(object):
         debug("entering SyncFileServer.load_meta()") 
         self._parent.clear_properties()
         directory = self._serverdirectory
-        debug_value("serverdirectory", directory)
+        debug("serverdirectory = %s", directory)
         fname = self.get_meta_filename()
-        debug_value("meta_filename", fname)
+        debug("meta_filename = %s", fname)
         propertylist = load_property_file(directory, fname)
         for p in propertylist:
             self._parent.append_property(p)
+        if has_journal(directory, fname):
+            # changes of an interrupted sync were replayed
+            debug("journal replayed")
+            self._parent.set_modified()
         debug("exiting SyncFileServer.load_meta()")
 
     def save_meta(self):
@@ -523,9 +1164,11 @@ class SyncFileServer(object):
         saves the meta data
         """
         debug("entering SyncFileServer.save_meta()")
+        if not self._parent.is_modified():
+            debug("meta data unchanged")
+            debug("exiting SyncFileServer.save_meta()")
+            return
         propertylist = self._parent.get_property_list()
-        directory = self._serverdirectory
-        fname = self.get_meta_filename()
-        save_property_file(directory, fname, propertylist)
+        self.get_journal().compact(propertylist)
         debug("exiting SyncFileServer.save_meta()")
 
@@ -0,0 +1,279 @@
+# simplesync - statistics of a sync
+#
+# Copyright 2011 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import json
+import sys
+import time
+
+from threading import Lock
+
+# names of the timed phases
+STATS_SCAN = "scan"
+STATS_HASH = "hash"
+STATS_META_LOAD = "meta-load"
+STATS_META_SAVE = "meta-save"
+STATS_PLAN = "plan"
+
+STATS_PHASES = [ STATS_SCAN, STATS_HASH, STATS_META_LOAD, STATS_META_SAVE,
+                 STATS_PLAN ]
+
+# names of the counters
+STATS_FILES_SCANNED = "files-scanned"
+STATS_FILES_HASHED = "files-hashed"
+STATS_BYTES_HASHED = "bytes-hashed"
+
+# names of the counters of the copy backends, formatted with the backend
+STATS_COPY_FILES = "copy-%s-files"
+STATS_COPY_BYTES = "copy-%s-bytes"
+
+# units to format byte counts
+BYTE_UNITS = [ "B", "KB", "MB", "GB", "TB" ]
+
+def format_bytes(count):
+    """
+    formats a count of bytes for humans
+    Parameters:
+    - count
+      count of bytes
+    Returns:
+    - formatted string, e.g. "1.5 MB"
+    """
+    value = float(count)
+    for unit in BYTE_UNITS:
+        if value < 1024.0 or unit == BYTE_UNITS[-1]:
+            break
+        value = value / 1024.0
+    if unit == BYTE_UNITS[0]:
+        return "%i %s" % (count, unit)
+    return "%.1f %s" % (value, unit)
+
+class SyncStats(object):
+    """
+    timers and counters of a sync. The phases are timed, actions are
+    counted by type with their files, bytes and seconds. An instance
+    can be shared by several threads.
+    """
+
+    def __init__(self):
+        """
+        creates an instance
+        """
+        self._lock = Lock()
+        self._start = time.time()
+        self._times = {}
+        self._counts = {}
+        self._actions = {}
+
+    def add_time(self, phase, seconds):
+        """
+        adds the time spent in a phase
+        Parameters:
+        - phase
+          name of the phase, see STATS_PHASES
+        - seconds
+          seconds to add
+        """
+        self._lock.acquire()
+        try:
+            self._times[phase] = self._times.get(phase, 0.0) + seconds
+        finally:
+            self._lock.release()
+
+    def add_count(self, counter, count = 1):
+        """
+        increments a counter
+        Parameters:
+        - counter
+          name of the counter
+        - count
+          value to add
+        """
+        self._lock.acquire()
+        try:
+            self._counts[counter] = self._counts.get(counter, 0) + count
+        finally:
+            self._lock.release()
+
+    def add_copy(self, backend, size):
+        """
+        counts a file copied by a copy backend
+        Parameters:
+        - backend
+          name of the backend, see COPY_BACKENDS
+        - size
+          size of the file
+        """
+        self._lock.acquire()
+        try:
+            for (counter, count) in [ (STATS_COPY_FILES % backend, 1),
+                                      (STATS_COPY_BYTES % backend, size) ]:
+                self._counts[counter] = self._counts.get(counter, 0) + count
+        finally:
+            self._lock.release()
+
+    def add_action(self, action, size, seconds):
+        """
+        counts a processed action
+        Parameters:
+        - action
+          name of the type of the action
+        - size
+          count of bytes transferred
+        - seconds
+          seconds the action took
+        """
+        self._lock.acquire()
+        try:
+            entry = self._actions.setdefault(action, [ 0, 0, 0.0 ])
+            entry[0] = entry[0] + 1
+            entry[1] = entry[1] + size
+            entry[2] = entry[2] + seconds
+        finally:
+            self._lock.release()
+
+    def get_time(self, phase):
+        """
+        Parameters:
+        - phase
+          name of a phase
+        Returns:
+        - seconds spent in the phase
+        """
+        return self._times.get(phase, 0.0)
+
+    def get_count(self, counter):
+        """
+        Parameters:
+        - counter
+          name of a counter
+        Returns:
+        - value of the counter
+        """
+        return self._counts.get(counter, 0)
+
+    def get_actions(self):
+        """
+        Returns:
+        - sorted list of the types of the counted actions
+        """
+        result = self._actions.keys()
+        result.sort()
+        return result
+
+    def get_action_files(self, action):
+        return self._actions.get(action, [ 0, 0, 0.0 ])[0]
+
+    def get_action_bytes(self, action):
+        return self._actions.get(action, [ 0, 0, 0.0 ])[1]
+
+    def get_action_seconds(self, action):
+        return self._actions.get(action, [ 0, 0, 0.0 ])[2]
+
+    def get_files(self):
+        """
+        Returns:
+        - count of files of all actions
+        """
+        result = 0
+        for entry in self._actions.values():
+            result = result + entry[0]
+        return result
+
+    def get_bytes(self):
+        """
+        Returns:
+        - count of bytes transferred by all actions
+        """
+        result = 0
+        for entry in self._actions.values():
+            result = result + entry[1]
+        return result
+
+    def get_elapsed(self):
+        """
+        Returns:
+        - seconds since the instance was created
+        """
+        return time.time() - self._start
+
+    def get_throughput(self):
+        """
+        Returns:
+        - bytes transferred per second since the instance was created
+        """
+        return self.get_bytes() / max(self.get_elapsed(), 0.001)
+
+    def to_dict(self):
+        """
+        Returns:
+        - dictionary with all timers and counters, e.g. to save it as
+          JSON
+        """
+        self._lock.acquire()
+        try:
+            actions = {}
+            for (action, (files, size, seconds)) in self._actions.items():
+                actions[action] = { "files": files, "bytes": size,
+                                    "seconds": seconds }
+            result = { "elapsed": self.get_elapsed(),
+                       "times": dict(self._times),
+                       "counts": dict(self._counts),
+                       "actions": actions }
+        finally:
+            self._lock.release()
+        result["files"] = self.get_files()
+        result["bytes"] = self.get_bytes()
+        result["throughput"] = self.get_throughput()
+        return result
+
+    def save_json(self, filepath):
+        """
+        saves the statistics as JSON
+        Parameters:
+        - filepath
+          path of the file to write
+        """
+        f = open(filepath, "w")
+        try:
+            json.dump(self.to_dict(), f, indent = 2, sort_keys = True)
+            f.write("\n")
+        finally:
+            f.close()
+
+    def write_text(self, output = sys.stdout):
+        """
+        writes the statistics for humans
+        Parameters:
+        - output
+          file to write to
+        """
+        output.write("elapsed: %.3f s\n" % self.get_elapsed())
+        output.write("phases:\n")
+        for phase in STATS_PHASES:
+            output.write("  %-16s %10.3f s\n" % (phase, self.get_time(phase)))
+        counters = self._counts.keys()
+        counters.sort()
+        if len(counters) > 0:
+            output.write("counters:\n")
+            for counter in counters:
+                output.write("  %-16s %10i\n" % (counter, self.get_count(counter)))
+        output.write("actions:\n")
+        for action in self.get_actions():
+            seconds = self.get_action_seconds(action)
+            size = self.get_action_bytes(action)
+            output.write("  %-16s %6i files %12s %10.3f s %12s/s\n" %
+                         (action, self.get_action_files(action),
+                          format_bytes(size), seconds,
+                          format_bytes(size / max(seconds, 0.001))))
+        output.write("throughput: %s/s\n" % format_bytes(self.get_throughput()))
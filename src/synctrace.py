@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+# simplesync - structured trace of a sync
+#
+# Copyright 2011 Jochen Skulj, jochen@jochenskulj.de
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import atexit
+import json
+import sys
+import time
+
+from threading import Lock
+
+# parameter to write a trace file, e.g. --trace=ssync.trace
+PARAMETER_TRACE = "--trace="
+
+# types of the trace records
+RECORD_MUTATION = "mutation"
+RECORD_ACTION = "action"
+RECORD_PHASE = "phase"
+RECORD_SNAPSHOT = "snapshot"
+
+# minimum seconds between two snapshots of the same directory
+SNAPSHOT_INTERVAL = 5.0
+
+# size of the buffer of the trace file
+TRACE_BUFFER_SIZE = 64 * 1024
+
+# count of hot files reported by the analyzer
+HOT_FILE_COUNT = 10
+
+class TraceWriter(object):
+    """
+    writes trace records as JSON lines to a file that is kept open
+    """
+
+    def __init__(self, filepath):
+        """
+        creates an instance
+        Parameters:
+        - filepath
+          path of the trace file
+        """
+        self._fd = open(filepath, "w", TRACE_BUFFER_SIZE)
+        self._lock = Lock()
+        self._snapshots = {}
+
+    def write(self, record):
+        """
+        writes a record
+        Parameters:
+        - record
+          dictionary with the values of the record
+        """
+        record["time"] = time.time()
+        line = json.dumps(record) + "\n"
+        self._lock.acquire()
+        try:
+            if self._fd != None:
+                self._fd.write(line)
+        finally:
+            self._lock.release()
+
+    def is_snapshot_due(self, directory, now):
+        """
+        checks if a new snapshot of a directory should be written
+        Parameters:
+        - directory
+          directory of the snapshot
+        - now
+          current time
+        Returns:
+        - True:  snapshot is due
+        - False: last snapshot is recent
+        """
+        self._lock.acquire()
+        try:
+            last = self._snapshots.get(directory)
+            if last != None and now - last < SNAPSHOT_INTERVAL:
+                return False
+            self._snapshots[directory] = now
+        finally:
+            self._lock.release()
+        return True
+
+    def close(self):
+        """
+        writes the buffered records and closes the file
+        """
+        self._lock.acquire()
+        try:
+            if self._fd != None:
+                self._fd.close()
+                self._fd = None
+        finally:
+            self._lock.release()
+
+trace_writer = None
+trace_flag = None
+
+def get_trace_writer():
+    """
+    Returns:
+    - TraceWriter of the trace file given by the command line or None
+      if tracing is switched off
+    """
+    global trace_flag
+    if trace_flag == None:
+        trace_flag = False
+        for arg in sys.argv:
+            if arg.startswith(PARAMETER_TRACE):
+                set_trace_file(arg[len(PARAMETER_TRACE):])
+    return trace_writer
+
+def set_trace_file(filepath):
+    """
+    starts writing a trace file or stops tracing
+    Parameters:
+    - filepath
+      path of the trace file or None to stop tracing
+    """
+    global trace_writer
+    global trace_flag
+    close_trace_file()
+    trace_flag = True
+    if filepath:
+        trace_writer = TraceWriter(filepath)
+
+def close_trace_file():
+    """
+    closes the trace file
+    """
+    global trace_writer
+    if trace_writer != None:
+        trace_writer.close()
+        trace_writer = None
+
+atexit.register(close_trace_file)
+
+def is_trace_enabled():
+    """
+    Returns:
+    - True:  trace records are written
+    - False: tracing is switched off
+    """
+    return get_trace_writer() != None
+
+def trace_mutation(directory, name, oldstate, newstate, duration):
+    """
+    traces the change of a property on the server
+    Parameters:
+    - directory
+      relative path of the directory
+    - name
+      name of the file
+    - oldstate
+      state before the change or None for new properties
+    - newstate
+      state after the change
+    - duration
+      seconds the change took
+    """
+    writer = get_trace_writer()
+    if writer != None:
+        writer.write({ "type": RECORD_MUTATION, "directory": directory,
+                       "name": name, "old": oldstate, "new": newstate,
+                       "duration": duration })
+
+def trace_action(directory, name, action, phase, duration):
+    """
+    traces a processed action
+    Parameters:
+    - directory
+      relative path of the directory
+    - name
+      name of the file
+    - action
+      name of the kind of action
+    - phase
+      phase of the action
+    - duration
+      seconds the action took
+    """
+    writer = get_trace_writer()
+    if writer != None:
+        writer.write({ "type": RECORD_ACTION, "directory": directory,
+                       "name": name, "action": action, "phase": phase,
+                       "duration": duration })
+
+def trace_phase(directory, phase, duration):
+    """
+    traces a phase of the planning
+    Parameters:
+    - directory
+      relative path of the directory
+    - phase
+      name of the phase
+    - duration
+      seconds the phase took
+    """
+    writer = get_trace_writer()
+    if writer != None:
+        writer.write({ "type": RECORD_PHASE, "directory": directory,
+                       "phase": phase, "duration": duration })
+
+def trace_snapshot(directory, propertylist, force = False):
+    """
+    traces the count of properties of a directory by state. Snapshots
+    are written at most every SNAPSHOT_INTERVAL seconds per directory.
+    Parameters:
+    - directory
+      relative path of the directory
+    - propertylist
+      list of file properties
+    - force
+      writes the snapshot even if the last one is recent
+    """
+    writer = get_trace_writer()
+    if writer == None:
+        return
+    if not writer.is_snapshot_due(directory, time.time()) and not force:
+        return
+    states = {}
+    for fileproperty in propertylist:
+        state = fileproperty.get_state()
+        states[state] = states.get(state, 0) + 1
+    writer.write({ "type": RECORD_SNAPSHOT, "directory": directory,
+                   "properties": len(propertylist), "states": states })
+
+def analyze_trace(filepath):
+    """
+    summarizes a trace file
+    Parameters:
+    - filepath
+      path of the trace file
+    Returns:
+    - dictionary with the seconds and counts per phase and action, the
+      count and seconds of the mutations, the count of snapshots and
+      the hot files. Mutations happen within actions, so their seconds
+      are reported separately and not added to the actions. Each hot
+      file has the count and seconds of its actions and the seconds of
+      its mutations and the files are ordered by the action seconds.
+    """
+    phases = {}
+    actions = {}
+    files = {}
+    mutations = 0
+    mutationseconds = 0.0
+    snapshots = 0
+    start = None
+    end = None
+    f = open(filepath)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of an interrupted trace
+                continue
+            recordtime = record.get("time")
+            if recordtime != None:
+                if start == None or recordtime < start:
+                    start = recordtime
+                if end == None or recordtime > end:
+                    end = recordtime
+            recordtype = record.get("type")
+            duration = record.get("duration", 0.0)
+            if recordtype == RECORD_PHASE:
+                entry = phases.setdefault(record["phase"], [ 0, 0.0 ])
+            elif recordtype == RECORD_ACTION:
+                entry = actions.setdefault(record["action"], [ 0, 0.0 ])
+            elif recordtype == RECORD_MUTATION:
+                mutations = mutations + 1
+                mutationseconds = mutationseconds + duration
+                entry = None
+            else:
+                snapshots = snapshots + 1
+                continue
+            if entry != None:
+                entry[0] = entry[0] + 1
+                entry[1] = entry[1] + duration
+            if "name" in record:
+                path = record["directory"].rstrip("/") + "/" + record["name"]
+                entry = files.setdefault(path, [ 0, 0.0, 0.0 ])
+                if recordtype == RECORD_MUTATION:
+                    entry[2] = entry[2] + duration
+                else:
+                    entry[0] = entry[0] + 1
+                    entry[1] = entry[1] + duration
+    finally:
+        f.close()
+    hotfiles = files.items()
+    hotfiles.sort(key=lambda item: (-item[1][1], -item[1][2], -item[1][0],
+                                    item[0]))
+    return { "phases": phases,
+             "actions": actions,
+             "mutations": mutations,
+             "mutation_seconds": mutationseconds,
+             "snapshots": snapshots,
+             "duration": (end - start) if start != None else 0.0,
+             "hotfiles": hotfiles[:HOT_FILE_COUNT] }
+
+def format_summary(summary, output = sys.stdout):
+    """
+    writes a summary created by analyze_trace()
+    Parameters:
+    - summary
+      dictionary with the summary
+    - output
+      file to write to
+    """
+    output.write("trace duration: %.3f s\n" % summary["duration"])
+    output.write("mutations: %i, %.3f s, snapshots: %i\n" %
+                 (summary["mutations"], summary["mutation_seconds"],
+                  summary["snapshots"]))
+    for (title, key) in [ ("phases", "phases"), ("actions", "actions") ]:
+        output.write("%s:\n" % title)
+        names = summary[key].keys()
+        names.sort()
+        for name in names:
+            (count, seconds) = summary[key][name]
+            output.write("  %-16s %8i %10.3f s\n" % (name, count, seconds))
+    output.write("hot files: action seconds, actions, mutation seconds\n")
+    for (path, (count, seconds, mutationseconds)) in summary["hotfiles"]:
+        output.write("  %10.3f s %6i %10.3f s  %s\n" %
+                     (seconds, count, mutationseconds, path))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: synctrace.py TRACEFILE"
+        sys.exit(-1)
+    format_summary(analyze_trace(sys.argv[1]))
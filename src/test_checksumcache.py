@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from checksumcache import *
+from fileproperty import *
+
+class ChecksumCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._filepath = os.path.join(self._directory, "file.txt")
+        f = open(self._filepath, "w")
+        f.write("content")
+        f.close()
+        self.set_past_mtime(self._filepath)
+        self._calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def set_past_mtime(self, filepath):
+        past = time.time() - 10 * CACHE_RACY_SECONDS
+        os.utime(filepath, (past, past))
+
+    def count_checksum(self, filepath):
+        self._calls = self._calls + 1
+        return create_checksum(filepath)
+
+    def test_unchanged_file(self):
+        cache = ChecksumCache(self._directory)
+        statresult = os.stat(self._filepath)
+        checksum = cache.get_checksum(self._filepath, statresult, self.count_checksum)
+        self.assertEquals(checksum, create_checksum(self._filepath))
+        cache.save()
+        cache = ChecksumCache(self._directory)
+        cached = cache.get_checksum(self._filepath, statresult, self.count_checksum)
+        self.assertEquals(cached, checksum)
+        self.assertEquals(self._calls, 1)
+        self.assertEquals(cache.get_hits(), 1)
+        self.assertEquals(os.path.exists(os.path.join(self._directory,
+                                                      CACHE_TEMP_FILENAME)), False)
+
+    def test_changed_file(self):
+        cache = ChecksumCache(self._directory)
+        cache.store(self._filepath, os.stat(self._filepath), "stale")
+        f = open(self._filepath, "a")
+        f.write("more content")
+        f.close()
+        statresult = os.stat(self._filepath)
+        self.assertEquals(cache.lookup(self._filepath, statresult), None)
+        checksum = cache.get_checksum(self._filepath, statresult, self.count_checksum)
+        self.assertEquals(checksum, create_checksum(self._filepath))
+
+    def test_size_bound(self):
+        cache = ChecksumCache(self._directory, 10)
+        statresult = os.stat(self._filepath)
+        for i in range(0, 20):
+            cache.store("/file-%i" % i, statresult, "checksum")
+        cache.save()
+        cache = ChecksumCache(self._directory, 10)
+        self.assertEquals(cache.lookup("/file-19", statresult), "checksum")
+        self.assertEquals(len([i for i in range(0, 20)
+            if cache.lookup("/file-%i" % i, statresult)]), 10)
+
+    def test_racy_mtime(self):
+        cache = ChecksumCache(self._directory)
+        os.utime(self._filepath, None)
+        statresult = os.stat(self._filepath)
+        cache.get_checksum(self._filepath, statresult, self.count_checksum)
+        cache.get_checksum(self._filepath, statresult, self.count_checksum)
+        self.assertEquals(self._calls, 2)
+
+    def test_removed_files(self):
+        cache = ChecksumCache(self._directory)
+        removed = os.path.join(self._directory, "removed.txt")
+        other = os.path.join(self._directory, "sub", "other.txt")
+        for filepath in [ self._filepath, removed, other ]:
+            cache.store(filepath, os.stat(self._filepath), "checksum")
+        cache.save()
+        cache = ChecksumCache(self._directory)
+        statresult = os.stat(self._filepath)
+        self.assertEquals(cache.lookup(self._filepath, statresult), "checksum")
+        cache.mark_scanned(self._directory + "/")
+        cache.save()
+        cache = ChecksumCache(self._directory)
+        self.assertEquals(cache.lookup(removed, statresult), None)
+        self.assertEquals(cache.lookup(other, statresult), "checksum")
+        self.assertEquals(cache.lookup(self._filepath, statresult), "checksum")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,7 @@
 import unittest
 import os.path
 import shutil
+import tempfile
 
 from synccrypt import *
 
@@ -71,6 +72,195 @@ class SyncCryptTest(unittest.TestCase):
             if not helper.check_file(fname, i):
                 print "encryption of %i bytes failed." % i
 
+class ContainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._key = normalize_key("test")
+        self._plain = os.path.join(self._path, "plain")
+        self._crypted = os.path.join(self._path, "crypted")
+        self._decrypted = os.path.join(self._path, "decrypted")
+        self._content = "".join([chr(i % 253) for i in range(0, 10000)])
+        self.write_file(self._plain, self._content)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def write_file(self, path, content):
+        f = open(path, "wb")
+        f.write(content)
+        f.close()
+
+    def read_file(self, path):
+        f = open(path, "rb")
+        content = f.read()
+        f.close()
+        return content
+
+    def test_parallel(self):
+        encrypt_file(self._plain, self._crypted, self._key, 1000, 3)
+        self.assertEquals(get_format_version(self._crypted), FORMAT_CONTAINER)
+        decrypt_file(self._crypted, self._decrypted, self._key, processes=3)
+        self.assertEquals(self.read_file(self._decrypted), self._content)
+        encrypt_file(self._plain, self._crypted, self._key, 1000, 1)
+        decrypt_file(self._crypted, self._decrypted, self._key, processes=1)
+        self.assertEquals(self.read_file(self._decrypted), self._content)
+
+    def test_empty(self):
+        self.write_file(self._plain, "")
+        encrypt_file(self._plain, self._crypted, self._key)
+        decrypt_file(self._crypted, self._decrypted, self._key)
+        self.assertEquals(self.read_file(self._decrypted), "")
+
+    def test_legacy(self):
+        srcfile = open(self._plain, "rb")
+        destfile = open(self._crypted, "wb")
+        encrypt_stream(srcfile, destfile, len(self._content), self._key)
+        destfile.close()
+        srcfile.close()
+        self.assertEquals(get_format_version(self._crypted), FORMAT_LEGACY)
+        decrypt_file(self._crypted, self._decrypted, self._key)
+        self.assertEquals(self.read_file(self._decrypted), self._content)
+
+    def test_tampered(self):
+        encrypt_file(self._plain, self._crypted, self._key, 1000, 1)
+        content = self.read_file(self._crypted)
+        pos = get_chunk_offset(5, 1000) + 100
+        content = content[:pos] + chr(ord(content[pos]) ^ 1) + content[pos + 1:]
+        self.write_file(self._crypted, content)
+        self.write_file(self._decrypted, "old content")
+        self.assertRaises(ValueError, decrypt_file, self._crypted,
+                          self._decrypted, self._key, processes=1)
+        self.assertEquals(self.read_file(self._decrypted), "old content")
+        self.assertEquals(os.listdir(self._path).count("decrypted" +
+                                                       DECRYPTION_EXTENSION), 0)
+
+    def test_versions(self):
+        for version in CHUNK_LAYOUTS.keys():
+            header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, version,
+                                           KEY_ORIGIN_PASSWORD, 1000,
+                                           len(self._content))
+            f = open(self._crypted, "wb")
+            f.write(header)
+            f.truncate(get_container_size(len(self._content), 1000, version))
+            f.close()
+            crypt_chunks((True, self._plain, self._crypted, self._key, header,
+                          range(get_chunk_count(len(self._content), 1000,
+                                                version))))
+            self.assertEquals(get_format_version(self._crypted), version)
+            decrypt_file(self._crypted, self._decrypted, self._key)
+            self.assertEquals(self.read_file(self._decrypted), self._content)
+
+    def test_damaged_header(self):
+        encrypt_file(self._plain, self._crypted, self._key, 1000, 1)
+        content = self.read_file(self._crypted)
+        self.write_file(self._decrypted, "old content")
+        damaged = [ content[:4] + chr(99) + content[5:],
+                    "X" + content[1:] ]
+        for crypted in damaged:
+            self.write_file(self._crypted, crypted)
+            self.assertRaises(ValueError, decrypt_file, self._crypted,
+                              self._decrypted, self._key, processes=1)
+            self.assertEquals(self.read_file(self._decrypted), "old content")
+
+    def test_truncated(self):
+        encrypt_file(self._plain, self._crypted, self._key, 1000, 1)
+        content = self.read_file(self._crypted)
+        self.write_file(self._decrypted, "old content")
+        for size in [ len(content) - 1, len(content) - 16, 10 ]:
+            self.write_file(self._crypted, content[:size])
+            self.assertRaises(ValueError, decrypt_file, self._crypted,
+                              self._decrypted, self._key, processes=1)
+            self.assertEquals(self.read_file(self._decrypted), "old content")
+        srcfile = open(self._plain, "rb")
+        destfile = open(self._crypted, "wb")
+        encrypt_stream(srcfile, destfile, len(self._content), self._key)
+        destfile.close()
+        srcfile.close()
+        content = self.read_file(self._crypted)
+        self.write_file(self._crypted, content[:-16])
+        self.assertRaises(ValueError, decrypt_file, self._crypted,
+                          self._decrypted, self._key)
+        self.assertEquals(self.read_file(self._decrypted), "old content")
+
+    def test_wrong_key(self):
+        encrypt_file(self._plain, self._crypted, self._key)
+        self.assertRaises(ValueError, decrypt_file, self._crypted,
+                          self._decrypted, normalize_key("wrong"))
+        self.assertEquals(os.path.exists(self._decrypted), False)
+
+    def test_session_pool(self):
+        self._content = self._content * (PARALLEL_MIN_CHUNKS *
+                                         CONTAINER_CHUNKSIZE / 10000 + 1)
+        self.write_file(self._plain, self._content)
+        crypt = SyncCrypt()
+        crypt.set_password("password")
+        crypt.set_processes(2)
+        crypt.start_pool()
+        try:
+            self.assertEquals(crypt.get_pool_arguments()["processes"], 2)
+            crypt.encrypt_to(self._plain, self._crypted)
+            crypt.decrypt_to(self._crypted, self._decrypted)
+        finally:
+            crypt.stop_pool()
+        self.assertEquals(crypt.get_pool_arguments(), {})
+        self.assertEquals(self.read_file(self._decrypted), self._content)
+
+class KeyDerivationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._plain = os.path.join(self._path, "plain")
+        self._crypted = os.path.join(self._path, "crypted")
+        self._decrypted = os.path.join(self._path, "decrypted")
+        f = open(self._plain, "wb")
+        f.write("content")
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def read_file(self, path):
+        f = open(path, "rb")
+        content = f.read()
+        f.close()
+        return content
+
+    def test_salt(self):
+        salt = create_salt()
+        self.assertEquals(parse_salt(format_salt(salt, 1000)), (salt, 1000))
+        self.assertEquals(parse_salt("invalid"), None)
+
+    def test_key_cache(self):
+        keycache = KeyCache()
+        salt = create_salt()
+        key = keycache.get_key("password", salt, 1000)
+        self.assertEquals(len(key), KDF_KEY_SIZE)
+        self.assertEquals(keycache.get_key("password", salt, 1000), key)
+        self.assertNotEquals(keycache.get_key("password", create_salt(), 1000), key)
+        self.assertNotEquals(keycache.get_key("other", salt, 1000), key)
+        keycache.clear()
+        self.assertEquals(keycache.get_key("password", salt, 1000), key)
+
+    def test_legacy_key(self):
+        crypt = SyncCrypt()
+        crypt.set_password("password")
+        crypt.encrypt_to(self._plain, self._crypted)
+        self.assertEquals(get_key_origin(self._crypted), KEY_ORIGIN_PASSWORD)
+        crypt.set_salt(create_salt(), 1000)
+        self.assertNotEquals(crypt.get_key(), crypt.get_legacy_key())
+        crypt.decrypt_to(self._crypted, self._decrypted)
+        self.assertEquals(self.read_file(self._decrypted), "content")
+        crypt.encrypt_to(self._plain, self._crypted)
+        self.assertEquals(get_key_origin(self._crypted), KEY_ORIGIN_KDF)
+        crypt.set_password("wrong")
+        self.assertRaises(ValueError, crypt.decrypt_to, self._crypted,
+                          self._decrypted)
+        crypt.set_password("password")
+        crypt.set_salt(None)
+        self.assertRaises(ValueError, crypt.decrypt_to, self._crypted,
+                          self._decrypted)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from cStringIO import StringIO
@@ -47,6 +50,165 @@ class FilePropertyTest(unittest.TestCase):
         self.assertEquals(path, "/home/jochen/file.txt")
         self.assertEquals(timestamp, 1242.99)
 
+    def test_property_string_round_trip(self):
+        file_property = FileProperty()
+        file_property.set_property_values(["<name>&amp;.txt", "/dir/<name>&amp;.txt",
+            "host", "1242.123456789", "new", "abc", TYPE_FILE, "True"])
+        property_string = file_property.get_property_string()
+        other_property = FileProperty()
+        other_property.set_property_string(property_string)
+        self.assertEquals(other_property.get_property_values(),
+                          file_property.get_property_values())
+        values = parse_property_string(property_string)
+        self.assertEquals(values[NAME_TAG], "<name>&amp;.txt")
+        self.assertEquals(parse_property_string("<name>a</name>"), None)
+
+    def test_create_checksum(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(directory, "file.bin")
+            f = open(filepath, "wb")
+            f.write("x" * 10000 + "\n" + "y" * 10000)
+            f.close()
+            expected = hashlib.md5("x" * 10000 + "\n" + "y" * 10000).hexdigest()
+            self.assertEquals(create_checksum(filepath), expected)
+            self.assertEquals(create_checksum(filepath, None, 4096), expected)
+            checksum = create_checksum(filepath, CHECKSUM_SHA1)
+            self.assertEquals(checksum.startswith("sha1:"), True)
+            self.assertEquals(get_checksum_algorithm(checksum), CHECKSUM_SHA1)
+            self.assertEquals(get_checksum_algorithm(expected), CHECKSUM_MD5)
+            self.assertEquals(create_checksum(filepath + ".missing"), None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_binary_meta(self):
+        directory = tempfile.mkdtemp()
+        try:
+            propertylist = []
+            for i in range(0, 50):
+                file_property = FileProperty()
+                file_property.set_property_values(["file-%i.txt" % i,
+                    "/dir/file-%i.txt" % i, "host", "1242.25", "existing",
+                    "abc%i" % i, TYPE_FILE, "True"])
+                propertylist.append(file_property)
+            self.assertEquals(save_property_file(directory, "meta", propertylist), True)
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals(len(loaded), 50)
+            for i in range(0, 50):
+                self.assertEquals(loaded[i].get_property_values(),
+                                  propertylist[i].get_property_values())
+            index = PropertyFileIndex(directory, "meta")
+            self.assertEquals(len(index.get_names()), 50)
+            self.assertEquals(index.get_property("file-7.txt").get_checksum(), "abc7")
+            self.assertEquals(index.get_property("missing.txt"), None)
+            index.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_duplicate_names(self):
+        directory = tempfile.mkdtemp()
+        try:
+            propertylist = []
+            for (name, checksum) in [ ("a.txt", "a1"), ("a.txt", "a2"),
+                                      (None, "n1"), (None, "n2") ]:
+                file_property = FileProperty()
+                if name:
+                    file_property.set_property_values([name, "/" + name,
+                        "host", "1242.25", "existing", checksum, TYPE_FILE,
+                        "False"])
+                file_property.set_checksum(checksum)
+                propertylist.append(file_property)
+            self.assertEquals(save_property_file(directory, "meta", propertylist), True)
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals([ p.get_checksum() for p in loaded ],
+                              [ "a1", "a2", "n1", "n2" ])
+            index = PropertyFileIndex(directory, "meta")
+            self.assertEquals(sorted(index.get_names()), [ "", "a.txt" ])
+            self.assertEquals(index.get_property("a.txt").get_checksum(), "a2")
+            index.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_legacy_meta(self):
+        directory = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(directory, "meta"), "w")
+            f.write(START_TAG)
+            f.write("<fileproperty><name>a.txt</name><path>/a.txt</path>")
+            f.write("<timestamp>12.5</timestamp></fileproperty>")
+            f.write(END_TAG)
+            f.close()
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals(len(loaded), 1)
+            self.assertEquals(loaded[0].get_name(), "a.txt")
+            save_property_file(directory, "meta", loaded)
+            f = open(os.path.join(directory, "meta"), "rb")
+            content = f.read()
+            f.close()
+            self.assertEquals(is_binary_meta(content), True)
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals(loaded[0].get_timestamp(), 12.5)
+        finally:
+            shutil.rmtree(directory)
+
+    def create_property(self, name, checksum):
+        file_property = FileProperty()
+        file_property.set_property_values([name, "/dir/" + name, "host",
+            "1242.25", "existing", checksum, TYPE_FILE, "True"])
+        return file_property
+
+    def test_meta_journal(self):
+        directory = tempfile.mkdtemp()
+        try:
+            save_property_file(directory, "meta",
+                               [ self.create_property("a.txt", "a1"),
+                                 self.create_property("b.txt", "b1") ])
+            self.assertEquals(os.path.exists(os.path.join(directory,
+                                                          META_TEMP_PREFIX + "meta")),
+                              False)
+            journal = MetaJournal(directory, "meta")
+            journal.append(self.create_property("a.txt", "a2"))
+            journal.append(self.create_property("c.txt", "c1"))
+            journal.remove("b.txt")
+            self.assertEquals(len(read_journal(directory, "meta")), 3)
+            journal.close()
+            self.assertEquals(has_journal(directory, "meta"), True)
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals([ (p.get_name(), p.get_checksum()) for p in loaded ],
+                              [ ("a.txt", "a2"), ("c.txt", "c1") ])
+            # a record torn by a crash ends the journal
+            path = journal.get_path()
+            f = open(path, "ab")
+            f.write(JOURNAL_RECORD_STRUCT.pack(JOURNAL_REMOVE, 0) + "\x05\x00")
+            f.close()
+            self.assertEquals(len(read_journal(directory, "meta")), 3)
+            self.assertEquals(journal.compact(loaded), True)
+            self.assertEquals(has_journal(directory, "meta"), False)
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals([ p.get_name() for p in loaded ], [ "a.txt", "c.txt" ])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_replay_duplicates(self):
+        directory = tempfile.mkdtemp()
+        try:
+            save_property_file(directory, "meta",
+                               [ self.create_property("a.txt", "a1"),
+                                 self.create_property("", "unnamed"),
+                                 self.create_property("a.txt", "a2"),
+                                 self.create_property("b.txt", "b1") ])
+            journal = MetaJournal(directory, "meta")
+            journal.append(self.create_property("b.txt", "b2"))
+            journal.remove("a.txt")
+            journal.append(self.create_property("a.txt", "a3"))
+            journal.close()
+            loaded = load_property_file(directory, "meta")
+            self.assertEquals([ (p.get_name(), p.get_checksum()) for p in loaded ],
+                              [ ("a.txt", "a1"), ("", "unnamed"),
+                                ("b.txt", "b2"), ("a.txt", "a3") ])
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from localproperty import *
@@ -22,6 +25,29 @@ class LocalPropertyTest(unittest.TestCase):
 				self.assertEquals(l > 0, True)
 		reader.save_meta()
 
+	def test_scan_directory(self):
+		directory = tempfile.mkdtemp()
+		try:
+			for name in [ "a.txt", ".hidden", META_FILENAME ]:
+				f = open(os.path.join(directory, name), "w")
+				f.write(name)
+				f.close()
+			os.mkdir(os.path.join(directory, "subdir"))
+			names = [ os.path.basename(p) for (p, s) in scan_directory(directory) ]
+			names.sort()
+			self.assertEquals(names, [ "a.txt", "subdir" ])
+			names = [ os.path.basename(p) for (p, s) in scan_directory(directory, HIDDEN_INCLUDE) ]
+			names.sort()
+			self.assertEquals(names, [ ".hidden", "a.txt", "subdir" ])
+			local = SyncLocal(directory)
+			local.read_directory(directory)
+			self.assertEquals(local.get_property("subdir").is_directory(), True)
+			current = local.get_property("a.txt").get_current()
+			self.assertEquals(current.get_path(), "/a.txt")
+			self.assertEquals(current.get_checksum(), create_checksum(os.path.join(directory, "a.txt")))
+		finally:
+			shutil.rmtree(directory)
+
 if __name__ == "__main__":
 	unittest.main()
 
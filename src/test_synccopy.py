@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from synccopy import *
+
+class SyncCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._src = os.path.join(self._path, "src")
+        self._dest = os.path.join(self._path, "dest")
+        self._content = "".join([chr(i % 251) for i in range(0, 100000)])
+        f = open(self._src, "wb")
+        f.write(self._content)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def read_file(self, path):
+        f = open(path, "rb")
+        content = f.read()
+        f.close()
+        return content
+
+    def test_copy_kernel(self):
+        for backend in [ COPY_FILE_RANGE, COPY_SENDFILE ]:
+            srcfile = open(self._src, "rb", 0)
+            destfile = open(self._dest, "wb", 0)
+            try:
+                result = copy_kernel(backend, srcfile, destfile,
+                                     len(self._content))
+            finally:
+                srcfile.close()
+                destfile.close()
+            if backend in kernel_functions:
+                self.assertEquals(result, True)
+                self.assertEquals(self.read_file(self._dest), self._content)
+            else:
+                self.assertEquals(result, False)
+
+    def test_copy_file(self):
+        stats = CopyStats()
+        backend = copy_file(self._src, self._dest)
+        stats.add(backend, len(self._content), "/src")
+        self.assertEquals(backend in COPY_BACKENDS, True)
+        self.assertEquals(self.read_file(self._dest), self._content)
+        self.assertEquals(stats.get_file_backend("/src"), backend)
+        self.assertEquals(stats.get_bytes(backend), len(self._content))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from syncdaemon import *
+
+class DirectoryScheduleTest(unittest.TestCase):
+
+    def test_schedule(self):
+        schedule = DirectorySchedule("/home/share", 100)
+        self.assertEquals(schedule.is_due(0), True)
+        self.assertEquals(schedule.take_work(0), None)
+        schedule.succeeded(0)
+        self.assertEquals(schedule.is_due(50), False)
+        self.assertEquals(schedule.get_delay(50), 50)
+        schedule.add_dirty_directories([ "/home/other", "/home/share/b",
+                                         "/home/share/a", "/home/sharex" ])
+        self.assertEquals(schedule.is_due(50), True)
+        self.assertEquals(schedule.take_work(50),
+                          [ "/home/share/a", "/home/share/b" ])
+        self.assertEquals(schedule.is_due(60), False)
+        self.assertEquals(schedule.is_due(100), True)
+        self.assertEquals(schedule.take_work(100), None)
+
+    def test_backoff(self):
+        schedule = DirectorySchedule("/home/share", 10000)
+        schedule.take_work(0)
+        schedule.add_dirty_directories([ "/home/share/a" ])
+        work = schedule.take_work(0)
+        schedule.failed(0, work)
+        self.assertEquals(schedule.get_failures(), 1)
+        self.assertEquals(schedule.is_due(BACKOFF_DELAY - 1), False)
+        self.assertEquals(schedule.is_due(BACKOFF_DELAY), True)
+        work = schedule.take_work(BACKOFF_DELAY)
+        self.assertEquals(work, [ "/home/share/a" ])
+        schedule.failed(BACKOFF_DELAY, work)
+        self.assertEquals(schedule.get_not_before(), 3 * BACKOFF_DELAY)
+        for count in range(20):
+            schedule.failed(0, work)
+        self.assertEquals(schedule.get_not_before(), BACKOFF_MAX_DELAY)
+        schedule.succeeded(0)
+        self.assertEquals(schedule.get_failures(), 0)
+        self.assertEquals(schedule.is_due(0), True)
+
+    def test_interval(self):
+        config = SyncConfig("DirectoryScheduleTest")
+        self.assertEquals(get_interval(config, "/home/share"), FULL_SYNC_INTERVAL)
+        config.set_value(CONFIG_KEY_INTERVAL, "600")
+        config.set_value(CONFIG_KEY_INTERVAL + ":/home/share", "60")
+        self.assertEquals(get_interval(config, "/home/share"), 60)
+        self.assertEquals(get_interval(config, "/home/other"), 600)
+        self.assertEquals(get_daemon_concurrency(config), 1)
+
+class DaemonSyncThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._server = os.path.join(self._path, "server")
+        self._root = os.path.join(self._path, "client")
+        os.mkdir(self._server)
+        self._directories = []
+        for name in [ "a", "b" ]:
+            directory = os.path.join(self._root, name)
+            os.makedirs(directory)
+            self._directories.append(directory)
+        self._config = SyncConfig("DaemonSyncThreadTest")
+        self._config.set_value(CONFIG_KEY_TYPE, CONFIG_VALUE_FILE)
+        self._config.set_value(CONFIG_KEY_SERVER_DIRECTORY, self._server)
+        self._config.set_value(CONFIG_KEY_DAEMON_CONCURRENCY, "2")
+        self._thread = DaemonSyncThread(self._config, self._directories,
+                                        self._root)
+        self._thread.init_journal()
+        self._thread.init_schedules()
+
+    def tearDown(self):
+        self._thread.get_journal().close()
+        shutil.rmtree(self._path)
+
+    def create_file(self, path, content):
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+
+    def dispatch(self, now):
+        threads = self._thread.dispatch(now)
+        self._thread.wait_syncs()
+        return len(threads)
+
+    def test_dispatch(self):
+        self.create_file(os.path.join(self._directories[0], "file.txt"), "a")
+        self.assertEquals(self.dispatch(0), 0)
+        self._thread.stop_pausing()
+        self.assertEquals(self.dispatch(0), 2)
+        self.assertEquals(os.path.exists(os.path.join(self._server,
+                                                      create_hash("/a/file.txt"))), True)
+        self.assertEquals(self.dispatch(1), 0)
+        self._thread.start_pausing()
+        self.assertEquals(self._thread.is_pausing(), True)
+        self.assertEquals(self.dispatch(FULL_SYNC_INTERVAL), 0)
+        self._thread.stop_pausing()
+        self.assertEquals(self.dispatch(FULL_SYNC_INTERVAL), 2)
+
+    def test_failure(self):
+        synchronize = self._thread.synchronize
+        def failing_synchronize(directory, dirtydirectories = None):
+            if directory == self._directories[1]:
+                raise IOError("server not available")
+            return synchronize(directory, dirtydirectories)
+        self._thread.synchronize = failing_synchronize
+        self._thread.stop_pausing()
+        self.dispatch(0)
+        schedules = self._thread.get_schedules()
+        self.assertEquals(schedules[0].get_failures(), 0)
+        self.assertEquals(schedules[1].get_failures(), 1)
+        self.assertEquals(self.dispatch(1), 0)
+        status = self._thread.get_status(1)
+        self.assertEquals(status["directories"][1]["last_error"],
+                          "server not available")
+        self.assertEquals(status["directories"][0]["last_sync"] != None, True)
+        self._thread.synchronize = synchronize
+        self.assertEquals(self._thread.sync_now(self._directories[1] + "/"), True)
+        self._thread.wait_syncs()
+        self.assertEquals(schedules[1].get_failures(), 0)
+
+    def test_stop_before_start(self):
+        self._thread.stop()
+        self._thread.start()
+        self.assertEquals(self._thread.is_running(), False)
+
+    def test_control(self):
+        path = os.path.join(self._path, "control.sock")
+        listener = DaemonListenerThread(self._thread, path)
+        listener.start()
+        client = DaemonClient(path)
+        try:
+            self.assertEquals(client.is_running(), True)
+            self.assertEquals(client.pause()["result"], RESULT_OK)
+            status = client.status()
+            self.assertEquals(status["state"], "pausing")
+            self.assertEquals([ entry["directory"] for entry in status["directories"] ],
+                              self._directories)
+            self.assertEquals(client.sync_now("/unknown")["result"], RESULT_ERROR)
+            self.assertEquals(client.send("unknown")["result"], RESULT_ERROR)
+            self.assertEquals(client.resume()["result"], RESULT_OK)
+            self._thread.wait_syncs()
+            self.assertEquals(client.status()["directories"][0]["last_sync"] != None,
+                              True)
+        finally:
+            client.stop()
+            listener.join()
+        self.assertEquals(os.path.exists(path), False)
+        self.assertEquals(client.is_running(), False)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from syncdebug import *
+
+class FormatCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count = self.count + 1
+        return "formatted"
+
+class DebugTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._path = tempfile.mkdtemp()
+        os.chdir(self._path)
+
+    def tearDown(self):
+        set_debug(False)
+        close_log_file()
+        os.chdir(self._cwd)
+        shutil.rmtree(self._path)
+
+    def read_log(self):
+        f = open(get_log_filename())
+        content = f.read()
+        f.close()
+        return content
+
+    def test_levels(self):
+        counter = FormatCounter()
+        set_debug(False)
+        debug("value %s", counter)
+        debug_error("error %s", counter)
+        self.assertEquals(counter.count, 0)
+        set_debug(True, DEBUG_LEVEL_INFO)
+        self.assertEquals(is_debug_enabled(DEBUG_LEVEL_DETAIL), False)
+        self.assertEquals(is_debug_enabled(DEBUG_LEVEL_ERROR), True)
+        debug_detail("detail %s", counter)
+        debug_value("detail", counter, DEBUG_LEVEL_DETAIL)
+        self.assertEquals(counter.count, 0)
+        debug("value %s", counter)
+        debug("100%")
+        self.assertEquals(counter.count, 1)
+        close_log_file()
+        self.assertEquals(self.read_log(), "[INFO] value formatted\n[INFO] 100%\n")
+
+    def test_buffering(self):
+        set_debug(True, DEBUG_LEVEL_DETAIL)
+        debug("first")
+        writer = get_log_writer()
+        writer._lastflush = time.time()
+        debug_detail("second")
+        self.assertEquals(self.read_log(), "")
+        debug_error("third")
+        self.assertEquals(self.read_log(),
+                          "[INFO] first\n[DETAIL] second\n[ERROR] third\n")
+        self.assertEquals(get_log_writer() is writer, True)
+
+    def test_flush_timer(self):
+        writer = LogWriter(open(get_log_filename(), "a", LOG_BUFFER_SIZE), 0.05)
+        writer.write("[INFO] idle\n")
+        self.assertEquals(self.read_log(), "")
+        time.sleep(0.5)
+        self.assertEquals(self.read_log(), "[INFO] idle\n")
+        writer.close()
+
+if __name__ == "__main__":
+    unittest.main()
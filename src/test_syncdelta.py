@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import random
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from syncdelta import *
+
+class SyncDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._random = random.Random(42)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def create_content(self, size):
+        return "".join([chr(self._random.randint(0, 255)) for i in range(size)])
+
+    def write_file(self, name, content):
+        filepath = os.path.join(self._path, name)
+        f = open(filepath, "wb")
+        f.write(content)
+        f.close()
+        return filepath
+
+    def read_file(self, filepath):
+        f = open(filepath, "rb")
+        content = f.read()
+        f.close()
+        return content
+
+    def sync(self, old, new, blocksize = 1024):
+        basepath = self.write_file("base", old)
+        srcpath = self.write_file("src", new)
+        sigpath = os.path.join(self._path, "base.sig")
+        create_signature(basepath, blocksize).save(sigpath)
+        signature = load_signature(sigpath)
+        delta = create_delta(srcpath, signature)
+        written = apply_delta(srcpath, basepath, delta, signature)
+        self.assertEquals(self.read_file(basepath), new)
+        return (delta, written)
+
+    def test_roll_weak_checksum(self):
+        data = self.create_content(100)
+        weak = create_weak_checksum(data[0:32])
+        for pos in range(0, 60):
+            weak = roll_weak_checksum(weak, 32, ord(data[pos]), ord(data[pos + 32]))
+            self.assertEquals(weak, create_weak_checksum(data[pos + 1:pos + 33]))
+
+    def test_changed_block(self):
+        old = self.create_content(10 * 1024 + 100)
+        new = old[:3000] + "changed" + old[3007:]
+        (delta, written) = self.sync(old, new)
+        self.assertEquals(written, 1024)
+        self.assertEquals(is_in_place_delta(delta, 1024), True)
+
+    def test_inserted_data(self):
+        old = self.create_content(10 * 1024)
+        new = old[:5000] + "inserted" + old[5000:]
+        (delta, written) = self.sync(old, new)
+        self.assertEquals(get_delta_size(delta) < 2048, True)
+
+    def test_appended_and_truncated(self):
+        old = self.create_content(5000)
+        self.sync(old, old + self.create_content(3000))
+        self.sync(old, old[:2500])
+        self.sync(old, "")
+        self.sync("", old)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from syncjournal import *
+
+class ChangeJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._journal = ChangeJournal(HIDDEN_SKIP, 1.0, 5.0)
+
+    def tearDown(self):
+        self._journal.close()
+        shutil.rmtree(self._path)
+
+    def create_file(self, path, content):
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+
+    def poll(self):
+        while self._journal.poll(0.2) > 0:
+            pass
+
+    def test_changes(self):
+        if not self._journal.is_available():
+            return
+        subdir = os.path.join(self._path, "sub")
+        os.mkdir(subdir)
+        self._journal.add_directory(self._path)
+        self.create_file(os.path.join(subdir, "file.txt"), "content")
+        self.create_file(os.path.join(self._path, META_FILENAME), "meta")
+        self.create_file(os.path.join(self._path, ".hidden"), "hidden")
+        self.poll()
+        now = time.time()
+        self.assertEquals(self._journal.take_dirty_directories(now), [])
+        self.assertEquals(self._journal.take_dirty_directories(now + 1.0), [ subdir ])
+        self.assertEquals(self._journal.take_dirty_directories(now + 1.0), [])
+        newdir = os.path.join(subdir, "new")
+        os.mkdir(newdir)
+        self.poll()
+        self.create_file(os.path.join(newdir, "file.txt"), "content")
+        self.poll()
+        self.assertEquals(self._journal.take_dirty_directories(time.time() + 1.0),
+                          [ subdir, newdir ])
+        os.rename(subdir, os.path.join(self._path, "moved"))
+        self.poll()
+        self.assertEquals(self._journal.take_dirty_directories(time.time() + 1.0),
+                          [ self._path, os.path.join(self._path, "moved"),
+                            os.path.join(self._path, "moved", "new") ])
+        self.assertEquals(self._journal.take_full_rescan(), False)
+
+    def test_coalesce(self):
+        self._journal.mark_dirty("/a", 100.0)
+        self._journal.mark_dirty("/b", 100.5)
+        self.assertEquals(self._journal.take_dirty_directories(101.0), [])
+        self._journal.mark_dirty("/c", 104.0)
+        self._journal.mark_dirty("/d", 104.9)
+        self.assertEquals(self._journal.take_dirty_directories(105.0),
+                          [ "/a", "/b", "/c", "/d" ])
+
+    def test_server_directory(self):
+        if not self._journal.is_available():
+            return
+        root = os.path.join(self._path, "root")
+        server = os.path.join(self._path, "server")
+        os.makedirs(os.path.join(root, "share"))
+        os.mkdir(server)
+        self._journal.add_server_directory(server, root)
+        self.create_file(os.path.join(server, ":::share"), "meta")
+        self.create_file(os.path.join(server, ":::share:::new"), "meta")
+        self.create_file(os.path.join(server, "syncsrvsalt"), "salt")
+        self.poll()
+        self.assertEquals(self._journal.take_dirty_directories(time.time() + 1.0),
+                          [ os.path.join(root, "share") ])
+
+    def test_overflow(self):
+        self._journal.handle_event(-1, IN_Q_OVERFLOW, "")
+        self.assertEquals(self._journal.take_full_rescan(), True)
+        self.assertEquals(self._journal.take_full_rescan(), False)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,379 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from syncconfig import *
+from synccrypt import *
+from syncprocessor import *
+
+class TreeSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._server = os.path.join(self._path, "server")
+        os.mkdir(self._server)
+        self._config = SyncConfig("TreeSyncTest")
+        self._config.set_value(CONFIG_KEY_TYPE, CONFIG_VALUE_FILE)
+        self._config.set_value(CONFIG_KEY_SERVER_DIRECTORY, self._server)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def create_file(self, path, content):
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+
+    def create_client(self, name):
+        root = os.path.join(self._path, name)
+        os.makedirs(os.path.join(root, "share"))
+        return root
+
+    def sync_tree(self, root, concurrency = 1):
+        processor = TreeSyncProcessor(self._config, root, os.path.join(root, "share"))
+        processor.set_concurrency(concurrency)
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        self.assertEquals(processor.get_errors(), [])
+        processor.shutdown()
+        return processor
+
+    def test_tree_sync(self):
+        root1 = self.create_client("client1")
+        os.makedirs(os.path.join(root1, "share", "a", "b"))
+        self.create_file(os.path.join(root1, "share", "top.txt"), "top")
+        self.create_file(os.path.join(root1, "share", "a", "b", "deep.txt"), "deep")
+        processor = self.sync_tree(root1)
+        copystats = processor.get_processors()[0].get_server().get_copy_stats()
+        self.assertEquals(copystats.get_file_backend("/share/top.txt") in COPY_BACKENDS, True)
+        self.assertEquals(len(processor.get_processors()), 3)
+        self.assertEquals(processor.get_action_count(), 4)
+        timings = processor.get_timings()
+        self.assertEquals(sorted(timings.keys()), sorted(TIMING_PHASES))
+        self.assertEquals(min(timings.values()) >= 0, True)
+        stats = processor.get_stats()
+        self.assertEquals(stats.get_action_files("upload"), 4)
+        self.assertEquals(stats.get_action_bytes("upload"), 7)
+        self.assertEquals(stats.get_count(STATS_FILES_SCANNED), 4)
+        self.assertEquals(stats.get_count(STATS_FILES_HASHED), 2)
+        backend = copystats.get_file_backend("/share/top.txt")
+        self.assertEquals(stats.get_count(STATS_COPY_FILES % backend) > 0, True)
+        deep = os.path.join(self._server, create_hash("/share/a/b/deep.txt"))
+        self.assertEquals(os.path.exists(deep), True)
+        self.assertEquals(os.path.exists(os.path.join(root1, "share", "a", "b",
+                                                      META_FILENAME)), True)
+        root2 = self.create_client("client2")
+        self.sync_tree(root2)
+        f = open(os.path.join(root2, "share", "a", "b", "deep.txt"))
+        self.assertEquals(f.read(), "deep")
+        f.close()
+        processor = self.sync_tree(root1)
+        self.assertEquals(processor.get_action_count(), 0)
+
+    def test_interrupted_sync(self):
+        root1 = self.create_client("client1")
+        for name in [ "a.txt", "b.txt", "c.txt" ]:
+            self.create_file(os.path.join(root1, "share", name), name)
+        processor = TreeSyncProcessor(self._config, root1,
+                                      os.path.join(root1, "share"))
+        processor.startup()
+        processor.process_next_action()
+        # the sync is interrupted before the meta data is saved
+        metaname = create_hash("/share")
+        self.assertEquals(has_journal(self._server, metaname), True)
+        processor = self.sync_tree(root1)
+        self.assertEquals(processor.get_action_count(), 2)
+        self.assertEquals(has_journal(self._server, metaname), False)
+        self.assertEquals(len(load_property_file(self._server, metaname)), 3)
+        self.assertEquals(self.sync_tree(root1).get_action_count(), 0)
+        root2 = self.create_client("client2")
+        processor = TreeSyncProcessor(self._config, root2,
+                                      os.path.join(root2, "share"))
+        processor.startup()
+        processor.process_next_action()
+        self.assertEquals(has_journal(os.path.join(root2, "share"), META_FILENAME),
+                          True)
+        self.assertEquals(self.sync_tree(root2).get_action_count(), 2)
+        self.assertEquals(self.sync_tree(root2).get_action_count(), 0)
+
+    def test_directory_mtime(self):
+        root1 = self.create_client("client1")
+        subdir = os.path.join(root1, "share", "a")
+        os.mkdir(subdir)
+        self.create_file(os.path.join(subdir, "file.txt"), "file")
+        self.sync_tree(root1)
+        # adding files to a directory changes its mtime, but the content
+        # of the directory is synchronized by its own processor
+        mtime = os.path.getmtime(subdir) + 10
+        os.utime(subdir, (mtime, mtime))
+        self.assertEquals(self.sync_tree(root1).get_action_count(), 0)
+        local = FileProperty()
+        local.scan(subdir, root1)
+        server = FileProperty()
+        server.set_values(local)
+        action = ActionEntry(local, server, ACTION_UPLOAD)
+        self.assertEquals(action.is_obsolete(), True)
+        server.set_state(STATE_DELETED)
+        self.assertEquals(action.is_obsolete(), False)
+
+    def test_dirty_directories(self):
+        root1 = self.create_client("client1")
+        os.makedirs(os.path.join(root1, "share", "a", "b"))
+        os.makedirs(os.path.join(root1, "share", "c"))
+        self.create_file(os.path.join(root1, "share", "a", "b", "deep.txt"), "deep")
+        self.create_file(os.path.join(root1, "share", "c", "other.txt"), "other")
+        self.sync_tree(root1)
+        deep = os.path.join(root1, "share", "a", "b", "deep.txt")
+        self.create_file(deep, "changed")
+        os.utime(deep, (os.path.getmtime(deep) + 10, os.path.getmtime(deep) + 10))
+        os.makedirs(os.path.join(root1, "share", "a", "b", "new"))
+        self.create_file(os.path.join(root1, "share", "a", "b", "new", "new.txt"), "new")
+        metapath = os.path.join(self._server, create_hash("/share/c"))
+        metatime = int(os.path.getmtime(metapath)) - 100
+        os.utime(metapath, (metatime, metatime))
+        processor = TreeSyncProcessor(self._config, root1, os.path.join(root1, "share"))
+        processor.set_dirty_directories([ os.path.join(root1, "share", "a", "b"),
+                                          os.path.join(root1, "share", "gone") ])
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        processor.shutdown()
+        self.assertEquals(len(processor.get_processors()), 2)
+        self.assertEquals(processor.get_action_count(), 3)
+        self.assertEquals(os.path.getmtime(metapath), metatime)
+        self.assertEquals(self.sync_tree(root1).get_action_count(), 0)
+        self.assertEquals(os.path.getmtime(metapath), metatime)
+
+    def test_parallel_sync(self):
+        root1 = self.create_client("client1")
+        for i in range(0, 5):
+            subdir = os.path.join(root1, "share", "dir-%i" % i)
+            os.mkdir(subdir)
+            for j in range(0, 10):
+                self.create_file(os.path.join(subdir, "file-%i.txt" % j), "%i-%i" % (i, j))
+        processor = self.sync_tree(root1, 4)
+        self.assertEquals(processor.get_action_count(), 55)
+        root2 = self.create_client("client2")
+        processor = self.sync_tree(root2, 4)
+        self.assertEquals(processor.get_action_count(), 55)
+        for i in range(0, 5):
+            for j in range(0, 10):
+                f = open(os.path.join(root2, "share", "dir-%i" % i, "file-%i.txt" % j))
+                self.assertEquals(f.read(), "%i-%i" % (i, j))
+                f.close()
+        self.assertEquals(self.sync_tree(root1, 4).get_action_count(), 0)
+        self.assertEquals(self.sync_tree(root2, 4).get_action_count(), 0)
+
+    def test_failed_action(self):
+        fileproperty = FileProperty()
+        fileproperty.set_property_values(["a.txt", "/a.txt", "host", "1.0",
+                                          STATE_NEW, "abc", TYPE_FILE, "False"])
+        action = ActionEntry(fileproperty, None, ACTION_UPLOAD)
+        def fail(action):
+            raise IOError("server not available")
+        for concurrency in [ 1, 2 ]:
+            errors = []
+            processed = []
+            executor = ActionExecutor(concurrency)
+            # a failed action doesn't stop the following actions
+            executor.process(action, fail, errors.append)
+            executor.process(action, processed.append, errors.append)
+            executor.stop()
+            self.assertEquals(len(errors), 1)
+            self.assertEquals("server not available" in errors[0], True)
+            self.assertEquals(processed, [ action ])
+
+    def test_delta_upload(self):
+        self._config.set_value(CONFIG_KEY_DELTA, CONFIG_VALUE_TRUE)
+        self._config.set_value(CONFIG_KEY_DELTA_BLOCKSIZE, "1024")
+        root1 = self.create_client("client1")
+        filepath = os.path.join(root1, "share", "big.bin")
+        content = "".join([chr(i % 251) for i in range(0, 20000)])
+        self.create_file(filepath, content)
+        self.sync_tree(root1)
+        serverpath = os.path.join(self._server, create_hash("/share/big.bin"))
+        sigpath = os.path.join(self._server, SIGNATURE_PREFIX + create_hash("/share/big.bin"))
+        self.assertEquals(os.path.exists(sigpath), True)
+        content = content[:10000] + "changed" + content[10007:]
+        self.create_file(filepath, content)
+        os.utime(filepath, (os.path.getmtime(filepath) + 10, os.path.getmtime(filepath) + 10))
+        processor = self.sync_tree(root1)
+        self.assertEquals(processor.get_action_count(), 1)
+        f = open(serverpath, "rb")
+        self.assertEquals(f.read(), content)
+        f.close()
+
+    def test_move(self):
+        root1 = self.create_client("client1")
+        os.makedirs(os.path.join(root1, "share", "a"))
+        os.makedirs(os.path.join(root1, "share", "b"))
+        self.create_file(os.path.join(root1, "share", "a", "old.txt"), "renamed")
+        self.create_file(os.path.join(root1, "share", "a", "moved.txt"), "moved")
+        self.sync_tree(root1)
+        root2 = self.create_client("client2")
+        self.sync_tree(root2)
+        renamed = os.stat(os.path.join(root2, "share", "a", "old.txt")).st_ino
+        moved = os.stat(os.path.join(root2, "share", "a", "moved.txt")).st_ino
+        os.rename(os.path.join(root1, "share", "a", "old.txt"),
+                  os.path.join(root1, "share", "a", "new.txt"))
+        os.rename(os.path.join(root1, "share", "a", "moved.txt"),
+                  os.path.join(root1, "share", "b", "moved.txt"))
+        processor = self.sync_tree(root1)
+        self.assertEquals(processor.get_action_count(), 2)
+        copystats = processor.get_processors()[0].get_server().get_copy_stats()
+        self.assertEquals(copystats.get_backends(), [])
+        self.assertEquals(os.path.exists(os.path.join(self._server, create_hash("/share/a/new.txt"))), True)
+        self.assertEquals(os.path.exists(os.path.join(self._server, create_hash("/share/a/old.txt"))), False)
+        processor = self.sync_tree(root2)
+        self.assertEquals(processor.get_action_count(), 2)
+        for subprocessor in processor.get_processors():
+            for action in subprocessor.get_actions():
+                self.assertEquals(action.get_action(), ACTION_MOVE)
+        self.assertEquals(os.stat(os.path.join(root2, "share", "a", "new.txt")).st_ino, renamed)
+        self.assertEquals(os.stat(os.path.join(root2, "share", "b", "moved.txt")).st_ino, moved)
+        self.assertEquals(os.path.exists(os.path.join(root2, "share", "a", "old.txt")), False)
+        self.assertEquals(self.sync_tree(root1).get_action_count(), 0)
+        self.assertEquals(self.sync_tree(root2).get_action_count(), 0)
+
+    def test_move_fallback(self):
+        root1 = self.create_client("client1")
+        self.create_file(os.path.join(root1, "share", "old.txt"), "renamed")
+        self.sync_tree(root1)
+        os.rename(os.path.join(root1, "share", "old.txt"),
+                  os.path.join(root1, "share", "new.txt"))
+        move = SyncFileServer.move
+        SyncFileServer.move = lambda self, fileproperty, srcproperty, srcserver: False
+        try:
+            stats = self.sync_tree(root1).get_stats()
+        finally:
+            SyncFileServer.move = move
+        self.assertEquals(stats.get_actions(), [ "move" ])
+        self.assertEquals(stats.get_files(), 1)
+        self.assertEquals(os.path.exists(os.path.join(self._server, create_hash("/share/new.txt"))), True)
+        self.assertEquals(os.path.exists(os.path.join(self._server, create_hash("/share/old.txt"))), False)
+        self.assertEquals(self.sync_tree(root1).get_action_count(), 0)
+
+    def test_content_store(self):
+        self._config.set_value(CONFIG_KEY_STORE, CONFIG_VALUE_CONTENT)
+        root1 = self.create_client("client1")
+        os.makedirs(os.path.join(root1, "share", "a"))
+        os.makedirs(os.path.join(root1, "share", "b"))
+        self.create_file(os.path.join(root1, "share", "a", "file.txt"), "same")
+        self.create_file(os.path.join(root1, "share", "b", "copy.txt"), "same")
+        processor = self.sync_tree(root1)
+        copystats = processor.get_processors()[0].get_server().get_copy_stats()
+        self.assertEquals(copystats.get_files(COPY_DEDUP), 1)
+        blobs = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self._server, OBJECT_DIRECTORY)):
+            blobs.extend(filenames)
+        self.assertEquals(len(blobs), 1)
+        self.assertEquals(os.path.exists(os.path.join(self._server, create_hash("/share/a/file.txt"))), False)
+        os.rename(os.path.join(root1, "share", "a"), os.path.join(root1, "share", "c"))
+        processor = self.sync_tree(root1)
+        copystats = processor.get_processors()[0].get_server().get_copy_stats()
+        self.assertEquals(copystats.get_file_backend("/share/c/file.txt"), COPY_DEDUP)
+        self.assertEquals(copystats.get_backends(), [ COPY_DEDUP ])
+        root2 = self.create_client("client2")
+        self.sync_tree(root2)
+        f = open(os.path.join(root2, "share", "c", "file.txt"))
+        self.assertEquals(f.read(), "same")
+        f.close()
+        self.assertEquals(os.path.exists(os.path.join(root2, "share", "a", "file.txt")), False)
+
+    def list_blobs(self):
+        result = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self._server, OBJECT_DIRECTORY)):
+            for filename in filenames:
+                result.append(os.path.join(dirpath, filename))
+        return result
+
+    def backdate_blobs(self):
+        mtime = time.time() - BLOB_GRACE_SECONDS - 10
+        for blobpath in self.list_blobs():
+            os.utime(blobpath, (mtime, mtime))
+
+    def test_collect_blobs(self):
+        self._config.set_value(CONFIG_KEY_STORE, CONFIG_VALUE_CONTENT)
+        root1 = self.create_client("client1")
+        os.makedirs(os.path.join(root1, "share", "a"))
+        os.makedirs(os.path.join(root1, "share", "b"))
+        self.create_file(os.path.join(root1, "share", "a", "file.txt"), "one")
+        self.create_file(os.path.join(root1, "share", "b", "copy.txt"), "one")
+        self.create_file(os.path.join(root1, "share", "other.txt"), "two")
+        self.sync_tree(root1)
+        self.assertEquals(len(self.list_blobs()), 2)
+        self.backdate_blobs()
+        # the blob is still referenced by the file in the other directory
+        os.remove(os.path.join(root1, "share", "b", "copy.txt"))
+        self.sync_tree(root1)
+        self.assertEquals(len(self.list_blobs()), 2)
+        os.remove(os.path.join(root1, "share", "a", "file.txt"))
+        other = os.path.join(root1, "share", "other.txt")
+        self.create_file(other, "three")
+        mtime = os.path.getmtime(other) + 10
+        os.utime(other, (mtime, mtime))
+        self.sync_tree(root1)
+        blobs = self.list_blobs()
+        self.assertEquals(len(blobs), 1)
+        f = open(blobs[0])
+        self.assertEquals(f.read(), "three")
+        f.close()
+        root2 = self.create_client("client2")
+        self.sync_tree(root2)
+        f = open(os.path.join(root2, "share", "other.txt"))
+        self.assertEquals(f.read(), "three")
+        f.close()
+
+    def test_encrypted_sync(self):
+        root1 = self.create_client("client1")
+        self.create_file(os.path.join(root1, "share", "secret.txt"), "secret content")
+        synccrypt = SyncCrypt()
+        synccrypt.set_password("password")
+        processor = TreeSyncProcessor(self._config, root1, os.path.join(root1, "share"))
+        processor.set_encryption(synccrypt, True)
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        processor.shutdown()
+        serverpath = os.path.join(self._server, create_hash("/share/secret.txt"))
+        f = open(serverpath, "rb")
+        self.assertNotEquals(f.read(), "secret content")
+        f.close()
+        self.assertEquals(os.listdir(os.path.join(root1, "share")).count("secret.txt" + ENCRYPTION_EXTENSION), 0)
+        self.assertEquals(os.path.exists(os.path.join(self._server, SERVER_SALT_FILENAME)), True)
+        root2 = self.create_client("client2")
+        processor = TreeSyncProcessor(self._config, root2, os.path.join(root2, "share"))
+        processor.set_encryption(synccrypt)
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        processor.shutdown()
+        self.assertEquals(os.listdir(os.path.join(root2, "share")).count("secret.txt" + ENCRYPTION_EXTENSION), 0)
+        f = open(os.path.join(root2, "share", "secret.txt"))
+        self.assertEquals(f.read(), "secret content")
+        f.close()
+
+    def test_invalid_salt(self):
+        root1 = self.create_client("client1")
+        self.create_file(os.path.join(root1, "share", "secret.txt"), "secret content")
+        self.create_file(os.path.join(self._server, SERVER_SALT_FILENAME), "")
+        synccrypt = SyncCrypt()
+        synccrypt.set_password("password")
+        processor = TreeSyncProcessor(self._config, root1, os.path.join(root1, "share"))
+        processor.set_encryption(synccrypt, True)
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        processor.shutdown()
+        self.assertNotEquals(processor.get_errors(), [])
+        serverpath = os.path.join(self._server, create_hash("/share/secret.txt"))
+        self.assertEquals(os.path.exists(serverpath), False)
+
+if __name__ == "__main__":
+    unittest.main()
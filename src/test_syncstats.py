@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from syncstats import *
+
+class SyncStatsTest(unittest.TestCase):
+
+    def test_format_bytes(self):
+        self.assertEquals(format_bytes(0), "0 B")
+        self.assertEquals(format_bytes(1023), "1023 B")
+        self.assertEquals(format_bytes(1536), "1.5 KB")
+        self.assertEquals(format_bytes(3 * 1024 * 1024), "3.0 MB")
+
+    def test_stats(self):
+        stats = SyncStats()
+        stats.add_time(STATS_SCAN, 1.5)
+        stats.add_time(STATS_SCAN, 0.5)
+        stats.add_count(STATS_FILES_SCANNED, 3)
+        stats.add_action("upload", 100, 1.0)
+        stats.add_action("upload", 50, 1.0)
+        stats.add_action("delete-server", 0, 0.5)
+        stats.add_copy("reflink", 100)
+        self.assertEquals(stats.get_time(STATS_SCAN), 2.0)
+        self.assertEquals(stats.get_time(STATS_HASH), 0.0)
+        self.assertEquals(stats.get_count(STATS_FILES_SCANNED), 3)
+        self.assertEquals(stats.get_actions(), [ "delete-server", "upload" ])
+        self.assertEquals(stats.get_action_files("upload"), 2)
+        self.assertEquals(stats.get_action_bytes("upload"), 150)
+        self.assertEquals(stats.get_files(), 3)
+        self.assertEquals(stats.get_bytes(), 150)
+        self.assertEquals(stats.get_count(STATS_COPY_FILES % "reflink"), 1)
+        self.assertEquals(stats.get_count(STATS_COPY_BYTES % "reflink"), 100)
+        output = StringIO()
+        stats.write_text(output)
+        self.assertEquals("upload" in output.getvalue(), True)
+        self.assertEquals("copy-reflink-files" in output.getvalue(), True)
+        path = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(path, "stats.json")
+            stats.save_json(filepath)
+            f = open(filepath)
+            content = json.load(f)
+            f.close()
+        finally:
+            shutil.rmtree(path)
+        self.assertEquals(content["actions"]["upload"]["bytes"], 150)
+        self.assertEquals(content["times"][STATS_SCAN], 2.0)
+        self.assertEquals(content["files"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
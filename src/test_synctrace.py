@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from syncconfig import *
+from syncprocessor import *
+from synctrace import *
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._server = os.path.join(self._path, "server")
+        self._root = os.path.join(self._path, "client")
+        self._trace = os.path.join(self._path, "ssync.trace")
+        os.mkdir(self._server)
+        os.makedirs(os.path.join(self._root, "share"))
+        self._config = SyncConfig("TraceTest")
+        self._config.set_value(CONFIG_KEY_TYPE, CONFIG_VALUE_FILE)
+        self._config.set_value(CONFIG_KEY_SERVER_DIRECTORY, self._server)
+
+    def tearDown(self):
+        set_trace_file(None)
+        shutil.rmtree(self._path)
+
+    def create_file(self, path, content):
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+
+    def test_trace(self):
+        for name in [ "a.txt", "b.txt" ]:
+            self.create_file(os.path.join(self._root, "share", name), name)
+        set_trace_file(self._trace)
+        self.assertEquals(is_trace_enabled(), True)
+        processor = TreeSyncProcessor(self._config, self._root,
+                                      os.path.join(self._root, "share"))
+        processor.startup()
+        while processor.has_open_actions():
+            processor.process_next_action()
+        processor.shutdown()
+        set_trace_file(None)
+        self.assertEquals(is_trace_enabled(), False)
+        summary = analyze_trace(self._trace)
+        self.assertEquals(summary["mutations"], 2)
+        self.assertEquals(summary["actions"]["upload"][0], 2)
+        self.assertEquals(sorted(summary["phases"].keys()), sorted(TIMING_PHASES))
+        self.assertEquals(summary["snapshots"] >= 2, True)
+        self.assertEquals(sorted([ path for (path, values) in summary["hotfiles"] ]),
+                          [ "/share/a.txt", "/share/b.txt" ])
+        for (path, (count, seconds, mutationseconds)) in summary["hotfiles"]:
+            # the mutation happens within the upload
+            self.assertEquals(count, 1)
+            self.assertEquals(seconds >= mutationseconds, True)
+        self.assertEquals(summary["mutation_seconds"] <=
+                          summary["actions"]["upload"][1], True)
+        output = StringIO()
+        format_summary(summary, output)
+        self.assertEquals("hot files:" in output.getvalue(), True)
+
+    def test_mutation_seconds(self):
+        set_trace_file(self._trace)
+        trace_action("/share", "a.txt", "upload", 1, 2.0)
+        trace_mutation("/share", "a.txt", None, "new", 0.5)
+        trace_mutation("/share", "b.txt", None, "new", 1.0)
+        set_trace_file(None)
+        summary = analyze_trace(self._trace)
+        self.assertEquals(summary["actions"]["upload"], [ 1, 2.0 ])
+        self.assertEquals(summary["mutation_seconds"], 1.5)
+        self.assertEquals(summary["hotfiles"],
+                          [ ("/share/a.txt", [ 1, 2.0, 0.5 ]),
+                            ("/share/b.txt", [ 0, 0.0, 1.0 ]) ])
+
+    def test_snapshot_interval(self):
+        set_trace_file(self._trace)
+        trace_snapshot("/share", [])
+        trace_snapshot("/share", [])
+        trace_snapshot("/other", [])
+        trace_snapshot("/share", [], True)
+        set_trace_file(None)
+        self.assertEquals(analyze_trace(self._trace)["snapshots"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import os
 import os.path
 
 def check_directory(dirpath):
@@ -31,6 +32,26 @@ def check_directory(dirpath):
         result = False
     return result
 
+def fsync_directory(dirpath):
+    """
+    writes the entries of a directory to disk, so a renamed file
+    survives a crash
+    Parameters:
+    - dirpath
+      full path of the directory
+    """
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # not supported by every filesystem
+        pass
+    finally:
+        os.close(fd)
+
 def check_file(filepath):
     """
     checks if a file exists